@@ -0,0 +1,25 @@
+from flask.views import MethodView
+from flask_smorest import Blueprint, abort
+from app.model.exeptions import SetpointsOperationError
+from app.manage_app.logging import processes_logger
+from app.api.changelog.schemas import ChangeLogQuerySchema, ChangeLogPageResponseSchema
+from app.model.changelog import get_changelog_page
+from app.api.serialization import fast_response
+
+blp = Blueprint(name="changelog",
+                import_name="changelog",
+                url_prefix="/api/processing/changelog",
+                description="Change log (audit history)")
+
+
+@blp.route("")
+class ChangeLogResource(MethodView):
+    @blp.arguments(ChangeLogQuerySchema, location="query")
+    @blp.response(200, ChangeLogPageResponseSchema)
+    def get(self, args):
+        """Return a page of change-log rows, newest first"""
+        try:
+            return fast_response(ChangeLogPageResponseSchema, get_changelog_page(**args))
+        except SetpointsOperationError as e:
+            processes_logger.error(str(e))
+            abort(400, message=str(e))
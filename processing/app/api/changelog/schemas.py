@@ -0,0 +1,33 @@
+from marshmallow import Schema, fields, validate
+
+
+class ChangeLogFilterSchema(Schema):
+    entity_type = fields.String(required=False)
+    entity_id = fields.UUID(required=False)
+    field_name = fields.String(required=False)
+    changed_by = fields.String(required=False)
+    changed_from = fields.AwareDateTime(required=False)
+    changed_to = fields.AwareDateTime(required=False)
+
+
+class ChangeLogQuerySchema(ChangeLogFilterSchema):
+    after = fields.String(required=False)
+    limit = fields.Integer(required=False, load_default=100,
+                           validate=validate.Range(min=1, max=1000))
+
+
+class ChangeLogResponseSchema(Schema):
+    id = fields.Integer()
+    entity_type = fields.String()
+    entity_id = fields.UUID()
+    field_name = fields.String()
+    old_value = fields.Raw(allow_none=True)
+    new_value = fields.Raw(allow_none=True)
+    changed_at = fields.DateTime()
+    changed_by = fields.String()
+    comment = fields.String(allow_none=True)
+
+
+class ChangeLogPageResponseSchema(Schema):
+    items = fields.List(fields.Nested(ChangeLogResponseSchema))
+    next_cursor = fields.String(allow_none=True)
@@ -0,0 +1,67 @@
+from flask import Response, stream_with_context
+from flask.views import MethodView
+from flask_smorest import Blueprint, abort
+import peewee
+from app.manage_app.logging import processes_logger
+from app.api.export.schemas import ExportQuerySchema, ThresholdExportQuerySchema, ChangeLogExportQuerySchema
+from app.model.models import Feature, Threshold, ChangeLog
+from app.model.export import (EXPORT_FORMATS, export_chunks, model_columns, feature_export_query,
+                              threshold_export_query, changelog_export_query)
+
+blp = Blueprint(name="export",
+                import_name="export",
+                url_prefix="/api/processing/export",
+                description="Streaming export (NDJSON / CSV)")
+
+
+def _stream(model, query, export_format):
+    """Start the export before sending headers so query errors still become a 400,
+    then stream the rest; errors after the first chunk can only cut the body short"""
+    chunks = export_chunks(query, model_columns(model), export_format)
+    try:
+        first = next(chunks, b'')
+    except peewee.PeeweeException as px:
+        processes_logger.error(str(px))
+        abort(400, message=str(px))
+
+    def generate():
+        yield first
+        try:
+            yield from chunks
+        except peewee.PeeweeException as px:
+            processes_logger.error(f'{model.__name__} export interrupted: {px}')
+            raise
+
+    filename = f'{model._meta.table_name}.{export_format}'
+    return Response(stream_with_context(generate()),
+                    mimetype=EXPORT_FORMATS[export_format],
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+
+@blp.route("/features")
+class FeatureExportResource(MethodView):
+    @blp.arguments(ExportQuerySchema, location="query")
+    @blp.response(200)
+    def get(self, args):
+        """Export all features as NDJSON or CSV"""
+        return _stream(Feature, feature_export_query(), args["format"])
+
+
+@blp.route("/thresholds")
+class ThresholdExportResource(MethodView):
+    @blp.arguments(ThresholdExportQuerySchema, location="query")
+    @blp.response(200)
+    def get(self, args):
+        """Export thresholds, optionally of one threshold set or feature"""
+        export_format = args.pop("format")
+        return _stream(Threshold, threshold_export_query(**args), export_format)
+
+
+@blp.route("/changelog")
+class ChangeLogExportResource(MethodView):
+    @blp.arguments(ChangeLogExportQuerySchema, location="query")
+    @blp.response(200)
+    def get(self, args):
+        """Export change-log rows in chronological order"""
+        export_format = args.pop("format")
+        return _stream(ChangeLog, changelog_export_query(**args), export_format)
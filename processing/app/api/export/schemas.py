@@ -0,0 +1,17 @@
+from marshmallow import Schema, fields, validate
+from app.api.changelog.schemas import ChangeLogFilterSchema
+from app.model.export import EXPORT_FORMATS
+
+
+class ExportQuerySchema(Schema):
+    format = fields.String(required=False, load_default='ndjson',
+                           validate=validate.OneOf(list(EXPORT_FORMATS)))
+
+
+class ThresholdExportQuerySchema(ExportQuerySchema):
+    threshold_set_id = fields.UUID(required=False)
+    feature_id = fields.UUID(required=False)
+
+
+class ChangeLogExportQuerySchema(ChangeLogFilterSchema, ExportQuerySchema):
+    pass
@@ -0,0 +1,16 @@
+from app.model.idempotency import run_idempotent, request_fingerprint
+
+REPLAYED_HEADER = "Idempotent-Replayed"
+
+
+def idempotent(scope, key, request_data, operation):
+    """Run operation() -> (body, status) once per Idempotency-Key.
+
+    Without a key the operation simply runs. With a key the response of the
+    first successful request is stored and returned to every retry with the
+    same key and request data, marked by the Idempotent-Replayed header.
+    """
+    if key is None:
+        return operation()
+    body, status, replayed = run_idempotent(scope, key, request_fingerprint(request_data), operation)
+    return body, status, ({REPLAYED_HEADER: "true"} if replayed else {})
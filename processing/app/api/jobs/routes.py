@@ -0,0 +1,187 @@
+import os
+from flask import send_file
+from flask.views import MethodView
+from flask_smorest import Blueprint, abort
+from app.model.exeptions import SetpointsOperationError
+from app.manage_app.logging import processes_logger
+from app.model.idempotency import IdempotencyKeyMismatch
+from app.model.jobs import (SUCCEEDED, JobStateError, enqueue_jobs, get_jobs, get_job_by_id, get_group, cancel_job,
+                            cancel_group, retry_job)
+from app.model.calculations import CALCULATIONS, result_path
+from app.api.jobs.schemas import (
+    JobSchema, JobGroupSchema, JobListQuerySchema, JobResponseSchema, JobGroupResponseSchema,
+    JobGroupCancelResponseSchema, CalculationResponseSchema
+)
+from app.api.shemas import IdempotencyHeaderSchema
+from app.api.idempotency import idempotent
+
+blp = Blueprint(name="jobs",
+                import_name="jobs",
+                url_prefix="/api/processing/jobs",
+                description="Calculation runs queued for processing_worker.py")
+
+
+def _enqueue(data, params_list, group):
+    return enqueue_jobs(
+        kind=data["kind"],
+        params_list=params_list,
+        threshold_set_id=data.get("threshold_set_id"),
+        priority=data.get("priority"),
+        max_attempts=data.get("max_attempts"),
+        # initiator=request.jwt_payload["sub"],
+        initiator=data.get("initiator"),
+        group=group,
+    )
+
+
+@blp.route("")
+class JobResource(MethodView):
+    @blp.arguments(JobListQuerySchema, location="query")
+    @blp.response(200, JobResponseSchema(many=True))
+    def get(self, args):
+        """Return jobs newest first"""
+        try:
+            return get_jobs(**args)
+        except SetpointsOperationError as e:
+            processes_logger.error(str(e))
+            abort(500, message=str(e))
+
+    @blp.arguments(IdempotencyHeaderSchema, location="headers")
+    @blp.arguments(JobSchema)
+    def post(self, headers, data):
+        """Queue a calculation (retries with the same Idempotency-Key get the first response)"""
+        def create():
+            return {"job_id": _enqueue(data, [data["params"]], group=False)["job_ids"][0]}, 202
+
+        try:
+            return idempotent("POST /jobs", headers.get("idempotency_key"), data, create)
+        except IdempotencyKeyMismatch as e:
+            abort(422, message=str(e))
+        except SetpointsOperationError as e:
+            processes_logger.error(str(e))
+            abort(400, message=str(e))
+
+
+@blp.route("/kinds")
+class CalculationResource(MethodView):
+    @blp.response(200, CalculationResponseSchema(many=True))
+    def get(self):
+        """Return the calculations jobs can run"""
+        return [{"name": item.name, "description": item.description, "needs_threshold_set": item.needs_threshold_set}
+                for item in CALCULATIONS.values()]
+
+
+@blp.route("/groups")
+class JobGroupResource(MethodView):
+    @blp.arguments(IdempotencyHeaderSchema, location="headers")
+    @blp.arguments(JobGroupSchema)
+    def post(self, headers, data):
+        """Queue a group run, one job per item of params"""
+        def create():
+            return _enqueue(data, data["items"], group=True), 202
+
+        try:
+            return idempotent("POST /jobs/groups", headers.get("idempotency_key"), data, create)
+        except IdempotencyKeyMismatch as e:
+            abort(422, message=str(e))
+        except SetpointsOperationError as e:
+            processes_logger.error(str(e))
+            abort(400, message=str(e))
+
+
+@blp.route("/groups/<uuid:group_id>")
+class JobGroupByIDResource(MethodView):
+    @blp.response(200, JobGroupResponseSchema)
+    def get(self, group_id):
+        """Return the progress of a group run: jobs per status and summed progress"""
+        try:
+            result = get_group(group_id)
+        except SetpointsOperationError as e:
+            processes_logger.error(str(e))
+            abort(500, message=str(e))
+        if not result:
+            abort(404, message=f"Job group {group_id} does not exist")
+        return result
+
+
+@blp.route("/groups/<uuid:group_id>/cancel")
+class JobGroupCancelResource(MethodView):
+    @blp.response(200, JobGroupCancelResponseSchema)
+    def post(self, group_id):
+        """Cancel the unfinished jobs of a group run"""
+        try:
+            return {"cancelled": cancel_group(group_id)}
+        except SetpointsOperationError as e:
+            processes_logger.error(str(e))
+            abort(400, message=str(e))
+
+
+@blp.route("/<uuid:job_id>")
+class JobByIDResource(MethodView):
+    @blp.response(200, JobResponseSchema)
+    def get(self, job_id):
+        """Return job status and progress"""
+        try:
+            result = get_job_by_id(job_id)
+        except SetpointsOperationError as e:
+            processes_logger.error(str(e))
+            abort(500, message=str(e))
+        if not result:
+            abort(404, message=f"Job {job_id} does not exist")
+        return result
+
+
+@blp.route("/<uuid:job_id>/cancel")
+class JobCancelResource(MethodView):
+    @blp.response(200, JobResponseSchema)
+    def post(self, job_id):
+        """Cancel a job: a queued one at once, a running one when its calculation next reports progress"""
+        try:
+            result = cancel_job(job_id)
+        except JobStateError as e:
+            abort(409, message=str(e))
+        except SetpointsOperationError as e:
+            processes_logger.error(str(e))
+            abort(400, message=str(e))
+        if not result:
+            abort(404, message=f"Job {job_id} does not exist")
+        return result
+
+
+@blp.route("/<uuid:job_id>/retry")
+class JobRetryResource(MethodView):
+    @blp.response(200, JobResponseSchema)
+    def post(self, job_id):
+        """Queue a failed or cancelled job again with a fresh set of attempts"""
+        try:
+            result = retry_job(job_id)
+        except JobStateError as e:
+            abort(409, message=str(e))
+        except SetpointsOperationError as e:
+            processes_logger.error(str(e))
+            abort(400, message=str(e))
+        if not result:
+            abort(404, message=f"Job {job_id} does not exist")
+        return result
+
+
+@blp.route("/<uuid:job_id>/result")
+class JobResultResource(MethodView):
+    @blp.response(200)
+    def get(self, job_id):
+        """Download the result file of a finished job"""
+        try:
+            job = get_job_by_id(job_id)
+        except SetpointsOperationError as e:
+            processes_logger.error(str(e))
+            abort(500, message=str(e))
+        if not job:
+            abort(404, message=f"Job {job_id} does not exist")
+        if job["status"] != SUCCEEDED:
+            abort(409, message=f"Job {job_id} is {job['status']}, it has no result yet")
+        file_name = (job["result"] or {}).get("file_name")
+        path = result_path(file_name) if file_name else None
+        if path is None or not os.path.isfile(path):
+            abort(404, message=f"Job {job_id} has no result file")
+        return send_file(os.path.abspath(path), mimetype="application/x-ndjson", as_attachment=True,
+                         download_name=file_name)
@@ -0,0 +1,116 @@
+from marshmallow import Schema, fields, validate, post_load, ValidationError
+from app.model.jobs import JOB_STATUSES
+from app.model.calculations import CALCULATIONS
+from app.api.setpoints.evaluation.schemas import EvaluationRequestSchema
+
+# parameters of every calculation, checked before the job is queued
+PARAMS_SCHEMAS = {
+    'threshold_evaluation': EvaluationRequestSchema(),
+}
+
+
+def _load_params(kind, params, field_name):
+    schema = PARAMS_SCHEMAS.get(kind)
+    if schema is None:
+        return params
+    try:
+        # round trip: the job keeps JSON with the parsed values (UUIDs as strings, numbers as floats)
+        return schema.dump(schema.load(params))
+    except ValidationError as e:
+        raise ValidationError(e.messages, field_name)
+
+
+class JobOptionsSchema(Schema):
+    kind = fields.String(required=True, validate=validate.OneOf(sorted(CALCULATIONS)))
+    threshold_set_id = fields.UUID(required=False, allow_none=True)
+    priority = fields.Integer(required=False, load_default=0, validate=validate.Range(min=-100, max=100))
+    max_attempts = fields.Integer(required=False, validate=validate.Range(min=1, max=20))
+    initiator = fields.String(required=False, allow_none=True, validate=validate.Length(max=255))
+
+    @post_load
+    def check_threshold_set(self, data, **kwargs):
+        if CALCULATIONS[data["kind"]].needs_threshold_set and not data.get("threshold_set_id"):
+            raise ValidationError(f"{data['kind']} needs a threshold set", "threshold_set_id")
+        return data
+
+
+class JobSchema(JobOptionsSchema):
+    params = fields.Dict(required=True)
+
+    @post_load
+    def load_params(self, data, **kwargs):
+        data["params"] = _load_params(data["kind"], data["params"], "params")
+        return data
+
+
+class JobGroupSchema(JobOptionsSchema):
+    items = fields.List(fields.Dict(), required=True, validate=validate.Length(min=1, max=10000))
+
+    @post_load
+    def load_items(self, data, **kwargs):
+        data["items"] = [_load_params(data["kind"], params, f"items.{index}")
+                         for index, params in enumerate(data["items"])]
+        return data
+
+
+class JobListQuerySchema(Schema):
+    status = fields.String(required=False, validate=validate.OneOf(JOB_STATUSES))
+    kind = fields.String(required=False)
+    group_id = fields.UUID(required=False)
+    threshold_set_id = fields.UUID(required=False)
+    limit = fields.Integer(required=False, load_default=100,
+                           validate=validate.Range(min=1, max=1000))
+
+
+class JobResponseSchema(Schema):
+    id = fields.UUID()
+    kind = fields.String()
+    threshold_set_id = fields.UUID(allow_none=True)
+    threshold_set_version = fields.Integer(allow_none=True)
+    setpoints_version = fields.Integer(allow_none=True)
+    group_id = fields.UUID(allow_none=True)
+    initiator = fields.String(allow_none=True)
+    status = fields.String()
+    priority = fields.Integer()
+    attempts = fields.Integer()
+    max_attempts = fields.Integer()
+    progress_done = fields.Integer()
+    progress_total = fields.Integer(allow_none=True)
+    cancel_requested = fields.Boolean()
+    result = fields.Raw(allow_none=True)
+    error = fields.String(allow_none=True)
+    worker_id = fields.String(allow_none=True)
+    run_after = fields.DateTime()
+    created_at = fields.DateTime()
+    started_at = fields.DateTime(allow_none=True)
+    heartbeat_at = fields.DateTime(allow_none=True)
+    finished_at = fields.DateTime(allow_none=True)
+
+
+class JobGroupCountsSchema(Schema):
+    queued = fields.Integer()
+    running = fields.Integer()
+    succeeded = fields.Integer()
+    failed = fields.Integer()
+    cancelled = fields.Integer()
+
+
+class JobGroupResponseSchema(Schema):
+    group_id = fields.UUID()
+    status = fields.String()
+    jobs = fields.Integer()
+    counts = fields.Nested(JobGroupCountsSchema)
+    progress_done = fields.Integer()
+    progress_total = fields.Integer()
+    created_at = fields.DateTime()
+    finished_at = fields.DateTime(allow_none=True)
+
+
+class JobGroupCancelResponseSchema(Schema):
+    cancelled = fields.Integer()
+
+
+class CalculationResponseSchema(Schema):
+    name = fields.String()
+    description = fields.String()
+    needs_threshold_set = fields.Boolean()
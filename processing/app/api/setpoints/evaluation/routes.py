@@ -0,0 +1,25 @@
+from flask.views import MethodView
+from flask_smorest import Blueprint, abort
+from app.model.exeptions import SetpointsOperationError
+from app.manage_app.logging import processes_logger
+from app.api.setpoints.evaluation.schemas import EvaluationRequestSchema, EvaluationResponseSchema
+
+blp = Blueprint(name="setpoints/evaluation",
+                import_name="evaluation",
+                url_prefix="/api/processing/setpoints/evaluation",
+                description="Threshold evaluation")
+
+
+@blp.route("/<uuid:threshold_set_id>")
+class EvaluationResource(MethodView):
+    @blp.arguments(EvaluationRequestSchema)
+    @blp.response(200, EvaluationResponseSchema)
+    def post(self, data, threshold_set_id):
+        """Check a batch of measurement series against an active threshold set"""
+        # numpy is imported with the evaluation module on the first call
+        from app.model.setpoints.evaluation import evaluate_batch
+        try:
+            return {"violations": evaluate_batch(threshold_set_id, data["series"])}
+        except SetpointsOperationError as e:
+            processes_logger.error(str(e))
+            abort(400, message=str(e))
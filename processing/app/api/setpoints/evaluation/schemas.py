@@ -0,0 +1,32 @@
+from marshmallow import Schema, fields, validate, validates_schema, ValidationError
+
+
+class SeriesSchema(Schema):
+    feature_id = fields.UUID(required=True)
+    series_id = fields.String(required=False, allow_none=True)
+    t_ms = fields.List(fields.Float(), required=True)
+    values = fields.List(fields.Float(), required=True)
+
+    @validates_schema
+    def validate_lengths(self, data, **kwargs):
+        if len(data["t_ms"]) != len(data["values"]):
+            raise ValidationError("t_ms and values must have the same length")
+
+
+class EvaluationRequestSchema(Schema):
+    series = fields.List(fields.Nested(SeriesSchema), required=True,
+                         validate=validate.Length(min=1))
+
+
+class ViolationSchema(Schema):
+    series_id = fields.String(allow_none=True)
+    feature_id = fields.UUID()
+    threshold_id = fields.UUID()
+    event = fields.String()
+    t_ms = fields.Float()
+    value = fields.Float()
+    threshold = fields.Float()
+
+
+class EvaluationResponseSchema(Schema):
+    violations = fields.List(fields.Nested(ViolationSchema))
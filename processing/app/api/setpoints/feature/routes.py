@@ -4,26 +4,48 @@ from flask_smorest import Blueprint, abort
 from app.model.exeptions import SetpointsOperationError
 from app.manage_app.logging import processes_logger
 from app.api.setpoints.feature.schemas import (
-    FeatureSchema, FeatureResponseSchema
+    FeatureSchema, FeatureResponseSchema, FeatureListQuerySchema, FeaturePageResponseSchema,
+    FeatureBulkModifySchema, FeatureBulkResultSchema, AsOfQuerySchema, FeatureAsOfBatchSchema
 )
 from app.model.setpoints.feature import (
-    add_feature, get_feature_list, get_feature_by_id, modify_feature
+    add_feature, add_features, upsert_feature, get_feature_list_with_etag, get_feature_page_with_etag,
+    get_feature_by_id_with_etag, modify_feature, modify_features, get_feature_as_of, get_features_as_of
 )
-from app.api.shemas import AmountQuerySchema, CommentQuerySchema
+from app.model.idempotency import IdempotencyKeyMismatch
+from app.model.history import HistoryArchived
+from app.api.shemas import AmountQuerySchema, CommentQuerySchema, IdempotencyHeaderSchema
+from app.api.serialization import fast_response
+from app.api.idempotency import idempotent
 
 blp = Blueprint(name="setpoints/features",
                 import_name="features",
                 url_prefix="/api/processing/setpoints/features",
                 description="Feature operations")
 
+feature_list_schema = FeatureResponseSchema(many=True)
+
 
 @blp.route("")
 class FeatureResource(MethodView):
+    @blp.etag
+    @blp.arguments(FeatureListQuerySchema, location="query")
+    @blp.response(200, FeaturePageResponseSchema)
+    def get(self, args):
+        """Return a page of features (keyset pagination, server-side filters)"""
+        try:
+            result, etag = get_feature_page_with_etag(**args)
+            blp.set_etag(etag)
+            return fast_response(FeaturePageResponseSchema, result)
+        except SetpointsOperationError as e:
+            processes_logger.error(str(e))
+            abort(500, message=str(e))
+
+    @blp.arguments(IdempotencyHeaderSchema, location="headers")
     @blp.arguments(CommentQuerySchema, location="query")
     @blp.arguments(FeatureSchema)
-    def post(self, query_args, data):
-        """Create new feature"""
-        try:
+    def post(self, headers, query_args, data):
+        """Create new feature (retries with the same Idempotency-Key get the first response)"""
+        def create():
             # user_login = request.jwt_payload["sub"]
             feature_id = add_feature(
                 name=data.get("name"),
@@ -36,6 +58,78 @@ class FeatureResource(MethodView):
                 # changed_by=user_login,
             )
             return {"feature_id": str(feature_id)}, 201
+
+        try:
+            return idempotent("POST /features", headers.get("idempotency_key"), [query_args, data], create)
+        except IdempotencyKeyMismatch as e:
+            abort(422, message=str(e))
+        except SetpointsOperationError as e:
+            processes_logger.error(str(e))
+            abort(400, message=str(e))
+
+
+@blp.route("/bulk")
+class FeatureBulkResource(MethodView):
+    @blp.arguments(IdempotencyHeaderSchema, location="headers")
+    @blp.arguments(CommentQuerySchema, location="query")
+    @blp.arguments(FeatureSchema(many=True))
+    @blp.response(201, FeatureBulkResultSchema(many=True))
+    def post(self, headers, query_args, data):
+        """Create many features in one transaction (retries with the same Idempotency-Key get the first response)"""
+        def create():
+            # user_login = request.jwt_payload["sub"]
+            return add_features(
+                data,
+                comment=query_args.get("comment"),
+                # changed_by=user_login,
+            ), 201
+
+        try:
+            return idempotent("POST /features/bulk", headers.get("idempotency_key"), [query_args, data], create)
+        except IdempotencyKeyMismatch as e:
+            abort(422, message=str(e))
+        except SetpointsOperationError as e:
+            processes_logger.error(str(e))
+            abort(400, message=str(e))
+
+    @blp.arguments(CommentQuerySchema, location="query")
+    @blp.arguments(FeatureBulkModifySchema(many=True))
+    @blp.response(200, FeatureBulkResultSchema(many=True))
+    def put(self, query_args, data):
+        """Modify many features in one transaction"""
+        try:
+            # user_login = request.jwt_payload["sub"]
+            return modify_features(
+                data,
+                comment=query_args.get("comment"),
+                # changed_by=user_login,
+            )
+        except SetpointsOperationError as e:
+            processes_logger.error(str(e))
+            abort(400, message=str(e))
+
+
+@blp.route("/by-name")
+class FeatureUpsertResource(MethodView):
+    @blp.arguments(CommentQuerySchema, location="query")
+    @blp.arguments(FeatureSchema)
+    @blp.response(200, FeatureResponseSchema)
+    @blp.alt_response(201, schema=FeatureResponseSchema, description="Feature was created")
+    def put(self, query_args, data):
+        """Update the feature with this name or create it (needs FEATURE_UNIQUE_NAMES)"""
+        try:
+            # user_login = request.jwt_payload["sub"]
+            result, created = upsert_feature(
+                name=data.get("name"),
+                description=data.get("description"),
+                type=data.get("type"),
+                priority=data.get("priority"),
+                default_threshold=data.get("default_threshold"),
+                active=data.get("active"),
+                comment=query_args.get("comment"),
+                # changed_by=user_login,
+            )
+            return result, 201 if created else 200
         except SetpointsOperationError as e:
             processes_logger.error(str(e))
             abort(400, message=str(e))
@@ -43,13 +137,16 @@ class FeatureResource(MethodView):
 
 @blp.route("/amount")
 class FeatureAmountResource(MethodView):
+    @blp.etag
     @blp.arguments(AmountQuerySchema, location="query")
-    @blp.response(200, FeatureResponseSchema(many=True))
+    @blp.response(200, feature_list_schema)
     def get(self, args):
         """Return selected amount of features"""
         try:
             amount = args.get("amount")
-            return get_feature_list(amount)
+            result, etag = get_feature_list_with_etag(amount)
+            blp.set_etag(etag)
+            return fast_response(feature_list_schema, result)
         except SetpointsOperationError as e:
             processes_logger.error(str(e))
             abort(500, message=str(e))
@@ -57,12 +154,47 @@ class FeatureAmountResource(MethodView):
 
 @blp.route("/<uuid:feature_id>")
 class FeatureByIDResource(MethodView):
+    @blp.etag
     @blp.response(200, FeatureResponseSchema)
     def get(self, feature_id):
         """Return feature by ID"""
         try:
-            result = get_feature_by_id(feature_id)
-            return result
+            result, etag = get_feature_by_id_with_etag(feature_id)
+            blp.set_etag(etag)
+            return fast_response(FeatureResponseSchema, result)
+        except SetpointsOperationError as e:
+            processes_logger.error(str(e))
+            abort(500, message=str(e))
+
+
+@blp.route("/<uuid:feature_id>/as-of")
+class FeatureAsOfResource(MethodView):
+    @blp.arguments(AsOfQuerySchema, location="query")
+    @blp.response(200, FeatureResponseSchema)
+    def get(self, args, feature_id):
+        """Return feature state at the given moment"""
+        try:
+            result = get_feature_as_of(feature_id, args["ts"])
+        except HistoryArchived as e:
+            abort(410, message=str(e))
+        except SetpointsOperationError as e:
+            processes_logger.error(str(e))
+            abort(500, message=str(e))
+        if not result:
+            abort(404, message=f"Feature {feature_id} did not exist at {args['ts'].isoformat()}")
+        return fast_response(FeatureResponseSchema, result)
+
+
+@blp.route("/as-of")
+class FeatureAsOfBatchResource(MethodView):
+    @blp.arguments(FeatureAsOfBatchSchema)
+    @blp.response(200, feature_list_schema)
+    def post(self, data):
+        """Return states of many features at the given moment"""
+        try:
+            return fast_response(feature_list_schema, get_features_as_of(data["ids"], data["ts"]))
+        except HistoryArchived as e:
+            abort(410, message=str(e))
         except SetpointsOperationError as e:
             processes_logger.error(str(e))
             abort(500, message=str(e))
@@ -85,7 +217,7 @@ class FeatureModifyResource(MethodView):
         """Modify selected feature"""
         try:
             # user_login = request.jwt_payload["sub"]
-            modify_feature(
+            result = modify_feature(
                 item_id=feature_id,
                 name=data.get("name"),
                 description=data.get("description"),
@@ -96,7 +228,6 @@ class FeatureModifyResource(MethodView):
                 comment=query_args.get("comment"),
                 # changed_by=user_login,
             )
-            result = get_feature_by_id(feature_id)
             return result
         except SetpointsOperationError as e:
             processes_logger.error(str(e))
@@ -1,4 +1,4 @@
-from marshmallow import Schema, fields
+from marshmallow import Schema, fields, validate
 
 
 class FeatureSchema(Schema):
@@ -20,4 +20,38 @@ class FeatureResponseSchema(Schema):
     active = fields.Boolean()
 
 
+class FeatureBulkModifySchema(FeatureSchema):
+    id = fields.UUID(required=True)
 
+
+class FeatureBulkResultSchema(Schema):
+    index = fields.Integer()
+    id = fields.UUID()
+    status = fields.String()
+
+
+class FeatureListQuerySchema(Schema):
+    after = fields.UUID(required=False)
+    limit = fields.Integer(required=False, load_default=100,
+                           validate=validate.Range(min=1, max=1000))
+    type = fields.String(required=False)
+    priority = fields.String(required=False)
+    active = fields.Boolean(required=False)
+    name_prefix = fields.String(required=False)
+    # COUNT(*) over the whole filtered set, only on request
+    with_total = fields.Boolean(required=False, load_default=False)
+
+
+class FeaturePageResponseSchema(Schema):
+    items = fields.List(fields.Nested(FeatureResponseSchema))
+    next_cursor = fields.UUID(allow_none=True)
+    total = fields.Integer()
+
+
+class AsOfQuerySchema(Schema):
+    ts = fields.AwareDateTime(required=True)
+
+
+class FeatureAsOfBatchSchema(Schema):
+    ids = fields.List(fields.UUID(), required=True, validate=validate.Length(min=1, max=1000))
+    ts = fields.AwareDateTime(required=True)
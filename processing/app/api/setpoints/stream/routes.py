@@ -0,0 +1,168 @@
+import json
+from flask import Response, request, stream_with_context
+from flask.views import MethodView
+from flask_smorest import Blueprint, abort
+from marshmallow import ValidationError
+from app.manage_app.config import Config
+from app.manage_app.logging import processes_logger
+from app.model.exeptions import SetpointsOperationError
+from app.model.models import StreamCheckpoint
+from app.model.setpoints.streaming import StreamBusyError, open_run, get_run_state, delete_run
+from app.api.setpoints.stream.schemas import StreamBatchSchema, StreamBatchResultSchema, RunStateSchema
+
+blp = Blueprint(name="setpoints/streams",
+                import_name="streams",
+                url_prefix="/api/processing/setpoints/streams",
+                description="Streaming threshold evaluation of live sample feeds")
+
+RUN_ID_MAX_LENGTH = StreamCheckpoint.run_id.max_length
+
+
+def _check_run_id(run_id):
+    if len(run_id) > RUN_ID_MAX_LENGTH:
+        abort(422, message=f"run_id must be at most {RUN_ID_MAX_LENGTH} characters")
+
+
+def _batches(stream):
+    """Micro-batches of an NDJSON body, read as the client sends them; blank lines are skipped"""
+    schema = StreamBatchSchema()
+    limit = Config.STREAM_MAX_LINE_BYTES
+    number = 0
+    while True:
+        line = stream.readline(limit + 1)
+        if not line:
+            return
+        number += 1
+        if len(line) > limit:
+            raise ValidationError({f"line {number}": [f"longer than {limit} bytes"]})
+        if not line.strip():
+            continue
+        try:
+            yield schema.load(json.loads(line))
+        except ValidationError as e:
+            raise ValidationError({f"line {number}": e.messages})
+        except ValueError as e:
+            raise ValidationError({f"line {number}": [str(e)]})
+
+
+def _ndjson(record, event):
+    return json.dumps(record) + "\n"
+
+
+def _sse(record, event):
+    seq = record.get("seq")
+    event_id = f"id: {seq}\n" if seq is not None else ""
+    return f"event: {event}\n{event_id}data: {json.dumps(record)}\n\n"
+
+
+def _feed(threshold_set_id, run_id, batches, write):
+    """One record per micro-batch, then an 'end' record once the run is saved.
+
+    Errors of the first batch propagate, so the view can still answer with a
+    status code; later ones end the stream with an 'error' record.
+    """
+    started = False
+    with open_run(threshold_set_id, run_id) as run:
+        try:
+            for batch in batches:
+                result = run.apply(batch["series"], batch.get("seq"))
+                result["checkpointed"] = run.checkpoint_due()
+                started = True
+                yield write(result, "batch")
+        except (ValidationError, SetpointsOperationError) as e:
+            if not started:
+                raise
+            message = e.messages if isinstance(e, ValidationError) else str(e)
+            processes_logger.error(f"Stream {threshold_set_id}/{run_id} interrupted: {message}")
+            yield write({"seq": run.seq, "error": message}, "error")
+    yield write({"seq": run.seq, "revision": run.revision}, "end")
+
+
+def _resume(first, records):
+    try:
+        yield first
+        yield from records
+    finally:
+        records.close()
+
+
+@blp.route("/<uuid:threshold_set_id>/<run_id>")
+class RunStreamResource(MethodView):
+    @blp.response(200, RunStateSchema)
+    def get(self, threshold_set_id, run_id):
+        """Return the saved state of a run: thresholds in violation, last sample and samples seen per feature"""
+        _check_run_id(run_id)
+        try:
+            return get_run_state(threshold_set_id, run_id)
+        except StreamBusyError as e:
+            abort(409, message=str(e))
+        except SetpointsOperationError as e:
+            processes_logger.error(str(e))
+            abort(500, message=str(e))
+
+    @blp.response(204)
+    def delete(self, threshold_set_id, run_id):
+        """Forget the run, the next sample starts it anew"""
+        _check_run_id(run_id)
+        try:
+            delete_run(threshold_set_id, run_id)
+        except StreamBusyError as e:
+            abort(409, message=str(e))
+        except SetpointsOperationError as e:
+            processes_logger.error(str(e))
+            abort(400, message=str(e))
+
+
+@blp.route("/<uuid:threshold_set_id>/<run_id>/samples")
+class RunStreamSamplesResource(MethodView):
+    @blp.arguments(StreamBatchSchema)
+    @blp.response(200, StreamBatchResultSchema)
+    def post(self, data, threshold_set_id, run_id):
+        """Apply one micro-batch of samples to the run and return the violations it started or cleared.
+
+        A batch with a seq at or below the last applied one is a retry and is skipped.
+        """
+        _check_run_id(run_id)
+        try:
+            with open_run(threshold_set_id, run_id) as run:
+                result = run.apply(data["series"], data.get("seq"))
+            result["checkpointed"] = True
+            return result
+        except StreamBusyError as e:
+            abort(409, message=str(e))
+        except SetpointsOperationError as e:
+            processes_logger.error(str(e))
+            abort(400, message=str(e))
+
+
+@blp.route("/<uuid:threshold_set_id>/<run_id>/feed")
+class RunStreamFeedResource(MethodView):
+    @blp.response(200)
+    def post(self, threshold_set_id, run_id):
+        """Feed micro-batches as NDJSON lines ({seq, series}) and get one result per batch as it is applied.
+
+        The response is NDJSON, or server-sent events with Accept: text/event-stream.
+        The run is saved every STREAM_CHECKPOINT_INTERVAL_MS (checkpointed: true)
+        and at the end; after a worker restart resend the batches from the last
+        saved seq, replays of applied batches are skipped. Servers read chunked
+        bodies in blocks (gunicorn: 1 KB), a batch is applied once the block with
+        its end arrives; send single latency-critical batches to /samples.
+        """
+        _check_run_id(run_id)
+        sse = request.accept_mimetypes.best_match(["application/x-ndjson", "text/event-stream"]) == \
+            "text/event-stream"
+        records = _feed(threshold_set_id, run_id, _batches(request.stream), _sse if sse else _ndjson)
+        try:
+            first = next(records)
+        except StreamBusyError as e:
+            abort(409, message=str(e))
+        except ValidationError as e:
+            abort(422, message=str(e.messages))
+        except SetpointsOperationError as e:
+            processes_logger.error(str(e))
+            abort(400, message=str(e))
+
+        headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        return Response(stream_with_context(_resume(first, records)),
+                        mimetype="text/event-stream" if sse else "application/x-ndjson",
+                        headers=headers)
@@ -0,0 +1,31 @@
+from marshmallow import Schema, fields, validate
+from app.api.setpoints.evaluation.schemas import SeriesSchema, ViolationSchema
+
+
+class StreamBatchSchema(Schema):
+    seq = fields.Integer(required=False, allow_none=True, validate=validate.Range(min=0))
+    series = fields.List(fields.Nested(SeriesSchema), required=True,
+                         validate=validate.Length(min=1))
+
+
+class StreamBatchResultSchema(Schema):
+    seq = fields.Integer(allow_none=True)
+    events = fields.List(fields.Nested(ViolationSchema))
+    late = fields.Integer()
+    duplicate = fields.Boolean()
+    checkpointed = fields.Boolean()
+
+
+class FeatureStreamStateSchema(Schema):
+    feature_id = fields.UUID()
+    violated = fields.List(fields.UUID())
+    last_t_ms = fields.Float(allow_none=True)
+    samples = fields.Integer()
+
+
+class RunStateSchema(Schema):
+    threshold_set_id = fields.UUID()
+    run_id = fields.String()
+    seq = fields.Integer(allow_none=True)
+    revision = fields.Integer()
+    features = fields.List(fields.Nested(FeatureStreamStateSchema))
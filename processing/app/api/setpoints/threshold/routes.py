@@ -0,0 +1,69 @@
+from flask.views import MethodView
+from flask_smorest import Blueprint, abort
+from app.model.exeptions import SetpointsOperationError
+from app.manage_app.logging import processes_logger
+from app.api.setpoints.threshold.schemas import ThresholdSchema, ThresholdResponseSchema
+from app.model.setpoints.threshold import get_threshold_by_id, modify_threshold, delete_threshold
+from app.api.shemas import CommentQuerySchema
+
+blp = Blueprint(name="setpoints/thresholds",
+                import_name="thresholds",
+                url_prefix="/api/processing/setpoints/thresholds",
+                description="Threshold operations")
+
+
+@blp.route("/<uuid:threshold_id>")
+class ThresholdByIDResource(MethodView):
+    @blp.response(200, ThresholdResponseSchema)
+    def get(self, threshold_id):
+        """Return threshold by ID"""
+        try:
+            result = get_threshold_by_id(threshold_id)
+        except SetpointsOperationError as e:
+            processes_logger.error(str(e))
+            abort(500, message=str(e))
+        if not result:
+            abort(404, message=f"Threshold {threshold_id} does not exist")
+        return result
+
+    @blp.arguments(CommentQuerySchema, location="query")
+    @blp.response(204)
+    def delete(self, query_args, threshold_id):
+        """Delete threshold"""
+        try:
+            # user_login = request.jwt_payload["sub"]
+            delete_threshold(
+                threshold_id,
+                comment=query_args.get("comment"),
+                # changed_by=user_login,
+            )
+        except SetpointsOperationError as e:
+            processes_logger.error(str(e))
+            abort(400, message=str(e))
+
+
+@blp.route("/<uuid:threshold_id>/settings")
+class ThresholdModifyResource(MethodView):
+    @blp.response(200, ThresholdResponseSchema)
+    @blp.arguments(ThresholdSchema)
+    @blp.arguments(CommentQuerySchema, location="query")
+    def put(self, data, query_args, threshold_id):
+        """Modify selected threshold"""
+        try:
+            # user_login = request.jwt_payload["sub"]
+            return modify_threshold(
+                item_id=threshold_id,
+                feature_id=data.get("feature_id"),
+                value=data.get("value"),
+                default=data.get("default"),
+                deadband=data.get("deadband"),
+                step_indicator=data.get("step_indicator"),
+                time_point_start_ms=data.get("time_point_start_ms"),
+                time_point_end_ms=data.get("time_point_end_ms"),
+                active=data.get("active"),
+                comment=query_args.get("comment"),
+                # changed_by=user_login,
+            )
+        except SetpointsOperationError as e:
+            processes_logger.error(str(e))
+            abort(400, message=str(e))
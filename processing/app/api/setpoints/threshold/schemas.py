@@ -0,0 +1,66 @@
+from marshmallow import Schema, fields, validates_schema, ValidationError
+
+
+class ThresholdSchema(Schema):
+    feature_id = fields.UUID(required=True)
+    default = fields.Boolean(required=False, load_default=False)
+    value = fields.Float(required=True)
+    deadband = fields.Float(required=False, allow_none=True)
+    step_indicator = fields.String(required=False, allow_none=True)
+    time_point_start_ms = fields.Integer(required=False, allow_none=True)
+    time_point_end_ms = fields.Integer(required=False, allow_none=True)
+    active = fields.Boolean(required=True)
+
+    @validates_schema
+    def validate_window(self, data, **kwargs):
+        start = data.get("time_point_start_ms")
+        end = data.get("time_point_end_ms")
+        if start is not None and end is not None and start >= end:
+            raise ValidationError("time_point_start_ms must be less than time_point_end_ms")
+
+
+class ThresholdResponseSchema(Schema):
+    id = fields.UUID()
+    feature_id = fields.UUID()
+    threshold_set_id = fields.UUID()
+    default = fields.Boolean()
+    value = fields.Float()
+    deadband = fields.Float()
+    step_indicator = fields.String()
+    time_point_start_ms = fields.Integer()
+    time_point_end_ms = fields.Integer()
+    active = fields.Boolean()
+
+
+class ThresholdWindowQuerySchema(Schema):
+    feature_id = fields.UUID(required=False)
+    t_ms = fields.Integer(required=False)
+    from_ms = fields.Integer(required=False)
+    to_ms = fields.Integer(required=False)
+
+    @validates_schema
+    def validate_window(self, data, **kwargs):
+        if data.get("t_ms") is not None and (data.get("from_ms") is not None or data.get("to_ms") is not None):
+            raise ValidationError("t_ms cannot be combined with from_ms/to_ms")
+        if data.get("from_ms") is not None and data.get("to_ms") is not None and data["from_ms"] >= data["to_ms"]:
+            raise ValidationError("from_ms must be less than to_ms")
+
+
+class ActiveThresholdQuerySchema(ThresholdWindowQuerySchema):
+    feature_id = fields.UUID(required=True)
+
+
+class ResolvedThresholdSchema(Schema):
+    id = fields.UUID()
+    feature_id = fields.UUID()
+    value = fields.Float()
+    deadband = fields.Float()
+    step_indicator = fields.String()
+    time_point_start_ms = fields.Integer()
+    time_point_end_ms = fields.Integer()
+
+
+class ThresholdBulkResultSchema(Schema):
+    index = fields.Integer()
+    id = fields.UUID()
+    status = fields.String()
@@ -0,0 +1,191 @@
+from flask.views import MethodView
+from flask_smorest import Blueprint, abort
+from app.model.exeptions import SetpointsOperationError
+from app.manage_app.logging import processes_logger
+from app.api.setpoints.threshold_set.schemas import (
+    ThresholdSetSchema, ThresholdSetResponseSchema, ThresholdSetListQuerySchema, ThresholdSetCloneResponseSchema,
+    ThresholdSetDiffResponseSchema
+)
+from app.api.setpoints.threshold.schemas import (
+    ThresholdSchema, ThresholdResponseSchema, ThresholdBulkResultSchema, ThresholdWindowQuerySchema,
+    ActiveThresholdQuerySchema, ResolvedThresholdSchema
+)
+from app.model.setpoints.threshold import (
+    add_threshold_set, modify_threshold_set, delete_threshold_set, get_threshold_sets, get_threshold_set_by_id,
+    get_threshold_set_versions, clone_threshold_set, diff_threshold_sets, get_thresholds, add_thresholds
+)
+from app.model.setpoints.compiled import get_active_thresholds
+from app.api.shemas import CommentQuerySchema
+
+blp = Blueprint(name="setpoints/threshold-sets",
+                import_name="threshold_sets",
+                url_prefix="/api/processing/setpoints/threshold-sets",
+                description="Threshold set operations")
+
+
+@blp.route("")
+class ThresholdSetResource(MethodView):
+    @blp.arguments(ThresholdSetListQuerySchema, location="query")
+    @blp.response(200, ThresholdSetResponseSchema(many=True))
+    def get(self, args):
+        """Return threshold sets ordered by name and version"""
+        try:
+            return get_threshold_sets(**args)
+        except SetpointsOperationError as e:
+            processes_logger.error(str(e))
+            abort(500, message=str(e))
+
+    @blp.arguments(CommentQuerySchema, location="query")
+    @blp.arguments(ThresholdSetSchema)
+    def post(self, query_args, data):
+        """Create new threshold set (version 1)"""
+        try:
+            # user_login = request.jwt_payload["sub"]
+            threshold_set_id = add_threshold_set(
+                name=data.get("name"),
+                description=data.get("description"),
+                group=data.get("group"),
+                active=data.get("active"),
+                comment=query_args.get("comment"),
+                # changed_by=user_login,
+            )
+            return {"threshold_set_id": str(threshold_set_id)}, 201
+        except SetpointsOperationError as e:
+            processes_logger.error(str(e))
+            abort(400, message=str(e))
+
+
+@blp.route("/<uuid:threshold_set_id>")
+class ThresholdSetByIDResource(MethodView):
+    @blp.response(200, ThresholdSetResponseSchema)
+    def get(self, threshold_set_id):
+        """Return threshold set by ID"""
+        try:
+            result = get_threshold_set_by_id(threshold_set_id)
+        except SetpointsOperationError as e:
+            processes_logger.error(str(e))
+            abort(500, message=str(e))
+        if not result:
+            abort(404, message=f"Threshold set {threshold_set_id} does not exist")
+        return result
+
+    @blp.arguments(CommentQuerySchema, location="query")
+    @blp.response(204)
+    def delete(self, query_args, threshold_set_id):
+        """Delete threshold set with all its thresholds"""
+        try:
+            # user_login = request.jwt_payload["sub"]
+            delete_threshold_set(
+                threshold_set_id,
+                comment=query_args.get("comment"),
+                # changed_by=user_login,
+            )
+        except SetpointsOperationError as e:
+            processes_logger.error(str(e))
+            abort(400, message=str(e))
+
+
+@blp.route("/<uuid:threshold_set_id>/settings")
+class ThresholdSetModifyResource(MethodView):
+    @blp.response(200, ThresholdSetResponseSchema)
+    @blp.arguments(ThresholdSetSchema)
+    @blp.arguments(CommentQuerySchema, location="query")
+    def put(self, data, query_args, threshold_set_id):
+        """Modify selected threshold set"""
+        try:
+            # user_login = request.jwt_payload["sub"]
+            return modify_threshold_set(
+                item_id=threshold_set_id,
+                name=data.get("name"),
+                description=data.get("description"),
+                group=data.get("group"),
+                active=data.get("active"),
+                comment=query_args.get("comment"),
+                # changed_by=user_login,
+            )
+        except SetpointsOperationError as e:
+            processes_logger.error(str(e))
+            abort(400, message=str(e))
+
+
+@blp.route("/<uuid:threshold_set_id>/versions")
+class ThresholdSetVersionsResource(MethodView):
+    @blp.response(200, ThresholdSetResponseSchema(many=True))
+    def get(self, threshold_set_id):
+        """Return every version of the set, oldest first"""
+        try:
+            return get_threshold_set_versions(threshold_set_id)
+        except SetpointsOperationError as e:
+            processes_logger.error(str(e))
+            abort(500, message=str(e))
+
+    @blp.arguments(CommentQuerySchema, location="query")
+    @blp.response(201, ThresholdSetCloneResponseSchema)
+    def post(self, query_args, threshold_set_id):
+        """Create the next version of the set as a copy of this one (copied inside the database)"""
+        try:
+            # user_login = request.jwt_payload["sub"]
+            threshold_set, count = clone_threshold_set(
+                threshold_set_id,
+                comment=query_args.get("comment"),
+                # changed_by=user_login,
+            )
+            return {"threshold_set": threshold_set, "thresholds_copied": count}
+        except SetpointsOperationError as e:
+            processes_logger.error(str(e))
+            abort(400, message=str(e))
+
+
+@blp.route("/<uuid:threshold_set_id>/diff/<uuid:other_id>")
+class ThresholdSetDiffResource(MethodView):
+    @blp.response(200, ThresholdSetDiffResponseSchema)
+    def get(self, threshold_set_id, other_id):
+        """Return thresholds added, removed or changed in the other set, matched by feature and time window"""
+        try:
+            return diff_threshold_sets(threshold_set_id, other_id)
+        except SetpointsOperationError as e:
+            processes_logger.error(str(e))
+            abort(400, message=str(e))
+
+
+@blp.route("/<uuid:threshold_set_id>/thresholds")
+class ThresholdSetThresholdsResource(MethodView):
+    @blp.arguments(ThresholdWindowQuerySchema, location="query")
+    @blp.response(200, ThresholdResponseSchema(many=True))
+    def get(self, args, threshold_set_id):
+        """Return thresholds of the set ordered by feature and time window, optionally only those of a window"""
+        try:
+            return get_thresholds(threshold_set_id, **args)
+        except SetpointsOperationError as e:
+            processes_logger.error(str(e))
+            abort(500, message=str(e))
+
+    @blp.arguments(CommentQuerySchema, location="query")
+    @blp.arguments(ThresholdSchema(many=True))
+    @blp.response(201, ThresholdBulkResultSchema(many=True))
+    def post(self, query_args, data, threshold_set_id):
+        """Create many thresholds of the set in one transaction"""
+        try:
+            # user_login = request.jwt_payload["sub"]
+            return add_thresholds(
+                threshold_set_id,
+                data,
+                comment=query_args.get("comment"),
+                # changed_by=user_login,
+            )
+        except SetpointsOperationError as e:
+            processes_logger.error(str(e))
+            abort(400, message=str(e))
+
+
+@blp.route("/<uuid:threshold_set_id>/active")
+class ThresholdSetActiveResource(MethodView):
+    @blp.arguments(ActiveThresholdQuerySchema, location="query")
+    @blp.response(200, ResolvedThresholdSchema(many=True))
+    def get(self, args, threshold_set_id):
+        """Return thresholds of a feature applying at t_ms or within [from_ms, to_ms), as evaluation sees them"""
+        try:
+            return get_active_thresholds(threshold_set_id, **args)
+        except SetpointsOperationError as e:
+            processes_logger.error(str(e))
+            abort(400, message=str(e))
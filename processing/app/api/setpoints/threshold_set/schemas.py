@@ -0,0 +1,54 @@
+from marshmallow import Schema, fields
+
+
+class ThresholdSetSchema(Schema):
+    name = fields.String(required=True)
+    description = fields.String(required=False, allow_none=True)
+    group = fields.String(required=False, allow_none=True)
+    active = fields.Boolean(required=True)
+
+
+class ThresholdSetResponseSchema(Schema):
+    id = fields.UUID()
+    name = fields.String()
+    description = fields.String()
+    group = fields.String()
+    active = fields.Boolean()
+    version = fields.Integer()
+    origin_id = fields.UUID()
+
+
+class ThresholdSetListQuerySchema(Schema):
+    name_prefix = fields.String(required=False)
+    group = fields.String(required=False)
+    active = fields.Boolean(required=False)
+
+
+class ThresholdSetCloneResponseSchema(Schema):
+    threshold_set = fields.Nested(ThresholdSetResponseSchema)
+    thresholds_copied = fields.Integer()
+
+
+class ThresholdDiffSideSchema(Schema):
+    id = fields.UUID()
+    default = fields.Boolean()
+    value = fields.Float()
+    deadband = fields.Float()
+    step_indicator = fields.String()
+    active = fields.Boolean()
+
+
+class ThresholdDiffItemSchema(Schema):
+    feature_id = fields.UUID()
+    time_point_start_ms = fields.Integer(allow_none=True)
+    time_point_end_ms = fields.Integer(allow_none=True)
+    status = fields.String()
+    changed_fields = fields.List(fields.String())
+    base = fields.Nested(ThresholdDiffSideSchema, allow_none=True)
+    other = fields.Nested(ThresholdDiffSideSchema, allow_none=True)
+
+
+class ThresholdSetDiffResponseSchema(Schema):
+    base_id = fields.UUID()
+    other_id = fields.UUID()
+    items = fields.List(fields.Nested(ThresholdDiffItemSchema))
@@ -1,4 +1,4 @@
-from marshmallow import Schema, fields
+from marshmallow import Schema, fields, validate
 
 
 class AmountQuerySchema(Schema):
@@ -9,6 +9,11 @@ class CommentQuerySchema(Schema):
     comment = fields.String(required=False)
 
 
+class IdempotencyHeaderSchema(Schema):
+    idempotency_key = fields.String(data_key="Idempotency-Key", required=False,
+                                    validate=validate.Length(min=1, max=255))
+
+
 class AmountCommentQuerySchema(Schema):
     amount = fields.Integer(required=False)
     comment = fields.String(required=False)
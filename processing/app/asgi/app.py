@@ -0,0 +1,80 @@
+import time
+import asyncpg
+from contextlib import asynccontextmanager
+from starlette.applications import Starlette
+from app.manage_app.config import Config
+from app.manage_app.logging import setup_logging, stop_logging, processes_logger
+from app.model.models import db, SchemaMigration
+from app.model.migrations import SCHEMA_VERSION, SchemaVersionError
+from app.asgi.database import adb
+from app.asgi.routes import routes, APIError, api_error_handler, json_response
+
+
+class RequestLogMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            processes_logger.info(f"Received {scope['method']} request to {scope['path']}")
+        await self.app(scope, receive, send)
+
+
+async def internal_error_handler(request, exc):
+    processes_logger.error(f"Unhandled exception: {str(exc)}", exc_info=exc)
+    return json_response({"error": "Internal server error"}, 500)
+
+
+async def _check_schema_version():
+    """check_schema_version() on the asyncpg pool"""
+    try:
+        found = await adb.fetchval(f'SELECT MAX(version) FROM "{SchemaMigration._meta.table_name}"')
+    except asyncpg.UndefinedTableError:
+        found = None
+    if found is None or found < SCHEMA_VERSION:
+        raise SchemaVersionError(found, SCHEMA_VERSION)
+
+
+def create_asgi_app(tests=False):
+    """Feature routes served by Starlette on an asyncpg pool.
+
+    Hot paths (page, list, by id, create, modify) run on asyncpg; bulk and
+    as-of requests reuse the WSGI model functions in worker threads on the
+    peewee pool. Schema migrations are still applied by processing_migrate.py.
+    """
+    database = Config.DATABASE_TEST if tests else Config.DATABASE
+
+    @asynccontextmanager
+    async def lifespan(app):
+        started = time.perf_counter()
+        setup_logging({name: getattr(Config, name) for name in dir(Config) if name.isupper()})
+        await adb.connect(database, Config.ASGI_DB_MIN_CONNECTIONS, Config.ASGI_DB_MAX_CONNECTIONS)
+        try:
+            await _check_schema_version()
+            db.init(
+                database=database['name'],
+                user=database['user'],
+                password=database['password'],
+                host=database['host'],
+                port=database['port'],
+                max_connections=Config.DB_MAX_CONNECTIONS,
+                stale_timeout=Config.DB_STALE_TIMEOUT,
+                timeout=Config.DB_POOL_TIMEOUT,
+                pre_ping_idle=Config.DB_POOL_PRE_PING_IDLE_SECONDS,
+            )
+            processes_logger.info(f"ASGI application started in {(time.perf_counter() - started) * 1000:.0f} ms")
+            yield
+        finally:
+            await adb.close()
+            if not db.is_closed():
+                db.close()
+            db.close_all()
+            stop_logging()
+
+    app = Starlette(
+        routes=routes,
+        lifespan=lifespan,
+        exception_handlers={APIError: api_error_handler, Exception: internal_error_handler},
+    )
+    app.add_middleware(RequestLogMiddleware)
+    return app
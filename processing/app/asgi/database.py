@@ -0,0 +1,66 @@
+import re
+import asyncpg
+
+_PLACEHOLDER = re.compile(r'%s')
+
+
+def to_asyncpg(sql, params):
+    """peewee/psycopg2 SQL (%s placeholders) as asyncpg SQL ($1, $2, ...)"""
+    counter = iter(range(1, len(params) + 1))
+    sql = _PLACEHOLDER.sub(lambda match: f'${next(counter)}', sql.replace('%%', '\x00'))
+    return sql.replace('\x00', '%'), params
+
+
+class AsyncDatabase:
+    """asyncpg pool executing peewee-built queries or plain SQL.
+
+    Queries are built with the same peewee models as the WSGI app and only
+    executed here, so both serving modes read and write identical SQL.
+    """
+
+    def __init__(self):
+        self.pool = None
+
+    async def connect(self, database, min_size, max_size):
+        self.pool = await asyncpg.create_pool(
+            database=database['name'],
+            user=database['user'],
+            password=database['password'],
+            host=database['host'],
+            port=database['port'],
+            min_size=min_size,
+            max_size=max_size,
+        )
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+    @staticmethod
+    def _sql(query, params):
+        if isinstance(query, str):
+            return query, list(params or ())
+        sql, params = query.sql()
+        return to_asyncpg(sql, list(params))
+
+    async def fetch(self, query, params=None, connection=None):
+        sql, args = self._sql(query, params)
+        if connection is not None:
+            return await connection.fetch(sql, *args)
+        return await self.pool.fetch(sql, *args)
+
+    async def fetchval(self, query, params=None, connection=None):
+        sql, args = self._sql(query, params)
+        if connection is not None:
+            return await connection.fetchval(sql, *args)
+        return await self.pool.fetchval(sql, *args)
+
+    async def execute(self, query, params=None, connection=None):
+        sql, args = self._sql(query, params)
+        if connection is not None:
+            return await connection.execute(sql, *args)
+        return await self.pool.execute(sql, *args)
+
+
+adb = AsyncDatabase()
@@ -0,0 +1,138 @@
+import json
+import uuid
+import asyncio
+import asyncpg
+from peewee import fn
+from app.model.models import db, Feature, ChangeLog
+from app.model.exeptions import SetpointsOperationError
+from app.model.changelog import build_changes
+from app.model.setpoints.feature import (FEATURE_FIELDS, feature_filters, update_returning_old_query,
+                                         instances_from_returning)
+from app.asgi.database import adb
+
+_CHANGELOG_INSERT = (
+    f'INSERT INTO "{ChangeLog._meta.table_name}" '
+    '(entity_type, entity_id, field_name, old_value, new_value, changed_by, changed_at, comment) '
+    'SELECT * FROM unnest($1::text[], $2::uuid[], $3::text[], $4::json[], $5::json[], '
+    '$6::text[], $7::timestamptz[], $8::text[])'
+)
+
+
+def _row_to_dict(row):
+    return {
+        'id': str(row['id']),
+        'name': row['name'],
+        'description': row['description'],
+        'type': row['type'],
+        'priority': row['priority'],
+        'default_threshold': row['default_threshold'],
+        'active': row['active'],
+    }
+
+
+def _error(e):
+    return SetpointsOperationError(message=str(e), item_type=Feature.__name__)
+
+
+async def run_sync(func, *args, **kwargs):
+    """Run a WSGI-side model function in a worker thread with its own pooled peewee connection"""
+    def call():
+        with db.connection_context():
+            return func(*args, **kwargs)
+    return await asyncio.to_thread(call)
+
+
+async def _write_changes(connection, changes):
+    if not changes:
+        return
+    await connection.execute(
+        _CHANGELOG_INSERT,
+        [change['entity_type'] for change in changes],
+        [change['entity_id'] for change in changes],
+        [change['field_name'] for change in changes],
+        [json.dumps(change['old_value']) for change in changes],
+        [json.dumps(change['new_value']) for change in changes],
+        [change['changed_by'] for change in changes],
+        [change['changed_at'] for change in changes],
+        [change['comment'] for change in changes])
+
+
+async def get_feature_page(after=None, limit=100, type=None, priority=None, active=None,
+                           name_prefix=None, with_total=False):
+    filters = feature_filters(type, priority, active, name_prefix)
+    page_query = Feature.select()
+    if filters:
+        page_query = page_query.where(*filters)
+    if after is not None:
+        page_query = page_query.where(Feature.id > after)
+    try:
+        rows = await adb.fetch(page_query.order_by(Feature.id).limit(limit + 1))
+        has_more = len(rows) > limit
+        items = [_row_to_dict(row) for row in rows[:limit]]
+        result = {
+            'items': items,
+            'next_cursor': items[-1]['id'] if has_more else None,
+        }
+        if with_total:
+            count_query = Feature.select(fn.COUNT(Feature.id))
+            if filters:
+                count_query = count_query.where(*filters)
+            result['total'] = await adb.fetchval(count_query)
+        return result
+    except asyncpg.PostgresError as e:
+        raise _error(e)
+
+
+async def get_feature_list(amount=None):
+    try:
+        rows = await adb.fetch(Feature.select().order_by(Feature.id).limit(amount))
+    except asyncpg.PostgresError as e:
+        raise _error(e)
+    return [_row_to_dict(row) for row in rows]
+
+
+async def get_feature_by_id(item_id):
+    try:
+        rows = await adb.fetch(Feature.select().where(Feature.id == item_id))
+    except asyncpg.PostgresError as e:
+        raise _error(e)
+    return _row_to_dict(rows[0]) if rows else {}
+
+
+async def add_feature(name, description=None, type=None, priority=None, default_threshold=None,
+                      active=True, changed_by='system', comment=None):
+    row = Feature(id=uuid.uuid4(), name=name, description=description, type=type, priority=priority,
+                  default_threshold=default_threshold, active=active)
+    insert = Feature.insert({getattr(Feature, name): getattr(row, name) for name in ('id',) + FEATURE_FIELDS})
+    try:
+        async with adb.pool.acquire() as connection:
+            async with connection.transaction():
+                await adb.execute(insert, connection=connection)
+                await _write_changes(connection, build_changes(None, row, changed_by, comment))
+    except asyncpg.PostgresError as e:
+        raise _error(e)
+    return row.id
+
+
+async def modify_feature(item_id, name, description=None, type=None, priority=None, default_threshold=None,
+                         active=True, changed_by='system', comment=None):
+    query = update_returning_old_query(item_id, {
+        Feature.name: name,
+        Feature.description: description,
+        Feature.type: type,
+        Feature.priority: priority,
+        Feature.default_threshold: default_threshold,
+        Feature.active: active,
+    })
+    try:
+        async with adb.pool.acquire() as connection:
+            async with connection.transaction():
+                rows = await adb.fetch(query, connection=connection)
+                if not rows:
+                    raise SetpointsOperationError(message=f'Error: {item_id} does not exist',
+                                                  item_type=Feature.__name__)
+                old_instance, new_instance = instances_from_returning(rows[0])
+                await _write_changes(connection, build_changes(old_instance, new_instance, changed_by, comment))
+    except asyncpg.PostgresError as e:
+        raise _error(e)
+    return {'id': str(new_instance.id), **{name: getattr(new_instance, name) for name in FEATURE_FIELDS}}
@@ -0,0 +1,260 @@
+import json
+import hashlib
+from marshmallow import ValidationError, EXCLUDE
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.routing import Route
+from werkzeug.http import HTTP_STATUS_CODES, parse_etags
+from app.model.exeptions import SetpointsOperationError
+from app.manage_app.logging import processes_logger
+from app.api.serialization import compile_schema
+from app.api.setpoints.feature.schemas import (
+    FeatureSchema, FeatureResponseSchema, FeatureListQuerySchema, FeaturePageResponseSchema,
+    FeatureBulkModifySchema, FeatureBulkResultSchema, AsOfQuerySchema, FeatureAsOfBatchSchema
+)
+from app.api.shemas import AmountQuerySchema, CommentQuerySchema, IdempotencyHeaderSchema
+from app.api.idempotency import idempotent
+from app.model.idempotency import IdempotencyKeyMismatch
+from app.model.history import HistoryArchived
+from app.model.setpoints.feature import (
+    _etag, add_feature as add_feature_sync, add_features, modify_features, upsert_feature,
+    get_feature_as_of, get_features_as_of
+)
+from app.asgi import feature
+from app.asgi.feature import run_sync
+
+PREFIX = "/api/processing/setpoints/features"
+
+feature_schema = FeatureSchema()
+feature_list_schema = FeatureResponseSchema(many=True)
+feature_many_schema = FeatureSchema(many=True)
+bulk_modify_schema = FeatureBulkModifySchema(many=True)
+bulk_result_schema = FeatureBulkResultSchema(many=True)
+list_query_schema = FeatureListQuerySchema()
+amount_query_schema = AmountQuerySchema()
+comment_query_schema = CommentQuerySchema()
+idempotency_header_schema = IdempotencyHeaderSchema()
+as_of_query_schema = AsOfQuerySchema()
+as_of_batch_schema = FeatureAsOfBatchSchema()
+
+
+class APIError(Exception):
+    """HTTP error rendered like flask_smorest.abort renders it"""
+
+    def __init__(self, code, message=None, errors=None):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+        self.errors = errors
+
+    def payload(self):
+        payload = {"code": self.code, "status": HTTP_STATUS_CODES[self.code]}
+        if self.message is not None:
+            payload["message"] = self.message
+        if self.errors is not None:
+            payload["errors"] = self.errors
+        return payload
+
+
+def json_response(data, status=200, headers=None):
+    # the same bytes as the Flask JSON provider: sorted keys, compact separators, trailing newline
+    body = json.dumps(data, sort_keys=True, separators=(",", ":")) + "\n"
+    return Response(body, status_code=status, headers=headers, media_type="application/json")
+
+
+async def api_error_handler(request, exc):
+    return json_response(exc.payload(), exc.code)
+
+
+def _load(schema, data, location):
+    try:
+        if location == "query":
+            return schema.load(data, unknown=EXCLUDE)
+        return schema.load(data)
+    except ValidationError as e:
+        raise APIError(422, errors={location: e.messages})
+
+
+def _query(request, schema):
+    return _load(schema, dict(request.query_params), "query")
+
+
+async def _body(request, schema):
+    raw = await request.body()
+    data = {}
+    if raw:
+        try:
+            data = json.loads(raw)
+        except ValueError:
+            raise APIError(400, errors={"json": ["Invalid JSON body."]})
+    return _load(schema, data, "json")
+
+
+def _idempotency_key(request):
+    key = request.headers.get("idempotency-key")
+    if key is None:
+        return None
+    return _load(idempotency_header_schema, {"Idempotency-Key": key}, "headers")["idempotency_key"]
+
+
+async def _run_idempotent(scope, key, request_data, operation):
+    """app.api.idempotency.idempotent() in a worker thread, returns (body, status, headers)"""
+    try:
+        body, status, headers = await run_sync(idempotent, scope, key, request_data, operation)
+    except IdempotencyKeyMismatch as e:
+        raise APIError(422, message=str(e))
+    except SetpointsOperationError as e:
+        raise _failed(e, 400)
+    return body, status, headers
+
+
+def _with_etag(request, schema, result, etag_data):
+    """Response with the ETag flask-smorest would set, 304 when If-None-Match matches"""
+    etag = hashlib.sha1(json.dumps(etag_data, sort_keys=True).encode()).hexdigest()
+    if etag in parse_etags(request.headers.get("if-none-match")):
+        return Response(status_code=304)
+    return json_response(compile_schema(schema)(result), headers={"ETag": f'"{etag}"'})
+
+
+def _failed(e, code):
+    processes_logger.error(str(e))
+    return APIError(code, message=str(e))
+
+
+async def feature_resource(request: Request):
+    if request.method == "GET":
+        args = _query(request, list_query_schema)
+        try:
+            result = await feature.get_feature_page(**args)
+        except SetpointsOperationError as e:
+            raise _failed(e, 500)
+        return _with_etag(request, FeaturePageResponseSchema, result, _etag(result))
+
+    key = _idempotency_key(request)
+    query_args = _query(request, comment_query_schema)
+    data = await _body(request, feature_schema)
+    if key is not None:
+        # the key is claimed in the transaction of the insert, that is the WSGI model code
+        def create():
+            feature_id = add_feature_sync(comment=query_args.get("comment"), **data)
+            return {"feature_id": str(feature_id)}, 201
+        body, status, headers = await _run_idempotent("POST /features", key, [query_args, data], create)
+        return json_response(body, status, headers)
+    try:
+        feature_id = await feature.add_feature(
+            name=data.get("name"),
+            description=data.get("description"),
+            type=data.get("type"),
+            priority=data.get("priority"),
+            default_threshold=data.get("default_threshold"),
+            active=data.get("active"),
+            comment=query_args.get("comment"),
+        )
+    except SetpointsOperationError as e:
+        raise _failed(e, 400)
+    return json_response({"feature_id": str(feature_id)}, 201)
+
+
+async def feature_bulk_resource(request: Request):
+    key = _idempotency_key(request) if request.method == "POST" else None
+    query_args = _query(request, comment_query_schema)
+    if request.method == "POST":
+        data = await _body(request, feature_many_schema)
+        func, status = add_features, 201
+        if key is not None:
+            body, status, headers = await _run_idempotent(
+                "POST /features/bulk", key, [query_args, data],
+                lambda: (add_features(data, comment=query_args.get("comment")), 201))
+            return json_response(compile_schema(bulk_result_schema)(body), status, headers)
+    else:
+        data = await _body(request, bulk_modify_schema)
+        func, status = modify_features, 200
+    try:
+        result = await run_sync(func, data, comment=query_args.get("comment"))
+    except SetpointsOperationError as e:
+        raise _failed(e, 400)
+    return json_response(compile_schema(bulk_result_schema)(result), status)
+
+
+async def feature_upsert_resource(request: Request):
+    query_args = _query(request, comment_query_schema)
+    data = await _body(request, feature_schema)
+    try:
+        result, created = await run_sync(upsert_feature, comment=query_args.get("comment"), **data)
+    except SetpointsOperationError as e:
+        raise _failed(e, 400)
+    return json_response(compile_schema(FeatureResponseSchema)(result), 201 if created else 200)
+
+
+async def feature_amount_resource(request: Request):
+    args = _query(request, amount_query_schema)
+    try:
+        result = await feature.get_feature_list(args.get("amount"))
+    except SetpointsOperationError as e:
+        raise _failed(e, 500)
+    return _with_etag(request, feature_list_schema, result, _etag(result))
+
+
+async def feature_by_id_resource(request: Request):
+    try:
+        result = await feature.get_feature_by_id(request.path_params["feature_id"])
+    except SetpointsOperationError as e:
+        raise _failed(e, 500)
+    return _with_etag(request, FeatureResponseSchema, result, _etag(result))
+
+
+async def feature_as_of_resource(request: Request):
+    feature_id = request.path_params["feature_id"]
+    args = _query(request, as_of_query_schema)
+    try:
+        result = await run_sync(get_feature_as_of, feature_id, args["ts"])
+    except HistoryArchived as e:
+        raise APIError(410, message=str(e))
+    except SetpointsOperationError as e:
+        raise _failed(e, 500)
+    if not result:
+        raise APIError(404, message=f"Feature {feature_id} did not exist at {args['ts'].isoformat()}")
+    return json_response(compile_schema(FeatureResponseSchema)(result))
+
+
+async def feature_as_of_batch_resource(request: Request):
+    data = await _body(request, as_of_batch_schema)
+    try:
+        result = await run_sync(get_features_as_of, data["ids"], data["ts"])
+    except HistoryArchived as e:
+        raise APIError(410, message=str(e))
+    except SetpointsOperationError as e:
+        raise _failed(e, 500)
+    return json_response(compile_schema(feature_list_schema)(result))
+
+
+async def feature_modify_resource(request: Request):
+    data = await _body(request, feature_schema)
+    query_args = _query(request, comment_query_schema)
+    try:
+        result = await feature.modify_feature(
+            item_id=request.path_params["feature_id"],
+            name=data.get("name"),
+            description=data.get("description"),
+            type=data.get("type"),
+            priority=data.get("priority"),
+            default_threshold=data.get("default_threshold"),
+            active=data.get("active"),
+            comment=query_args.get("comment"),
+        )
+    except SetpointsOperationError as e:
+        raise _failed(e, 400)
+    return json_response(compile_schema(FeatureResponseSchema)(result))
+
+
+# the same paths, methods and schemas as app.api.setpoints.feature.routes
+routes = [
+    Route(PREFIX, feature_resource, methods=["GET", "POST"]),
+    Route(f"{PREFIX}/bulk", feature_bulk_resource, methods=["POST", "PUT"]),
+    Route(f"{PREFIX}/by-name", feature_upsert_resource, methods=["PUT"]),
+    Route(f"{PREFIX}/amount", feature_amount_resource, methods=["GET"]),
+    Route(f"{PREFIX}/as-of", feature_as_of_batch_resource, methods=["POST"]),
+    Route(PREFIX + "/{feature_id:uuid}", feature_by_id_resource, methods=["GET"]),
+    Route(PREFIX + "/{feature_id:uuid}/as-of", feature_as_of_resource, methods=["GET"]),
+    Route(PREFIX + "/{feature_id:uuid}/settings", feature_modify_resource, methods=["PUT"]),
+]
@@ -1,26 +1,117 @@
-import jwt
 import os
+import signal
+import hashlib
+import threading
 from flask import request
 from flask_smorest import abort
 from app.manage_app.config import Config
+from app.manage_app.cache import TTLCache
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 PUBLIC_KEY_PATH = os.path.join(BASE_DIR, "keys", "public.pem")
 
+_cache_stats = {
+    "key_hits": 0,
+    "key_misses": 0,
+}
+
+
+class PublicKeyCache:
+    """Parsed RSA public key, reloaded when the file changes or on SIGHUP."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._key = None
+        self._mtime = None
+        self._force_reload = False
+
+    def invalidate(self):
+        self._force_reload = True
+
+    def get(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            mtime = None
+
+        key = self._key
+        if key is not None and mtime == self._mtime and not self._force_reload:
+            _cache_stats["key_hits"] += 1
+            return key
+
+        # imported on first use: jwt and cryptography add ~40 ms to every worker boot
+        from cryptography.hazmat.primitives.serialization import load_pem_public_key
+        with self._lock:
+            if self._key is None or mtime != self._mtime or self._force_reload:
+                _cache_stats["key_misses"] += 1
+                self._key = load_pem_public_key(load_public_key())
+                self._mtime = mtime
+                self._force_reload = False
+                # tokens verified with the previous key must be checked again
+                _token_cache.clear()
+            return self._key
+
+
+def _token_cache_key(token, audience):
+    return hashlib.sha256(token.encode()).hexdigest(), audience
+
+
+# verified payloads, entries never outlive the token's own `exp`
+_token_cache = TTLCache(Config.JWT_TOKEN_CACHE_SIZE, Config.JWT_TOKEN_CACHE_TTL)
+_public_key_cache = PublicKeyCache(PUBLIC_KEY_PATH)
+
 
 def load_public_key():
     with open(PUBLIC_KEY_PATH, "rb") as f:
         return f.read()
 
+
+def get_public_key():
+    return _public_key_cache.get()
+
+
+def install_key_reload_signal():
+    """Reload the public key on SIGHUP (key rotation without restart)."""
+    previous = signal.getsignal(signal.SIGHUP)
+
+    def handler(signum, frame):
+        _public_key_cache.invalidate()
+        if callable(previous):
+            previous(signum, frame)
+
+    try:
+        signal.signal(signal.SIGHUP, handler)
+    except ValueError:
+        # signal handlers can only be installed from the main thread
+        pass
+
+
+def get_auth_cache_stats():
+    stats = dict(_cache_stats)
+    token_stats = _token_cache.stats()
+    stats["token_hits"] = token_stats["hits"]
+    stats["token_misses"] = token_stats["misses"]
+    stats["token_cache_size"] = token_stats["size"]
+    return stats
+
+
 def verify_token(token, audience="*", expected_type=None):
-    payload = jwt.decode(
-        token,
-        load_public_key(),
-        algorithms=["RS256"],
-        audience=audience,
-        issuer="spawnx_users",
-        leeway=10
-    )
+    import jwt
+    # stat-only check on the key file, drops cached tokens after rotation
+    public_key = get_public_key()
+    key = _token_cache_key(token, audience)
+    payload = _token_cache.get(key)
+    if payload is None:
+        payload = jwt.decode(
+            token,
+            public_key,
+            algorithms=["RS256"],
+            audience=audience,
+            issuer="spawnx_users",
+            leeway=10
+        )
+        _token_cache.put(key, payload, expires_at=payload.get("exp"))
     if expected_type and payload.get("type") != expected_type:
         raise jwt.InvalidTokenError("Token type mismatch")
     return payload
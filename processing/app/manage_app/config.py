@@ -26,6 +26,119 @@ class Config:
         'password': os.getenv('TESTING_DB_PASSWORD')
     }
 
+    # Пул соединений с БД (на один процесс gunicorn). Соединение, простоявшее
+    # в пуле дольше DB_POOL_PRE_PING_IDLE_SECONDS, проверяется SELECT 1 перед
+    # выдачей (0 - не проверять); занятые соединения не проверяются
+    DB_MAX_CONNECTIONS = int(os.getenv('DB_MAX_CONNECTIONS', 8))
+    DB_STALE_TIMEOUT = int(os.getenv('DB_STALE_TIMEOUT', 300))
+    DB_POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT', 10))
+    DB_POOL_PRE_PING_IDLE_SECONDS = float(os.getenv('DB_POOL_PRE_PING_IDLE_SECONDS', 60))
+
+    # Кэш проверенных JWT (размер и время жизни записи в секундах)
+    JWT_TOKEN_CACHE_SIZE = int(os.getenv('JWT_TOKEN_CACHE_SIZE', 1024))
+    JWT_TOKEN_CACHE_TTL = int(os.getenv('JWT_TOKEN_CACHE_TTL', 300))
+
+    # Кэш чтения признаков; NOTIFY об измененных признаках шлет триггер таблицы feature,
+    # воркеры сбрасывают кэш через LISTEN; FEATURE_CACHE_NOTIFY=0 отключает прослушивание
+    # (допустимо только при одном воркере)
+    FEATURE_CACHE_SIZE = int(os.getenv('FEATURE_CACHE_SIZE', 2048))
+    FEATURE_CACHE_TTL = int(os.getenv('FEATURE_CACHE_TTL', 60))
+    FEATURE_CACHE_NOTIFY = os.getenv('FEATURE_CACHE_NOTIFY', '1') == '1'
+
+    # Фоновая запись журнала изменений (по умолчанию синхронно, как в тестах)
+    CHANGELOG_ASYNC = os.getenv('CHANGELOG_ASYNC', '0') == '1'
+    CHANGELOG_QUEUE_SIZE = int(os.getenv('CHANGELOG_QUEUE_SIZE', 1000))
+    CHANGELOG_BATCH_ROWS = int(os.getenv('CHANGELOG_BATCH_ROWS', 500))
+    CHANGELOG_FLUSH_INTERVAL_MS = int(os.getenv('CHANGELOG_FLUSH_INTERVAL_MS', 200))
+    CHANGELOG_PUT_TIMEOUT_MS = int(os.getenv('CHANGELOG_PUT_TIMEOUT_MS', 500))
+
+    # Помесячные секции журнала изменений: сколько месяцев создавать заранее,
+    # сколько хранить (0 - хранить всё) и куда выгружать архив
+    CHANGELOG_PARTITION_MONTHS_AHEAD = int(os.getenv('CHANGELOG_PARTITION_MONTHS_AHEAD', 3))
+    CHANGELOG_RETENTION_MONTHS = int(os.getenv('CHANGELOG_RETENTION_MONTHS', 0))
+    CHANGELOG_ARCHIVE_DIR = os.getenv('CHANGELOG_ARCHIVE_DIR', 'archive/changelog')
+
+    # Снимки состояния сущностей для восстановления истории "на момент времени":
+    # снимок сохраняется после воспроизведения стольких строк журнала, но только
+    # для истории старше SNAPSHOT_SETTLE_SECONDS
+    SNAPSHOT_REPLAY_THRESHOLD = int(os.getenv('SNAPSHOT_REPLAY_THRESHOLD', 50))
+    SNAPSHOT_SETTLE_SECONDS = int(os.getenv('SNAPSHOT_SETTLE_SECONDS', 300))
+
+    # Скомпилированные наборы уставок пересобираются при смене версии уставок;
+    # версия перечитывается из БД не чаще раза в THRESHOLD_VERSION_CHECK_SECONDS,
+    # THRESHOLD_VERSION_NOTIFY=1 включает мгновенное оповещение через LISTEN/NOTIFY
+    THRESHOLD_VERSION_CHECK_SECONDS = float(os.getenv('THRESHOLD_VERSION_CHECK_SECONDS', 5))
+    THRESHOLD_VERSION_NOTIFY = os.getenv('THRESHOLD_VERSION_NOTIFY', '0') == '1'
+
+    # Потоковая проверка уставок: состояние прогона сохраняется в БД не реже раза
+    # в STREAM_CHECKPOINT_INTERVAL_MS и в конце каждого запроса; прогоны без запросов
+    # дольше STREAM_IDLE_SECONDS выгружаются из памяти воркера (останется сохраненное).
+    # STREAM_MAX_LINE_BYTES - предельный размер одной микро-пачки в NDJSON
+    STREAM_CHECKPOINT_INTERVAL_MS = int(os.getenv('STREAM_CHECKPOINT_INTERVAL_MS', 5000))
+    STREAM_IDLE_SECONDS = int(os.getenv('STREAM_IDLE_SECONDS', 600))
+    STREAM_MAX_LINE_BYTES = int(os.getenv('STREAM_MAX_LINE_BYTES', 4 * 1024 * 1024))
+
+    # Очередь расчетов (processing_worker.py): JOB_PROCESSES процессов расчета
+    # (0 - по числу доступных ядер), очередь опрашивается не реже раза в
+    # JOB_POLL_SECONDS (новые задачи будят воркер через LISTEN/NOTIFY). Воркер
+    # отмечает занятые задачи раз в JOB_HEARTBEAT_SECONDS; задача без отметки
+    # дольше JOB_LEASE_SECONDS (воркер упал) возвращается в очередь. Неудачная
+    # попытка повторяется до JOB_MAX_ATTEMPTS раз с задержкой
+    # JOB_RETRY_DELAY_SECONDS * 2^(попытка - 1). Файлы результатов - в JOB_RESULT_DIR
+    JOB_PROCESSES = int(os.getenv('JOB_PROCESSES', 0))
+    JOB_POLL_SECONDS = float(os.getenv('JOB_POLL_SECONDS', 5))
+    JOB_HEARTBEAT_SECONDS = float(os.getenv('JOB_HEARTBEAT_SECONDS', 10))
+    JOB_LEASE_SECONDS = int(os.getenv('JOB_LEASE_SECONDS', 60))
+    JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', 3))
+    JOB_RETRY_DELAY_SECONDS = int(os.getenv('JOB_RETRY_DELAY_SECONDS', 30))
+    JOB_PROGRESS_INTERVAL_MS = int(os.getenv('JOB_PROGRESS_INTERVAL_MS', 1000))
+    JOB_RESULT_DIR = os.getenv('JOB_RESULT_DIR', 'results/jobs')
+
+    # Потоковая выгрузка: строки читаются именованным курсором пачками по
+    # EXPORT_FETCH_ROWS и отдаются клиенту кусками по EXPORT_CHUNK_ROWS строк
+    EXPORT_FETCH_ROWS = int(os.getenv('EXPORT_FETCH_ROWS', 2000))
+    EXPORT_CHUNK_ROWS = int(os.getenv('EXPORT_CHUNK_ROWS', 500))
+
+    # Быстрая сериализация ответов GET без marshmallow (тот же JSON побайтно)
+    FAST_SERIALIZATION = os.getenv('FAST_SERIALIZATION', '0') == '1'
+
+    # Повторы POST с заголовком Idempotency-Key возвращают сохраненный ответ
+    # IDEMPOTENCY_TTL_HOURS часов. FEATURE_UNIQUE_NAMES=1 - уникальный индекс на
+    # имя признака (создает processing_migrate.py) и upsert по имени
+    IDEMPOTENCY_TTL_HOURS = int(os.getenv('IDEMPOTENCY_TTL_HOURS', 24))
+    FEATURE_UNIQUE_NAMES = os.getenv('FEATURE_UNIQUE_NAMES', '0') == '1'
+
+    # gunicorn.conf.py: 0 - по числу доступных ядер (CPU + 1 воркер, потоков
+    # не больше DB_MAX_CONNECTIONS). Каждый воркер держит до DB_MAX_CONNECTIONS
+    # соединений плюс соединения LISTEN, это должно помещаться в max_connections Postgres
+    GUNICORN_WORKERS = int(os.getenv('GUNICORN_WORKERS', 0))
+    GUNICORN_THREADS = int(os.getenv('GUNICORN_THREADS', 0))
+    GUNICORN_PRELOAD = os.getenv('GUNICORN_PRELOAD', '1') == '1'
+    GUNICORN_BIND = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+    # Выставляет gunicorn.conf.py при preload: create_app() в мастере не запускает
+    # потоки и соединения, это делает init_worker() в каждом воркере после fork
+    DEFER_WORKER_INIT = False
+
+    # ASGI-режим (uvicorn processing_asgi:app): размер пула asyncpg на процесс
+    ASGI_DB_MIN_CONNECTIONS = int(os.getenv('ASGI_DB_MIN_CONNECTIONS', 2))
+    ASGI_DB_MAX_CONNECTIONS = int(os.getenv('ASGI_DB_MAX_CONNECTIONS', 20))
+
+    # Метрики запросов (время, время в БД, число SQL-запросов) в формате Prometheus
+    METRICS_PATH = os.getenv('METRICS_PATH', '/api/processing/metrics')
+    # Каталог, через который воркеры gunicorn сводят гистограммы в один ответ
+    # (раз в METRICS_FLUSH_SECONDS каждый воркер пишет туда свои); пусто - только свой процесс
+    METRICS_DIR = os.getenv('METRICS_DIR', '')
+    METRICS_FLUSH_SECONDS = float(os.getenv('METRICS_FLUSH_SECONDS', 1))
+
+    # Сэмплирующий профайлер: доля профилируемых запросов, порог "медленного"
+    # запроса, период снятия стеков; ?profile=1 работает только с заголовком
+    # X-Profile-Token, равным PROFILE_TOKEN. Стеки пишутся в PROFILE_DIR (*.folded)
+    PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0))
+    PROFILE_SLOW_MS = int(os.getenv('PROFILE_SLOW_MS', 500))
+    PROFILE_INTERVAL_MS = int(os.getenv('PROFILE_INTERVAL_MS', 5))
+    PROFILE_TOKEN = os.getenv('PROFILE_TOKEN', '')
+    PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+
     if os.getenv('APP_ENV') == 'development':
         LOG_LEVEL = logging.DEBUG
         LOG_FILEMODE = 'w'
@@ -42,6 +155,18 @@ class Config:
         LOG_MAX_BYTES = 1*1024*1024  # 5 MB
         LOG_BACKUP_COUNT = 5
 
+    # Логи пишутся отдельным потоком: записи копятся в очереди LOG_QUEUE_SIZE и
+    # сбрасываются в файл пачками до LOG_BATCH_SIZE записей не реже раза в
+    # LOG_FLUSH_INTERVAL_MS. При переполнении очереди LOG_QUEUE_POLICY=drop
+    # отбрасывает запись сразу, block ждёт до LOG_QUEUE_BLOCK_TIMEOUT_MS.
+    # LOG_JSON=1 - одна JSON-запись на строку
+    LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 10000))
+    LOG_QUEUE_POLICY = os.getenv('LOG_QUEUE_POLICY', 'drop')
+    LOG_QUEUE_BLOCK_TIMEOUT_MS = int(os.getenv('LOG_QUEUE_BLOCK_TIMEOUT_MS', 100))
+    LOG_BATCH_SIZE = int(os.getenv('LOG_BATCH_SIZE', 200))
+    LOG_FLUSH_INTERVAL_MS = int(os.getenv('LOG_FLUSH_INTERVAL_MS', 500))
+    LOG_JSON = os.getenv('LOG_JSON', '0') == '1'
+
     OPEN_ROUTS = {
                    '/api/processing/swagger/ui', '/docs', '/api/processes/swagger.json','/favicon.ico',
                    '/api/processing/swaggerui/droid-sans.css',
@@ -51,6 +176,7 @@ class Config:
                    '/api/processing/swaggerui/favicon-32x32.png',
                    '/api/processing/swaggerui/favicon-16x16.png',
                    '/api/processing/openapi.json',
+                   METRICS_PATH,
                    '/swagger/ui', '/docs', '/swagger.json',
                    '/swaggerui/droid-sans.css',
                    '/swaggerui/swagger-ui.css',
@@ -1,21 +1,21 @@
-import uuid
-import os
 import psycopg2
+import psycopg2.errors
 import traceback
 from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
-from app.model.models import create_all_tables, drop_all_tables
+from app.manage_app.config import Config
 
 
-def ensure_database_exists():
-    db_name = os.getenv('DB_NAME')
-    port = os.getenv('DB_PORT')
-    host = os.getenv('DB_HOST')
+def ensure_database_exists(database=None):
+    database = database or Config.DATABASE
+    db_name = database['name']
+    port = database['port']
+    host = database['host']
 
     try:
         conn = psycopg2.connect(
             dbname='postgres',
-            user=os.getenv('DB_USER'),
-            password=os.getenv('DB_PASSWORD'),
+            user=database['user'],
+            password=database['password'],
             host=host,
             port=port
         )
@@ -31,7 +31,11 @@ def ensure_database_exists():
     )
     exists = cur.fetchone()
     if not exists:
-        cur.execute(f'CREATE DATABASE "{db_name}";')
+        try:
+            cur.execute(f'CREATE DATABASE "{db_name}";')
+        except (psycopg2.errors.DuplicateDatabase, psycopg2.errors.UniqueViolation):
+            # создана сервисом, запущенным одновременно с этим (гонка дает UniqueViolation)
+            pass
         # print(f'Database "{db_name}" created')
     else:
         pass
@@ -39,9 +43,3 @@ def ensure_database_exists():
     cur.close()
     conn.close()
 
-
-def create_tables():
-    create_all_tables()
-    # drop_all_tables()
-    pass
-
@@ -1,16 +1,174 @@
 import logging
 import os
+import json
+import time
+import queue
+import atexit
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler
 from concurrent_log_handler import ConcurrentRotatingFileHandler
 
 processes_logger = logging.getLogger("processes_logger")
 
+_STOP = object()
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line"""
+
+    def format(self, record):
+        data = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "pid": record.process,
+            "thread": record.threadName,
+        }
+        if record.exc_text:
+            data["exc"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class PolicyQueueHandler(QueueHandler):
+    """QueueHandler that drops the record (policy 'drop') or waits up to block_timeout
+    seconds and then drops it (policy 'block') when the queue is full"""
+
+    def __init__(self, log_queue, policy="drop", block_timeout=0.1):
+        super().__init__(log_queue)
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.dropped = 0
+
+    def prepare(self, record):
+        # the traceback has to be rendered here, the frames are gone once the writer gets it
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            if self.policy == "block":
+                self.queue.put(record, timeout=self.block_timeout)
+            else:
+                self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class BatchingLogWriter(threading.Thread):
+    """Writes queued records through one handler, many records per write.
+
+    A batch is formatted line by line and handed to the handler as a single
+    record, so the file lock and flush of the handler are paid once per batch.
+    """
+
+    def __init__(self, log_queue, handler, formatter, batch_size=200, flush_interval=0.5):
+        super().__init__(name="log-writer", daemon=True)
+        self.queue = log_queue
+        self.handler = handler
+        self.formatter = formatter
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.batches = 0
+        handler.setFormatter(logging.Formatter("%(message)s"))
+
+    def _collect(self):
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size and batch[-1] is not _STOP:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, records):
+        lines = []
+        for record in records:
+            if record.levelno >= self.handler.level:
+                try:
+                    lines.append(self.formatter.format(record))
+                except Exception:
+                    self.handler.handleError(record)
+        if not lines:
+            return
+        top = max(records, key=lambda record: record.levelno)
+        batch = logging.makeLogRecord({"name": top.name, "levelno": top.levelno,
+                                       "levelname": top.levelname, "msg": "\n".join(lines)})
+        self.handler.handle(batch)
+        self.batches += 1
+
+    def run(self):
+        while True:
+            batch = self._collect()
+            stop = batch[-1] is _STOP
+            if stop:
+                batch.pop()
+            if batch:
+                self._write(batch)
+            if stop:
+                return
+
+    def stop(self, timeout=5):
+        """Write everything queued so far and stop the thread"""
+        try:
+            self.queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            return
+        self.join(timeout)
+        self.handler.close()
+
+
+_queue_handler = None
+_writer = None
+_loggers = []
+
+
+def stop_logging():
+    """Write out the queue and stop the writer thread, loggers are detached from the queue"""
+    global _queue_handler, _writer
+    if _queue_handler is not None:
+        for logger in _loggers:
+            logger.removeHandler(_queue_handler)
+    if _writer is not None:
+        _writer.stop()
+    _queue_handler = None
+    _writer = None
+    _loggers.clear()
+
+
+atexit.register(stop_logging)
+
+
+def get_logging_stats():
+    if _queue_handler is None:
+        return None
+    return {"queued": _queue_handler.queue.qsize(),
+            "dropped": _queue_handler.dropped,
+            "batches": _writer.batches}
+
+
 def configure_logging(app):
-    log_level = app.config['LOG_LEVEL']
-    log_file = app.config['LOG_FILE']
-    log_filemode = app.config['LOG_FILEMODE']
-    log_format = app.config['LOG_FORMAT']
-    log_max_bytes = app.config['LOG_MAX_BYTES']
-    log_backup_count = app.config['LOG_BACKUP_COUNT']
+    setup_logging(app.config, app.logger)
+
+
+def setup_logging(config, app_logger=None):
+    """config: mapping with the LOG_* settings (app.config or the ASGI app's settings)"""
+    log_level = config['LOG_LEVEL']
+    log_file = config['LOG_FILE']
+    log_filemode = config['LOG_FILEMODE']
+    log_format = config['LOG_FORMAT']
+    log_max_bytes = config['LOG_MAX_BYTES']
+    log_backup_count = config['LOG_BACKUP_COUNT']
 
 
     # ---------
@@ -41,27 +199,46 @@ def configure_logging(app):
     # file_handler.setFormatter(logging.Formatter(log_format))
     # file_handler.setLevel(log_level)
 
+    # Все логгеры пишут в очередь, в файл пишет только фоновый поток
+    global _queue_handler, _writer
+    stop_logging()
+    formatter = JsonFormatter() if config['LOG_JSON'] else logging.Formatter(log_format)
+    log_queue = queue.Queue(maxsize=config['LOG_QUEUE_SIZE'])
+    queue_handler = PolicyQueueHandler(log_queue,
+                                       policy=config['LOG_QUEUE_POLICY'],
+                                       block_timeout=config['LOG_QUEUE_BLOCK_TIMEOUT_MS'] / 1000)
+    queue_handler.setLevel(log_level)
+    writer = BatchingLogWriter(log_queue, file_handler, formatter,
+                               batch_size=config['LOG_BATCH_SIZE'],
+                               flush_interval=config['LOG_FLUSH_INTERVAL_MS'] / 1000)
+    writer.start()
+    _queue_handler, _writer = queue_handler, writer
+    _loggers.extend([logging.getLogger(), logging.getLogger('werkzeug'), processes_logger])
+    if app_logger is not None:
+        _loggers.append(app_logger)
+
     # Настройка корневого логгера
     root_logger = logging.getLogger()
     root_logger.handlers.clear()
-    root_logger.addHandler(file_handler)
+    root_logger.addHandler(queue_handler)
     root_logger.setLevel(log_level)
 
     # Логгер Flask
-    app.logger.handlers.clear()
-    app.logger.addHandler(file_handler)
-    app.logger.setLevel(log_level)
-    app.logger.propagate = False
+    if app_logger is not None:
+        app_logger.handlers.clear()
+        app_logger.addHandler(queue_handler)
+        app_logger.setLevel(log_level)
+        app_logger.propagate = False
 
     # Werkzeug
     werkzeug_logger = logging.getLogger('werkzeug')
     werkzeug_logger.handlers.clear()
-    werkzeug_logger.addHandler(file_handler)
+    werkzeug_logger.addHandler(queue_handler)
     werkzeug_logger.setLevel(log_level)
     werkzeug_logger.propagate = False
 
     # Processes
     processes_logger.handlers.clear()
-    processes_logger.addHandler(file_handler)
+    processes_logger.addHandler(queue_handler)
     processes_logger.setLevel(log_level)
-    processes_logger.propagate = False
\ No newline at end of file
+    processes_logger.propagate = False
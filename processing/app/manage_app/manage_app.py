@@ -1,16 +1,31 @@
+import time
+import atexit
 from flask import render_template
 from flask import Flask, request
 from flask_smorest import Api
-from app.auth.auth import check_token
+from app.auth.auth import check_token, install_key_reload_signal
 from app.manage_app.config import Config
 from app.manage_app.logging import configure_logging, processes_logger
+from app.manage_app.metrics import install_request_metrics
+from app.manage_app.profiler import install_profiler
 from app.model.models import db
-from app.manage_app.default_units import ensure_database_exists, create_tables
+from app.model.migrations import check_schema_version
 
+from app.model.changelog import start_changelog_writer, stop_changelog_writer
+from app.model.setpoints.feature import start_feature_cache_listener
+from app.model.setpoints.compiled import start_threshold_version_listener
 from app.api.setpoints.feature.routes import blp as feature_blueprint
+from app.api.setpoints.threshold_set.routes import blp as threshold_set_blueprint
+from app.api.setpoints.threshold.routes import blp as threshold_blueprint
+from app.api.changelog.routes import blp as changelog_blueprint
+from app.api.setpoints.evaluation.routes import blp as evaluation_blueprint
+from app.api.setpoints.stream.routes import blp as stream_blueprint
+from app.api.export.routes import blp as export_blueprint
+from app.api.jobs.routes import blp as jobs_blueprint
 
 
 def create_app(tests=False):
+    started = time.perf_counter()
     app = Flask(__name__, template_folder="templates")
 
     @app.route("/api/processing/swagger/ui")
@@ -42,7 +57,12 @@ def create_app(tests=False):
         }
     })
 
-    ensure_database_exists()
+    pool_options = {
+        'max_connections': app.config['DB_MAX_CONNECTIONS'],
+        'stale_timeout': app.config['DB_STALE_TIMEOUT'],
+        'timeout': app.config['DB_POOL_TIMEOUT'],
+        'pre_ping_idle': app.config['DB_POOL_PRE_PING_IDLE_SECONDS'],
+    }
 
     if tests:
         db.init(
@@ -51,6 +71,7 @@ def create_app(tests=False):
             password=app.config['DATABASE_TEST']['password'],
             host=app.config['DATABASE_TEST']['host'],
             port=app.config['DATABASE_TEST']['port'],
+            **pool_options,
         )
     else:
         db.init(
@@ -59,9 +80,14 @@ def create_app(tests=False):
             password=app.config['DATABASE']['password'],
             host=app.config['DATABASE']['host'],
             port=app.config['DATABASE']['port'],
+            **pool_options,
         )
 
-    create_tables()
+    # схему создает и обновляет processing_migrate.py, здесь только проверка версии
+    with db.connection_context():
+        check_schema_version()
+    # соединение, открытое при проверке, не должно оставаться в пуле
+    db.close_all()
 
     configure_logging(app)
 
@@ -69,6 +95,18 @@ def create_app(tests=False):
     def log_request_info():
         processes_logger.info(f"Received {request.method} request to {request.path}")
 
+    @app.before_request
+    def open_db_connection():
+        db.connect(reuse_if_open=True)
+
+    @app.teardown_request
+    def close_db_connection(exc):
+        if not db.is_closed():
+            db.close()
+
+    install_request_metrics(app)
+    install_profiler(app)
+
     @app.errorhandler(Exception)
     def handle_exception(e):
         processes_logger.error(f"Unhandled exception: {str(e)}", exc_info=True)
@@ -80,5 +118,64 @@ def create_app(tests=False):
 
     api = Api(app)
     api.register_blueprint(feature_blueprint)
+    api.register_blueprint(threshold_set_blueprint)
+    api.register_blueprint(threshold_blueprint)
+    api.register_blueprint(changelog_blueprint)
+    api.register_blueprint(evaluation_blueprint)
+    api.register_blueprint(stream_blueprint)
+    api.register_blueprint(export_blueprint)
+    api.register_blueprint(jobs_blueprint)
 
+    if app.config['DEFER_WORKER_INIT']:
+        # gunicorn --preload: это мастер, воркеры получат готовое после fork
+        preload_shared(api)
+    else:
+        init_worker(app, tests)
+
+    processes_logger.info(f"Application created in {(time.perf_counter() - started) * 1000:.0f} ms")
     return app
+
+
+def preload_shared(api):
+    """Work done once in the gunicorn master, shared by the workers copy-on-write"""
+    # imported lazily on the first request otherwise
+    import jwt  # noqa: F401
+    import numpy  # noqa: F401
+    from cryptography.hazmat.primitives.serialization import load_pem_public_key  # noqa: F401
+    from app.model.setpoints.evaluation import evaluate_batch  # noqa: F401
+    # resolves every schema of the OpenAPI spec
+    api.spec.to_dict()
+
+
+def init_worker(app, tests=False):
+    """Per-process state: log writer, key reload signal, change-log writer, NOTIFY listeners.
+
+    Called by create_app(), or by the gunicorn post_worker_init hook in every
+    worker when the app was preloaded in the master (DEFER_WORKER_INIT).
+    """
+    database = app.config['DATABASE_TEST'] if tests else app.config['DATABASE']
+    if app.config['DEFER_WORKER_INIT']:
+        configure_logging(app)
+    install_key_reload_signal()
+
+    if app.config['CHANGELOG_ASYNC'] and not tests:
+        start_changelog_writer(
+            max_queue=app.config['CHANGELOG_QUEUE_SIZE'],
+            batch_rows=app.config['CHANGELOG_BATCH_ROWS'],
+            flush_interval=app.config['CHANGELOG_FLUSH_INTERVAL_MS'] / 1000,
+            put_timeout=app.config['CHANGELOG_PUT_TIMEOUT_MS'] / 1000,
+        )
+        # дописываем очередь журнала при остановке воркера
+        atexit.register(stop_changelog_writer)
+
+    listen_params = {
+        'dbname': database['name'],
+        'user': database['user'],
+        'password': database['password'],
+        'host': database['host'],
+        'port': database['port'],
+    }
+    if app.config['FEATURE_CACHE_NOTIFY']:
+        start_feature_cache_listener(listen_params)
+    if app.config['THRESHOLD_VERSION_NOTIFY']:
+        start_threshold_version_listener(listen_params)
@@ -0,0 +1,235 @@
+import os
+import json
+import time
+import threading
+from bisect import bisect_left
+from flask import Response, g, request
+from app.manage_app.config import Config
+from app.manage_app.logging import get_logging_stats, processes_logger
+from app.model.models import db
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+METRICS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Histogram:
+    """Cumulative histogram in the Prometheus text format, one series per label set"""
+
+    def __init__(self, name, documentation, labelnames, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+        self.observed = 0
+
+    def observe(self, labels, value):
+        _start_flusher()
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            self.observed += 1
+
+    def snapshot(self):
+        """{labels: (bucket counts, sum)} observed by this process"""
+        with self._lock:
+            return {labels: (list(counts), total) for labels, (counts, total) in self._series.items()}
+
+    def render(self, series=None):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        if series is None:
+            series = self.snapshot()
+        for labels, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f'{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labelnames, labels)} {total}')
+            lines.append(f'{self.name}_count{_labels(self.labelnames, labels)} {cumulative}')
+        return lines
+
+
+REQUEST_DURATION = Histogram('processing_request_duration_seconds',
+                             'Wall time of a request by route', ('method', 'route', 'status'),
+                             DURATION_BUCKETS)
+REQUEST_DB_DURATION = Histogram('processing_request_db_seconds',
+                                'Time spent in SQL statements per request by route', ('method', 'route'),
+                                DURATION_BUCKETS)
+REQUEST_QUERIES = Histogram('processing_request_queries',
+                            'SQL statements executed per request by route', ('method', 'route'),
+                            QUERY_COUNT_BUCKETS)
+HISTOGRAMS = (REQUEST_DURATION, REQUEST_DB_DURATION, REQUEST_QUERIES)
+
+_flusher_pid = None
+_flusher_lock = threading.Lock()
+
+
+def _worker_file(pid):
+    return os.path.join(Config.METRICS_DIR, f'{pid}.json')
+
+
+def flush_metrics():
+    """Write the histograms of this process to METRICS_DIR, for the worker answering a scrape"""
+    data = {histogram.name: [[list(labels), counts, total]
+                             for labels, (counts, total) in histogram.snapshot().items()]
+            for histogram in HISTOGRAMS}
+    path = _worker_file(os.getpid())
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def _flush_loop():
+    flushed = None
+    while True:
+        time.sleep(Config.METRICS_FLUSH_SECONDS)
+        observed = sum(histogram.observed for histogram in HISTOGRAMS)
+        if observed == flushed:
+            continue
+        try:
+            flush_metrics()
+            flushed = observed
+        except OSError as e:
+            processes_logger.warning(f"Request metrics were not flushed: {e}")
+
+
+def _start_flusher():
+    # lazily in every worker: with preload_app nothing may start threads in the master before fork
+    global _flusher_pid
+    if not Config.METRICS_DIR or _flusher_pid == os.getpid():
+        return
+    with _flusher_lock:
+        if _flusher_pid != os.getpid():
+            _flusher_pid = os.getpid()
+            threading.Thread(target=_flush_loop, name='metrics-flush', daemon=True).start()
+
+
+def _merge(target, series):
+    for labels, (counts, total) in series:
+        merged = target.get(labels)
+        if merged is None:
+            target[labels] = (list(counts), total)
+        else:
+            target[labels] = ([a + b for a, b in zip(merged[0], counts)], merged[1] + total)
+
+
+def _collect_histograms():
+    """{name: series} of this process plus every other worker that flushed to METRICS_DIR.
+
+    Files of exited workers stay, their requests remain counted; the
+    directory is emptied when gunicorn starts.
+    """
+    collected = {histogram.name: histogram.snapshot() for histogram in HISTOGRAMS}
+    if not Config.METRICS_DIR:
+        return collected
+    own = os.path.basename(_worker_file(os.getpid()))
+    try:
+        entries = [entry.path for entry in os.scandir(Config.METRICS_DIR)
+                   if entry.name.endswith('.json') and entry.name != own]
+    except FileNotFoundError:
+        return collected
+    for path in entries:
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for name, series in data.items():
+            if name in collected:
+                _merge(collected[name], ((tuple(labels), (counts, total)) for labels, counts, total in series))
+    return collected
+
+
+def _gauges(prefix, stats, pid):
+    lines = []
+    for key, value in sorted((stats or {}).items()):
+        if isinstance(value, dict):
+            lines.extend(_gauges(f'{prefix}_{key}', value, pid))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            lines.append(f'# TYPE {prefix}_{key} gauge')
+            lines.append(f'{prefix}_{key}{{pid="{pid}"}} {value}')
+    return lines
+
+
+def _stats_gauges():
+    # imported here: the stats providers pull in the whole model layer
+    from app.auth.auth import get_auth_cache_stats
+    from app.model.changelog import get_changelog_writer_stats
+    from app.model.setpoints.feature import get_feature_cache_stats
+
+    pid = os.getpid()
+    lines = _gauges('processing_db_pool', db.get_pool_stats(), pid)
+    lines += _gauges('processing_auth', get_auth_cache_stats(), pid)
+    lines += _gauges('processing_feature_cache', get_feature_cache_stats(), pid)
+    lines += _gauges('processing_changelog_writer', get_changelog_writer_stats(), pid)
+    lines += _gauges('processing_logging', get_logging_stats(), pid)
+    return lines
+
+
+def render_metrics():
+    lines = []
+    collected = _collect_histograms()
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.render(collected[histogram.name]))
+    lines.extend(_stats_gauges())
+    return '\n'.join(lines) + '\n'
+
+
+def _route():
+    rule = request.url_rule
+    return rule.rule if rule is not None else 'unmatched'
+
+
+def install_request_metrics(app):
+    """Time every request, count its SQL statements and serve them at METRICS_PATH.
+
+    With METRICS_DIR set (gunicorn.conf.py does it) every worker flushes its
+    histograms there and a scrape returns the sum over all workers. Without
+    it, and for the gauges always, the numbers are those of the answering
+    process; the gauges carry its pid.
+    """
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+        db.track_queries()
+
+    @app.after_request
+    def remember_status(response):
+        g.response_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def observe_request(exc):
+        started = g.pop('request_started', None)
+        # an earlier before_request hook may have answered before tracking started
+        queries = db.pop_query_stats() if started is not None else None
+        if started is None or request.path == Config.METRICS_PATH:
+            return
+        route = _route()
+        status = g.pop('response_status', 500)
+        REQUEST_DURATION.observe((request.method, route, str(status)), time.perf_counter() - started)
+        if queries is not None:
+            REQUEST_DB_DURATION.observe((request.method, route), queries['seconds'])
+            REQUEST_QUERIES.observe((request.method, route), queries['count'])
+
+    @app.route(Config.METRICS_PATH)
+    def metrics():
+        return Response(render_metrics(), mimetype=None, content_type=METRICS_CONTENT_TYPE)
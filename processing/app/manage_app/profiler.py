@@ -0,0 +1,125 @@
+import os
+import re
+import sys
+import hmac
+import time
+import random
+import threading
+from collections import Counter
+from datetime import datetime, timezone
+from flask import g, request
+from app.manage_app.config import Config
+from app.manage_app.logging import processes_logger
+
+
+def _fold(frame):
+    """Stack of frame in the collapsed (flamegraph.pl / speedscope) format, root first"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{frame.f_globals.get('__name__', '?')}:{code.co_name}")
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class StackSampler(threading.Thread):
+    """Samples the stacks of registered threads every interval seconds.
+
+    Only threads serving a profiled request are registered, the sampler itself
+    idles otherwise.
+    """
+
+    def __init__(self, interval):
+        super().__init__(name="stack-sampler", daemon=True)
+        self.interval = interval
+        self._targets = {}
+        self._lock = threading.Lock()
+
+    def add(self, thread_id):
+        with self._lock:
+            self._targets[thread_id] = Counter()
+
+    def remove(self, thread_id):
+        with self._lock:
+            return self._targets.pop(thread_id, Counter())
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            if not self._targets:
+                continue
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_id, stacks in self._targets.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        stacks[_fold(frame)] += 1
+
+
+_sampler = None
+_sampler_lock = threading.Lock()
+
+
+def _get_sampler():
+    global _sampler
+    if _sampler is None:
+        with _sampler_lock:
+            if _sampler is None:
+                sampler = StackSampler(Config.PROFILE_INTERVAL_MS / 1000)
+                sampler.start()
+                _sampler = sampler
+    return _sampler
+
+
+def _profile_requested():
+    """?profile=1 is honoured only with the X-Profile-Token header matching PROFILE_TOKEN"""
+    if request.args.get('profile') != '1' or not Config.PROFILE_TOKEN:
+        return False
+    return hmac.compare_digest(request.headers.get('X-Profile-Token', ''), Config.PROFILE_TOKEN)
+
+
+def write_folded(stacks, method, route, elapsed):
+    os.makedirs(Config.PROFILE_DIR, exist_ok=True)
+    name = re.sub(r'[^A-Za-z0-9]+', '_', route).strip('_') or 'root'
+    stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%f')
+    path = os.path.join(Config.PROFILE_DIR, f'{stamp}_{method}_{name}_{int(elapsed * 1000)}ms.folded')
+    with open(path, 'w', encoding='utf-8') as f:
+        for stack, count in stacks.most_common():
+            f.write(f'{stack} {count}\n')
+    return path
+
+
+def install_profiler(app):
+    """Sample stacks of a share of requests (PROFILE_SAMPLE_RATE) or of ?profile=1 requests.
+
+    Samples of requests slower than PROFILE_SLOW_MS, and of every explicitly
+    requested one, are written to PROFILE_DIR as folded stacks.
+    """
+    if Config.PROFILE_SAMPLE_RATE <= 0 and not Config.PROFILE_TOKEN:
+        return
+
+    @app.before_request
+    def start_profile():
+        forced = _profile_requested()
+        if not forced and random.random() >= Config.PROFILE_SAMPLE_RATE:
+            return
+        g.profile = (time.perf_counter(), forced)
+        _get_sampler().add(threading.get_ident())
+
+    @app.teardown_request
+    def finish_profile(exc):
+        profile = g.pop('profile', None)
+        if profile is None:
+            return
+        started, forced = profile
+        stacks = _get_sampler().remove(threading.get_ident())
+        elapsed = time.perf_counter() - started
+        if not stacks or (not forced and elapsed * 1000 < Config.PROFILE_SLOW_MS):
+            return
+        rule = request.url_rule
+        try:
+            path = write_folded(stacks, request.method, rule.rule if rule is not None else request.path, elapsed)
+            processes_logger.info(f"Profile of {request.method} {request.path} ({elapsed * 1000:.0f} ms) "
+                                  f"written to {path}")
+        except OSError as e:
+            processes_logger.error(f"Could not write profile: {e}")
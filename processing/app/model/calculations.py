@@ -0,0 +1,152 @@
+import os
+import json
+import time
+import peewee
+from app.manage_app.config import Config
+from app.model.models import db
+from app.model.jobs import report_progress
+from app.model.setpoints.compiled import invalidate_compiled_threshold_sets
+from app.model.setpoints.evaluation import get_active_compiled_threshold_set, evaluate_compiled
+
+# threshold_evaluation: series are evaluated in chunks of about this many samples,
+# progress is reported and cancellation checked between chunks
+EVALUATION_CHUNK_SAMPLES = 100_000
+
+# failures worth another attempt: the database or the disk went away, not the input
+RETRYABLE_ERRORS = (peewee.OperationalError, peewee.InterfaceError, OSError)
+
+
+class JobCancelled(Exception):
+    """The job was cancelled, or requeued and taken over, while the calculation ran"""
+
+
+class JobContext:
+    """What a calculation sees of its job: parameters, progress reporting and cancellation"""
+
+    def __init__(self, job):
+        self.job_id = job['id']
+        self.kind = job['kind']
+        self.params = job['params']
+        self.threshold_set_id = job['threshold_set_id']
+        self.attempt = job['attempt']
+        self.done = 0
+        self.total = None
+        self._reported_at = None
+
+    def progress(self, done, total=None):
+        """Record progress; saved at most every JOB_PROGRESS_INTERVAL_MS and at the end.
+
+        Raises JobCancelled once the job was cancelled, so calculations stop
+        at their next report.
+        """
+        self.done = done
+        if total is not None:
+            self.total = total
+        now = time.monotonic()
+        if (self._reported_at is not None and done != self.total
+                and (now - self._reported_at) * 1000 < Config.JOB_PROGRESS_INTERVAL_MS):
+            return
+        self._reported_at = now
+        if report_progress(self.job_id, self.attempt, self.done, self.total):
+            raise JobCancelled()
+
+    def write_result(self, lines, suffix='ndjson'):
+        """Write result records to JOB_RESULT_DIR as NDJSON, returns the file name.
+
+        Every attempt writes its own temporary file, renamed into place once
+        complete while the job row is locked by this attempt; a retried
+        attempt overwrites the result of a failed one, an attempt that lost
+        the job raises JobCancelled and leaves the result alone.
+        """
+        file_name = f'{self.job_id}.{suffix}'
+        os.makedirs(Config.JOB_RESULT_DIR, exist_ok=True)
+        path = os.path.join(Config.JOB_RESULT_DIR, file_name)
+        part_path = f'{path}.{self.attempt}.part'
+        try:
+            with open(part_path, 'w') as file:
+                for line in lines:
+                    file.write(json.dumps(line) + '\n')
+            with db.atomic():
+                # the progress UPDATE keeps the row locked until the rename, a requeue waits for it
+                if report_progress(self.job_id, self.attempt, self.done, self.total):
+                    raise JobCancelled()
+                os.replace(part_path, path)
+        finally:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+        return file_name
+
+
+class Calculation:
+    __slots__ = ('name', 'run', 'needs_threshold_set', 'description')
+
+    def __init__(self, name, run, needs_threshold_set, description):
+        self.name = name
+        self.run = run
+        self.needs_threshold_set = needs_threshold_set
+        self.description = description
+
+
+# name -> Calculation, the kinds of jobs processing_worker.py runs
+CALCULATIONS = {}
+
+
+def calculation(name, needs_threshold_set=False):
+    """Register run(context) -> result (JSON) as the calculation for jobs of kind name"""
+    def register(run):
+        CALCULATIONS[name] = Calculation(name, run, needs_threshold_set, (run.__doc__ or '').strip())
+        return run
+    return register
+
+
+def is_retryable(error):
+    """True when the error or one it was raised from is transient"""
+    while error is not None:
+        if isinstance(error, RETRYABLE_ERRORS):
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+
+def result_path(file_name):
+    """Path of a job result file, None for names outside JOB_RESULT_DIR"""
+    if os.path.basename(file_name) != file_name:
+        return None
+    return os.path.join(Config.JOB_RESULT_DIR, file_name)
+
+
+@calculation('threshold_evaluation', needs_threshold_set=True)
+def threshold_evaluation(context):
+    """Evaluate series against the threshold set of the job, violations go to the result file"""
+    series = context.params['series']
+    total = sum(len(item['t_ms']) for item in series)
+    context.progress(0, total)
+    # the pool process may hold an older snapshot, the job starts from the current thresholds
+    # and keeps that one snapshot to the end, whatever changes meanwhile
+    invalidate_compiled_threshold_sets()
+    compiled = get_active_compiled_threshold_set(context.threshold_set_id)
+
+    violations, counts = [], {'start': 0, 'end': 0}
+    chunk, chunk_samples, done = [], 0, 0
+    # series are independent, evaluating them in chunks gives the events of one batch
+    for index, item in enumerate(series):
+        chunk.append(item)
+        chunk_samples += len(item['t_ms'])
+        if chunk_samples < EVALUATION_CHUNK_SAMPLES and index + 1 < len(series):
+            continue
+        events = evaluate_compiled(compiled, chunk)
+        for event in events:
+            counts[event['event']] += 1
+        violations.extend(events)
+        done += chunk_samples
+        chunk, chunk_samples = [], 0
+        context.progress(done)
+
+    return {
+        'file_name': context.write_result(violations),
+        'setpoints_version': compiled.version,
+        'series': len(series),
+        'samples': total,
+        'violations': counts['start'],
+        'cleared': counts['end'],
+    }
@@ -1,7 +1,19 @@
 import json
+import time
+import queue
+import base64
+import binascii
+import threading
 from datetime import datetime, timezone
 from functools import wraps
-from app.model.models import ChangeLog
+import peewee
+from peewee import chunked, Tuple
+from app.manage_app.logging import processes_logger
+from app.model.models import db, ChangeLog
+from app.model.exeptions import SetpointsOperationError
+
+# 8 параметров на строку, держимся далеко от лимита в 65535 параметров запроса
+CHANGELOG_CHUNK_SIZE = 1000
 
 
 def normalize_for_compare(value):
@@ -22,8 +34,16 @@ def normalize_for_store(value):
         return str(value)
 
 
-def log_changes(old_instance, new_instance, changed_by, comment=None):
-    changed_at = datetime.now(timezone.utc)
+def _field_value(instance, field):
+    # the raw id of a foreign key: the accessor would load the related row
+    if isinstance(field, peewee.ForeignKeyField):
+        return instance.__data__.get(field.name)
+    return getattr(instance, field.name)
+
+
+def build_changes(old_instance, new_instance, changed_by, comment=None, changed_at=None):
+    if changed_at is None:
+        changed_at = datetime.now(timezone.utc)
     changes = []
 
     if old_instance is None:
@@ -33,7 +53,7 @@ def log_changes(old_instance, new_instance, changed_by, comment=None):
         for field in new_instance._meta.fields.values():
             field_name = field.name
             old_value = None
-            new_value = getattr(new_instance, field_name)
+            new_value = _field_value(new_instance, field)
             if new_value not in (None, '', [], {}, set()):
                 changes.append({
                     'entity_type': entity_type,
@@ -51,8 +71,8 @@ def log_changes(old_instance, new_instance, changed_by, comment=None):
         entity_id = old_instance.id
         for field in old_instance._meta.fields.values():
             field_name = field.name
-            old_value = getattr(old_instance, field_name)
-            new_value = getattr(new_instance, field_name)
+            old_value = _field_value(old_instance, field)
+            new_value = _field_value(new_instance, field)
             if normalize_for_compare(old_value) != normalize_for_compare(new_value):
                 changes.append({
                     'entity_type': entity_type,
@@ -65,8 +85,147 @@ def log_changes(old_instance, new_instance, changed_by, comment=None):
                     'comment': comment,
                 })
 
+    return changes
+
+
+def _insert_changes(changes, chunk_size=CHANGELOG_CHUNK_SIZE):
+    for chunk in chunked(changes, chunk_size):
+        ChangeLog.insert_many(chunk).execute()
+
+
+class ChangeLogWriter(threading.Thread):
+    """Background writer that groups change-log rows of many requests into multi-row inserts.
+
+    Rows are flushed every flush_interval seconds or as soon as batch_rows are
+    collected. When the queue stays full for put_timeout seconds the caller
+    writes its rows synchronously, so audit data is never dropped on overload.
+    """
+
+    def __init__(self, max_queue=1000, batch_rows=500, flush_interval=0.2, put_timeout=0.5):
+        super().__init__(name="changelog-writer", daemon=True)
+        self.batch_rows = batch_rows
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.stats = {"rows_written": 0, "batches": 0, "sync_fallbacks": 0, "rows_failed": 0}
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stopped = threading.Event()
+
+    def submit(self, changes):
+        try:
+            self._queue.put(changes, timeout=self.put_timeout)
+        except queue.Full:
+            self.stats["sync_fallbacks"] += 1
+            _insert_changes(changes)
+
+    def stop(self, timeout=10):
+        """Flush everything queued so far and stop the thread"""
+        self._stopped.set()
+        self.join(timeout)
+
+    def _collect(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_rows:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.extend(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _flush(self, batch):
+        try:
+            with db.connection_context():
+                _insert_changes(batch)
+            self.stats["rows_written"] += len(batch)
+            self.stats["batches"] += 1
+        except Exception as e:
+            self.stats["rows_failed"] += len(batch)
+            processes_logger.error(f"Change log writer failed to store {len(batch)} rows: {e}")
+
+    def run(self):
+        while not (self._stopped.is_set() and self._queue.empty()):
+            batch = self._collect()
+            if batch:
+                self._flush(batch)
+
+
+_writer = None
+
+
+def start_changelog_writer(**options):
+    global _writer
+    if _writer is None:
+        _writer = ChangeLogWriter(**options)
+        _writer.start()
+    return _writer
+
+
+def get_changelog_writer_stats():
+    writer = _writer
+    if writer is None:
+        return None
+    stats = dict(writer.stats)
+    stats["queued_batches"] = writer._queue.qsize()
+    return stats
+
+
+def stop_changelog_writer():
+    global _writer
+    if _writer is not None:
+        _writer.stop()
+        _writer = None
+
+
+def write_changes(changes):
+    """Store change-log rows: synchronously, or via the background writer once the transaction commits"""
+    writer = _writer
+    if writer is None:
+        _insert_changes(changes)
+    else:
+        db.on_commit(lambda: writer.submit(changes))
+
+
+def log_changes(old_instance, new_instance, changed_by, comment=None):
+    changes = build_changes(old_instance, new_instance, changed_by, comment)
     if changes:
-        ChangeLog.insert_many(changes).execute()
+        write_changes(changes)
+
+
+def log_changes_many(pairs, changed_by, comment=None):
+    """Log (old_instance, new_instance) pairs of a bulk operation with one multi-row insert per chunk"""
+    changed_at = datetime.now(timezone.utc)
+    changes = []
+    for old_instance, new_instance in pairs:
+        changes.extend(build_changes(old_instance, new_instance, changed_by, comment, changed_at))
+    if changes:
+        write_changes(changes)
+    return changes
+
+
+def log_rows_sql(model, ids_query, changed_by, comment=None, deleted=False):
+    """Log the rows of model selected by ids_query as created (or deleted) with one INSERT ... SELECT.
+
+    Writes the entries build_changes would write for each row (every field that
+    is not NULL or empty) without reading the rows into Python, for operations
+    that copy or delete rows inside Postgres. Returns the number of entries.
+    """
+    table = model._meta.table_name
+    pk = model._meta.primary_key.column_name
+    values = ', '.join(f"('{field.name}', to_json(t.\"{field.column_name}\"))" for field in model._meta.sorted_fields)
+    old_value, new_value = ('f.value', 'NULL') if deleted else ('NULL', 'f.value')
+    ids_sql, ids_params = ids_query.sql()
+    cursor = db.execute_sql(
+        f'INSERT INTO "{ChangeLog._meta.table_name}" '
+        f'(entity_type, entity_id, field_name, old_value, new_value, changed_at, changed_by, comment) '
+        f'SELECT %s, t."{pk}", f.field_name, {old_value}, {new_value}, %s, %s, %s '
+        f'FROM "{table}" AS t CROSS JOIN LATERAL (VALUES {values}) AS f (field_name, value) '
+        f'WHERE t."{pk}" IN ({ids_sql}) '
+        f'AND f.value IS NOT NULL AND f.value::text NOT IN (\'null\', \'""\')',
+        [model.__name__, datetime.now(timezone.utc), changed_by, comment] + list(ids_params))
+    return cursor.rowcount
 
 
 def clone_instance(instance):
@@ -121,3 +280,81 @@ def log_entity_change(get_instance, changed_by_getter, comment_getter=None):
             return result
         return wrapper
     return decorator
+
+
+# --- history queries --------------------------------------------------------------------------------------------------
+
+def _encode_cursor(changed_at, item_id):
+    raw = f"{changed_at.isoformat()}|{item_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def _decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        changed_at, item_id = raw.rsplit('|', 1)
+        return datetime.fromisoformat(changed_at), int(item_id)
+    except (ValueError, binascii.Error):
+        raise SetpointsOperationError(message=f'Invalid cursor: {cursor}',
+                                      item_type=ChangeLog.__name__)
+
+
+def changelog_filters(entity_type=None,
+                      entity_id=None,
+                      field_name=None,
+                      changed_by=None,
+                      changed_from=None,
+                      changed_to=None):
+    """WHERE conditions shared by the history page and the export"""
+    filters = []
+    if entity_type is not None:
+        filters.append(ChangeLog.entity_type == entity_type)
+    if entity_id is not None:
+        filters.append(ChangeLog.entity_id == entity_id)
+    if field_name is not None:
+        filters.append(ChangeLog.field_name == field_name)
+    if changed_by is not None:
+        filters.append(ChangeLog.changed_by == changed_by)
+    if changed_from is not None:
+        filters.append(ChangeLog.changed_at >= changed_from)
+    if changed_to is not None:
+        filters.append(ChangeLog.changed_at < changed_to)
+    return filters
+
+
+def get_changelog_page(after=None,
+                       limit=100,
+                       entity_type=None,
+                       entity_id=None,
+                       field_name=None,
+                       changed_by=None,
+                       changed_from=None,
+                       changed_to=None):
+    """Keyset page of change-log rows, newest first, ordered by (changed_at, id)"""
+    filters = changelog_filters(entity_type=entity_type,
+                                entity_id=entity_id,
+                                field_name=field_name,
+                                changed_by=changed_by,
+                                changed_from=changed_from,
+                                changed_to=changed_to)
+    if after:
+        after_changed_at, after_id = _decode_cursor(after)
+        filters.append(Tuple(ChangeLog.changed_at, ChangeLog.id) < Tuple(after_changed_at, after_id))
+
+    try:
+        query = ChangeLog.select()
+        if filters:
+            query = query.where(*filters)
+        rows = list(query
+                    .order_by(ChangeLog.changed_at.desc(), ChangeLog.id.desc())
+                    .limit(limit + 1)
+                    .dicts())
+    except peewee.PeeweeException as px:
+        raise SetpointsOperationError(message=str(px),
+                                      item_type=ChangeLog.__name__)
+
+    items = rows[:limit]
+    next_cursor = None
+    if len(rows) > limit:
+        next_cursor = _encode_cursor(items[-1]['changed_at'], items[-1]['id'])
+    return {'items': items, 'next_cursor': next_cursor}
@@ -0,0 +1,185 @@
+import time
+import threading
+import peewee
+from playhouse.pool import PooledPostgresqlExtDatabase, MaxConnectionsExceeded
+
+
+class ProcessingDatabase(PooledPostgresqlExtDatabase):
+    """Pooled Postgres database with a connection health check and checkout metrics.
+
+    Connections are returned to the pool on close(). A pooled connection is
+    discarded when it is older than stale_timeout, and one that sat idle for
+    longer than pre_ping_idle seconds is checked with SELECT 1 first, so the
+    pool recovers after a Postgres restart instead of handing out dead
+    connections. Busy connections are never pinged: a request costs no extra
+    round trip.
+    """
+
+    def __init__(self, database, pre_ping_idle=None, **kwargs):
+        self._pre_ping_idle = pre_ping_idle
+        self._idle_since = {}
+        self._ping = threading.local()
+        self._after_commit = threading.local()
+        self._query_stats = threading.local()
+        self._stats_lock = threading.Lock()
+        self._stats = {}
+        self.reset_pool_stats()
+        super().__init__(database, **kwargs)
+
+    def init(self, database, pre_ping_idle=None, **kwargs):
+        if pre_ping_idle is not None:
+            self._pre_ping_idle = pre_ping_idle
+        super().init(database, **kwargs)
+
+    def reset_pool_stats(self):
+        with self._stats_lock:
+            self._stats = {
+                "checkouts": 0,
+                "checkout_wait_seconds_total": 0.0,
+                "checkout_wait_seconds_max": 0.0,
+                "timeouts": 0,
+                "discarded": 0,
+            }
+
+    def get_pool_stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["max_connections"] = self._max_connections
+        stats["in_use"] = len(self._in_use)
+        stats["idle"] = len(self._connections)
+        return stats
+
+    def reset_after_fork(self):
+        """Start the child process of a fork with an empty pool and fresh locks.
+
+        Connections inherited from the parent are forgotten, not closed: closing
+        them would end the parent's sessions on the shared sockets. They stay
+        referenced, so garbage collection does not close them either.
+        """
+        inherited = [conn for _, _, conn in self._connections]
+        inherited += [pool_conn.connection for pool_conn in self._in_use.values()]
+        self._inherited = getattr(self, "_inherited", []) + inherited
+        self._pool_lock = threading.RLock()
+        self._stats_lock = threading.Lock()
+        self._connections = []
+        self._in_use = {}
+        self._idle_since = {}
+        self._state.reset()
+        self.reset_pool_stats()
+
+    def column_type(self, field):
+        """SQL type of a model field, for casting untyped values such as VALUES lists"""
+        return self._field_types.get(field.field_type, field.field_type)
+
+    def track_queries(self):
+        """Start counting statements and their time in the current thread (one request).
+
+        Tracking nests: an inner track_queries() does not reset the outer one,
+        every open level counts the statements. Returns the live stats dict.
+        """
+        stack = getattr(self._query_stats, "stack", None)
+        if stack is None:
+            stack = self._query_stats.stack = []
+        stats = {"count": 0, "seconds": 0.0}
+        stack.append(stats)
+        return stats
+
+    def pop_query_stats(self):
+        """Statements counted since the innermost track_queries() in this thread, stops that level"""
+        stack = getattr(self._query_stats, "stack", None)
+        return stack.pop() if stack else None
+
+    def execute_sql(self, sql, params=None, **kwargs):
+        stack = getattr(self._query_stats, "stack", None)
+        if not stack:
+            return super().execute_sql(sql, params, **kwargs)
+        started = time.perf_counter()
+        try:
+            return super().execute_sql(sql, params, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            for stats in stack:
+                stats["count"] += 1
+                stats["seconds"] += elapsed
+
+    def _pending_after_commit(self):
+        pending = getattr(self._after_commit, "callbacks", None)
+        if pending is None:
+            pending = self._after_commit.callbacks = []
+        return pending
+
+    def on_commit(self, callback):
+        """Run callback once the current transaction commits, or right away outside a transaction."""
+        if not self.in_transaction():
+            callback()
+            return
+        self._pending_after_commit().append(callback)
+
+    def commit(self):
+        result = super().commit()
+        pending = self._pending_after_commit()
+        callbacks = list(pending)
+        pending.clear()
+        for callback in callbacks:
+            callback()
+        return result
+
+    def rollback(self):
+        self._pending_after_commit().clear()
+        return super().rollback()
+
+    def connect(self, reuse_if_open=False):
+        started = time.perf_counter()
+        try:
+            result = super().connect(reuse_if_open)
+        except MaxConnectionsExceeded:
+            with self._stats_lock:
+                self._stats["timeouts"] += 1
+            raise
+        waited = time.perf_counter() - started
+        with self._stats_lock:
+            self._stats["checkouts"] += 1
+            self._stats["checkout_wait_seconds_total"] += waited
+            if waited > self._stats["checkout_wait_seconds_max"]:
+                self._stats["checkout_wait_seconds_max"] = waited
+        # after a Postgres restart every idle connection may be dead, take the next one until one answers
+        while getattr(self._ping, "pending", False):
+            self._ping.pending = False
+            # through execute_sql, so the ping shows up in the statement counters
+            try:
+                self.execute_sql("SELECT 1")
+            except (peewee.OperationalError, peewee.InterfaceError):
+                # counted as discarded by _close()
+                self.manual_close()
+                result = super().connect(reuse_if_open)
+        return result
+
+    def _connect(self):
+        conn = super()._connect()
+        idle_since = self._idle_since.pop(self.conn_key(conn), None)
+        self._ping.pending = bool(self._pre_ping_idle and idle_since is not None
+                                  and time.monotonic() - idle_since > self._pre_ping_idle)
+        return conn
+
+    def _can_reuse(self, conn):
+        # called when the connection goes back to the pool
+        reusable = super()._can_reuse(conn)
+        if reusable:
+            self._idle_since[self.conn_key(conn)] = time.monotonic()
+        return reusable
+
+    def _close(self, conn, close_conn=False):
+        # close_conn: thrown away (stale, failed ping), not returned to the pool
+        if close_conn:
+            self._idle_since.pop(self.conn_key(conn), None)
+            with self._stats_lock:
+                self._stats["discarded"] += 1
+        return super()._close(conn, close_conn)
+
+    def _is_closed(self, conn):
+        closed = super()._is_closed(conn)
+        if closed:
+            self._idle_since.pop(self.conn_key(conn), None)
+            with self._stats_lock:
+                self._stats["discarded"] += 1
+        return closed
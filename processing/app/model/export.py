@@ -0,0 +1,102 @@
+import io
+import csv
+import json
+import uuid
+from datetime import date, datetime
+from playhouse.postgres_ext import ServerSide
+from app.manage_app.config import Config
+from app.model.models import Feature, Threshold, ChangeLog
+from app.model.changelog import changelog_filters
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False, default=_json_default)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def iter_rows(query, fetch_rows=None):
+    """Rows of query as dicts through a named (server-side) cursor, fetch_rows at a time"""
+    return ServerSide(query.dicts(), array_size=fetch_rows or Config.EXPORT_FETCH_ROWS)
+
+
+def ndjson_chunks(rows, chunk_rows=None):
+    chunk_rows = chunk_rows or Config.EXPORT_CHUNK_ROWS
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(row, ensure_ascii=False, default=_json_default))
+        if len(lines) >= chunk_rows:
+            lines.append('')
+            yield '\n'.join(lines).encode('utf-8')
+            lines = []
+    if lines:
+        lines.append('')
+        yield '\n'.join(lines).encode('utf-8')
+
+
+def csv_chunks(rows, columns, chunk_rows=None):
+    chunk_rows = chunk_rows or Config.EXPORT_CHUNK_ROWS
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    count = 0
+    for row in rows:
+        writer.writerow([_csv_value(row.get(column)) for column in columns])
+        count += 1
+        if count >= chunk_rows:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+            count = 0
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def export_chunks(query, columns, export_format):
+    """Encoded chunks of the whole query result, memory stays bounded by one fetch"""
+    rows = iter_rows(query)
+    if export_format == 'csv':
+        return csv_chunks(rows, columns)
+    return ndjson_chunks(rows)
+
+
+def feature_export_query():
+    return Feature.select().order_by(Feature.id)
+
+
+def threshold_export_query(threshold_set_id=None, feature_id=None):
+    query = Threshold.select()
+    if threshold_set_id is not None:
+        query = query.where(Threshold.threshold_set_id == threshold_set_id)
+    if feature_id is not None:
+        query = query.where(Threshold.feature_id == feature_id)
+    return query.order_by(Threshold.threshold_set_id, Threshold.feature_id, Threshold.id)
+
+
+def changelog_export_query(**filters):
+    query = ChangeLog.select()
+    conditions = changelog_filters(**filters)
+    if conditions:
+        query = query.where(*conditions)
+    return query.order_by(ChangeLog.changed_at, ChangeLog.id)
+
+
+def model_columns(model):
+    return [field.name for field in model._meta.sorted_fields]
@@ -0,0 +1,171 @@
+from datetime import datetime, timedelta, timezone
+import peewee
+from peewee import ValuesList, Value, fn
+from app.manage_app.config import Config
+from app.model.models import db, ChangeLog, EntitySnapshot, DataVersion
+from app.model.exeptions import SetpointsOperationError
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+# DataVersion row holding the archive horizon (ms since epoch): change log rows before it were dropped
+ARCHIVE_HORIZON = 'changelog_archived_before'
+
+
+class HistoryArchived(SetpointsOperationError):
+    """The moment lies before the archive horizon, its state can no longer be rebuilt"""
+
+    def __init__(self, entity_type, ts, horizon):
+        super().__init__(message=f'History before {horizon.isoformat()} is archived, '
+                                 f'the state at {ts.isoformat()} can not be rebuilt',
+                         item_type=entity_type)
+
+
+def _latest_snapshots(entity_type, entity_ids, ts):
+    """Nearest snapshot at or before ts for every id, one DISTINCT ON query"""
+    query = (EntitySnapshot
+             .select(EntitySnapshot.entity_id, EntitySnapshot.taken_at, EntitySnapshot.data)
+             .distinct(EntitySnapshot.entity_id)
+             .where((EntitySnapshot.entity_type == entity_type) &
+                    (EntitySnapshot.entity_id.in_(entity_ids)) &
+                    (EntitySnapshot.taken_at <= ts))
+             .order_by(EntitySnapshot.entity_id, EntitySnapshot.taken_at.desc())
+             .dicts())
+    return {str(row['entity_id']): row for row in query}
+
+
+def _replay_rows(entity_type, since_by_id, ts):
+    """Change log rows in (snapshot time, ts] for every id, one query ordered for replay"""
+    since = ValuesList([(entity_id, taken_at) for entity_id, taken_at in since_by_id.items()],
+                       columns=('entity_id', 'taken_at'),
+                       alias='since')
+    return (ChangeLog
+            .select(ChangeLog.entity_id, ChangeLog.field_name, ChangeLog.new_value, ChangeLog.changed_at)
+            .join(since, on=(ChangeLog.entity_id == since.c.entity_id.cast('uuid')))
+            .where((ChangeLog.entity_type == entity_type) &
+                   (ChangeLog.changed_at > since.c.taken_at.cast('timestamptz')) &
+                   (ChangeLog.changed_at <= ts))
+            .order_by(ChangeLog.entity_id, ChangeLog.changed_at, ChangeLog.id)
+            .dicts())
+
+
+def _save_snapshots(entity_type, states):
+    rows = [{'entity_type': entity_type,
+             'entity_id': entity_id,
+             'taken_at': taken_at,
+             'data': data} for entity_id, (taken_at, data) in states.items()]
+    for chunk in peewee.chunked(rows, 500):
+        EntitySnapshot.insert_many(chunk).execute()
+
+
+def get_archive_horizon():
+    """Moment before which the change log was archived, None if it never was"""
+    row = (DataVersion
+           .select(DataVersion.version)
+           .where(DataVersion.name == ARCHIVE_HORIZON)
+           .tuples()
+           .first())
+    return datetime.fromtimestamp(row[0] / 1000, timezone.utc) if row else None
+
+
+def _entities_as_of(entity_type, entity_ids, ts):
+    snapshots = _latest_snapshots(entity_type, entity_ids, ts)
+    states = {entity_id: dict(snapshot['data']) for entity_id, snapshot in snapshots.items()}
+    since_by_id = {entity_id: snapshots[entity_id]['taken_at'] if entity_id in snapshots else EPOCH
+                   for entity_id in entity_ids}
+
+    replayed = {}
+    last_changed_at = {}
+    for row in _replay_rows(entity_type, since_by_id, ts):
+        entity_id = str(row['entity_id'])
+        states.setdefault(entity_id, {})[row['field_name']] = row['new_value']
+        replayed[entity_id] = replayed.get(entity_id, 0) + 1
+        last_changed_at[entity_id] = row['changed_at']
+
+    # long replays leave a snapshot behind so the next lookup is short;
+    # only for settled history, late asynchronous change log rows must not be skipped
+    settled = datetime.now(timezone.utc) - timedelta(seconds=Config.SNAPSHOT_SETTLE_SECONDS)
+    new_snapshots = {entity_id: (last_changed_at[entity_id], dict(states[entity_id]))
+                     for entity_id, count in replayed.items()
+                     if count >= Config.SNAPSHOT_REPLAY_THRESHOLD and last_changed_at[entity_id] < settled}
+    if new_snapshots:
+        _save_snapshots(entity_type, new_snapshots)
+    return states
+
+
+def get_entities_as_of(model, entity_ids, ts):
+    """State of many entities at moment ts, rebuilt from the nearest snapshot plus change log replay.
+
+    Returns {entity_id: dict of field values}; ids that did not exist at ts are omitted.
+    Raises HistoryArchived for a ts before the archive horizon.
+    """
+    entity_type = model.__name__
+    entity_ids = [str(entity_id) for entity_id in dict.fromkeys(entity_ids)]
+    if not entity_ids:
+        return {}
+
+    try:
+        horizon = get_archive_horizon()
+        if horizon is not None and ts < horizon:
+            raise HistoryArchived(entity_type, ts, horizon)
+        return _entities_as_of(entity_type, entity_ids, ts)
+    except peewee.PeeweeException as px:
+        raise SetpointsOperationError(message=str(px),
+                                      item_type=entity_type)
+
+
+def snapshot_history_before(ts):
+    """Snapshot, as of ts, every entity with change log rows before ts and move the archive horizon to ts.
+
+    Run before those rows are archived: moments from ts on are then replayed
+    from these snapshots, earlier ones raise HistoryArchived.
+    """
+    entities = {}
+    try:
+        query = (ChangeLog
+                 .select(ChangeLog.entity_type, ChangeLog.entity_id)
+                 .where(ChangeLog.changed_at < ts)
+                 .distinct()
+                 .tuples())
+        for entity_type, entity_id in query:
+            entities.setdefault(entity_type, []).append(str(entity_id))
+
+        with db.atomic():
+            for entity_type, entity_ids in entities.items():
+                for chunk in peewee.chunked(entity_ids, 500):
+                    # a rerun after a failed archive does not store the same snapshots twice
+                    taken = {str(row[0]) for row in (EntitySnapshot
+                                                     .select(EntitySnapshot.entity_id)
+                                                     .where((EntitySnapshot.entity_type == entity_type) &
+                                                            (EntitySnapshot.entity_id.in_(chunk)) &
+                                                            (EntitySnapshot.taken_at == ts))
+                                                     .tuples())}
+                    states = _entities_as_of(entity_type, chunk, ts)
+                    _save_snapshots(entity_type, {entity_id: (ts, state) for entity_id, state in states.items()
+                                                  if entity_id not in taken})
+            horizon_ms = int(ts.timestamp() * 1000)
+            (DataVersion
+             .insert(name=ARCHIVE_HORIZON, version=horizon_ms)
+             .on_conflict(conflict_target=[DataVersion.name],
+                          update={DataVersion.version: fn.GREATEST(DataVersion.version, horizon_ms)})
+             .execute())
+    except peewee.PeeweeException as px:
+        raise SetpointsOperationError(message=str(px),
+                                      item_type=ChangeLog.__name__)
+    return sum(len(entity_ids) for entity_ids in entities.values())
+
+
+def snapshot_entities(model):
+    """Store the current state of every row of model as a snapshot, one INSERT ... SELECT"""
+    state = []
+    for field in model._meta.sorted_fields:
+        state.extend([Value(field.name), field])
+    query = model.select(Value(model.__name__), model._meta.primary_key, fn.NOW(), fn.JSON_BUILD_OBJECT(*state))
+    try:
+        (EntitySnapshot
+         .insert_from(query, [EntitySnapshot.entity_type,
+                              EntitySnapshot.entity_id,
+                              EntitySnapshot.taken_at,
+                              EntitySnapshot.data])
+         .execute())
+    except peewee.PeeweeException as px:
+        raise SetpointsOperationError(message=str(px),
+                                      item_type=model.__name__)
@@ -0,0 +1,70 @@
+import json
+import hashlib
+from datetime import datetime, timedelta, timezone
+import peewee
+from app.manage_app.config import Config
+from app.model.models import db, IdempotencyKey
+from app.model.exeptions import SetpointsOperationError
+
+
+class IdempotencyKeyMismatch(SetpointsOperationError):
+    """The key was already used with a different request"""
+
+    def __init__(self, scope, key):
+        super().__init__(message=f'Idempotency-Key {key} was already used for another {scope} request',
+                         item_type=IdempotencyKey.__name__)
+
+
+def request_fingerprint(request_data):
+    return hashlib.sha256(json.dumps(request_data, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def run_idempotent(scope, key, fingerprint, operation):
+    """Run operation() -> (body, status) once per (scope, key), returns (body, status, replayed).
+
+    The key is claimed with INSERT ... ON CONFLICT in the transaction of the
+    operation itself: a retry that arrives while the first request is running
+    waits on the key row and then replays the committed response, a retry after
+    a failed request finds no key (the claim was rolled back) and runs again.
+    Expired keys are claimed anew.
+    """
+    now = datetime.now(timezone.utc)
+    expires_at = now + timedelta(hours=Config.IDEMPOTENCY_TTL_HOURS)
+    match = (IdempotencyKey.scope == scope) & (IdempotencyKey.key == key)
+    try:
+        with db.atomic():
+            claimed = list(IdempotencyKey
+                           .insert(scope=scope, key=key, request_hash=fingerprint, expires_at=expires_at)
+                           .on_conflict(conflict_target=[IdempotencyKey.scope, IdempotencyKey.key],
+                                        update={IdempotencyKey.request_hash: fingerprint,
+                                                IdempotencyKey.status: None,
+                                                IdempotencyKey.response: None,
+                                                IdempotencyKey.expires_at: expires_at},
+                                        where=(IdempotencyKey.expires_at <= now))
+                           .returning(IdempotencyKey.key)
+                           .tuples()
+                           .execute())
+            if claimed:
+                body, status = operation()
+                (IdempotencyKey
+                 .update(status=status, response=body)
+                 .where(match)
+                 .execute())
+                return body, status, False
+
+            stored = IdempotencyKey.get(match)
+    except peewee.PeeweeException as px:
+        raise SetpointsOperationError(message=str(px),
+                                      item_type=IdempotencyKey.__name__)
+
+    if stored.request_hash != fingerprint:
+        raise IdempotencyKeyMismatch(scope, key)
+    return stored.response, stored.status, True
+
+
+def purge_idempotency_keys():
+    """Delete expired keys, returns the number of deleted rows"""
+    return (IdempotencyKey
+            .delete()
+            .where(IdempotencyKey.expires_at <= datetime.now(timezone.utc))
+            .execute())
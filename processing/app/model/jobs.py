@@ -0,0 +1,385 @@
+import uuid
+from typing import List, Dict
+import peewee
+from peewee import fn, SQL
+from app.manage_app.config import Config
+from app.model.models import db, Job, ThresholdSet
+from app.model.exeptions import SetpointsOperationError
+from app.model.notify import notify
+
+# NOTIFY при появлении задач в очереди, будит processing_worker.py
+JOBS_CHANNEL = 'processing_jobs'
+
+QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED = 'queued', 'running', 'succeeded', 'failed', 'cancelled'
+JOB_STATUSES = (QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED)
+FINISHED_STATUSES = (SUCCEEDED, FAILED, CANCELLED)
+
+_CLAIM_ORDER = (Job.priority.desc(), Job.run_after, Job.created_at)
+# everything but params: the input of a calculation can be large and only the worker reads it
+_STATUS_FIELDS = [field for field in Job._meta.sorted_fields if field is not Job.params]
+
+# a running job whose worker stopped sending heartbeats goes back to the queue,
+# or fails when it used up its attempts; the lost attempt counts
+_REQUEUE_STALE_SQL = """
+UPDATE "{table}" SET
+    status = CASE WHEN cancel_requested THEN '{cancelled}'
+                  WHEN attempts < max_attempts THEN '{queued}'
+                  ELSE '{failed}' END,
+    error = %s,
+    worker_id = NULL,
+    heartbeat_at = NULL,
+    run_after = now(),
+    finished_at = CASE WHEN cancel_requested OR attempts >= max_attempts THEN now() END
+WHERE status = '{running}' AND heartbeat_at < now() - make_interval(secs => %s)
+RETURNING id, status
+"""
+
+
+class JobStateError(SetpointsOperationError):
+    """The job is not in a state the operation applies to"""
+
+    def __init__(self, job_id, status, action):
+        super().__init__(message=f'Error: job {job_id} is {status} and cannot be {action}',
+                         item_type=Job.__name__)
+
+
+def _dict_for_job(data) -> List[Dict]:
+    data_dict = []
+    for point in data:
+        data_dict.append({
+            'id':                       str(point.id),
+            'kind':                     point.kind,
+            'threshold_set_id':         str(point.threshold_set_id) if point.threshold_set_id else None,
+            'threshold_set_version':    point.threshold_set_version,
+            'setpoints_version':        point.setpoints_version,
+            'group_id':                 str(point.group_id) if point.group_id else None,
+            'initiator':                point.initiator,
+            'status':                   point.status,
+            'priority':                 point.priority,
+            'attempts':                 point.attempts,
+            'max_attempts':             point.max_attempts,
+            'progress_done':            point.progress_done,
+            'progress_total':           point.progress_total,
+            'cancel_requested':         point.cancel_requested,
+            'result':                   point.result,
+            'error':                    point.error,
+            'worker_id':                point.worker_id,
+            'run_after':                point.run_after,
+            'created_at':               point.created_at,
+            'started_at':               point.started_at,
+            'heartbeat_at':             point.heartbeat_at,
+            'finished_at':              point.finished_at,
+        })
+    return data_dict
+
+
+def _owned(job_id, attempt):
+    # the attempt is the lease: once the job was requeued the old attempt writes nothing
+    return (Job.id == job_id) & (Job.status == RUNNING) & (Job.attempts == attempt)
+
+
+def enqueue_jobs(kind, params_list, threshold_set_id=None, priority=0, max_attempts=None, initiator=None,
+                 group=False):
+    """Queue one job per params, returns {group_id, job_ids}.
+
+    group=True ties the jobs into a group run under a new group_id. The
+    threshold set must exist and be active; its version is recorded with the
+    jobs, the setpoints version a calculation used is recorded when it completes. Workers are woken by NOTIFY once the transaction commits.
+    """
+    group_id = uuid.uuid4() if group else None
+    job_ids = [uuid.uuid4() for _ in params_list]
+    max_attempts = max_attempts or Config.JOB_MAX_ATTEMPTS
+    try:
+        with db.atomic():
+            threshold_set_version = None
+            if threshold_set_id is not None:
+                threshold_set = ThresholdSet.get_or_none(ThresholdSet.id == threshold_set_id)
+                if threshold_set is None:
+                    raise SetpointsOperationError(message=f'Error: threshold set {threshold_set_id} does not exist',
+                                                  item_type=ThresholdSet.__name__)
+                if not threshold_set.active:
+                    raise SetpointsOperationError(message=f'Error: threshold set {threshold_set_id} is not active',
+                                                  item_type=ThresholdSet.__name__)
+                threshold_set_version = threshold_set.version
+
+            Job.insert_many([{
+                'id': job_id,
+                'kind': kind,
+                'params': params,
+                'threshold_set_id': threshold_set_id,
+                'threshold_set_version': threshold_set_version,
+                'group_id': group_id,
+                'initiator': initiator,
+                'status': QUEUED,
+                'priority': priority,
+                'max_attempts': max_attempts,
+                'run_after': fn.NOW(),
+                'created_at': fn.NOW(),
+            } for job_id, params in zip(job_ids, params_list)]).execute()
+            notify(db, JOBS_CHANNEL)
+    except peewee.PeeweeException as px:
+        raise SetpointsOperationError(message=str(px),
+                                      item_type=Job.__name__)
+    return {'group_id': str(group_id) if group_id else None, 'job_ids': [str(job_id) for job_id in job_ids]}
+
+
+def claim_jobs(worker_id, limit):
+    """Take up to limit ready jobs for worker_id, highest priority first.
+
+    Rows locked by a concurrent claim are skipped (FOR UPDATE SKIP LOCKED),
+    so any number of workers poll the same queue without waiting on each
+    other or taking a job twice. Returns [{id, kind, params, threshold_set_id, attempt}].
+    """
+    if limit <= 0:
+        return []
+    ready = (Job
+             .select(Job.id)
+             .where((Job.status == QUEUED) & (Job.run_after <= fn.NOW()))
+             .order_by(*_CLAIM_ORDER)
+             .limit(limit)
+             .for_update('FOR UPDATE SKIP LOCKED'))
+    try:
+        with db.atomic():
+            rows = list(Job
+                        .update(status=RUNNING,
+                                attempts=Job.attempts + 1,
+                                worker_id=worker_id,
+                                progress_done=0,
+                                progress_total=None,
+                                started_at=fn.NOW(),
+                                heartbeat_at=fn.NOW())
+                        .where(Job.id.in_(ready))
+                        .returning(Job.id, Job.kind, Job.params, Job.threshold_set_id, Job.attempts, Job.priority)
+                        .tuples()
+                        .execute())
+    except peewee.PeeweeException as px:
+        raise SetpointsOperationError(message=str(px),
+                                      item_type=Job.__name__)
+    rows.sort(key=lambda row: -row[5])
+    return [{'id': str(job_id), 'kind': kind, 'params': params,
+             'threshold_set_id': str(threshold_set_id) if threshold_set_id else None, 'attempt': attempt}
+            for job_id, kind, params, threshold_set_id, attempt, _ in rows]
+
+
+def report_progress(job_id, attempt, done, total=None):
+    """Save the progress of a running attempt; True when it should stop (cancelled or requeued)"""
+    values = {Job.progress_done: done, Job.heartbeat_at: fn.NOW()}
+    if total is not None:
+        values[Job.progress_total] = total
+    rows = list(Job
+                .update(values)
+                .where(_owned(job_id, attempt))
+                .returning(Job.cancel_requested)
+                .tuples()
+                .execute())
+    return not rows or rows[0][0]
+
+
+def heartbeat_jobs(worker_id, job_ids):
+    """Extend the lease of the jobs the worker is running"""
+    if not job_ids:
+        return 0
+    return (Job
+            .update(heartbeat_at=fn.NOW())
+            .where(Job.id.in_(job_ids) & (Job.status == RUNNING) & (Job.worker_id == worker_id))
+            .execute())
+
+
+def complete_job(job_id, attempt, result):
+    """Mark the attempt succeeded, False when the job is no longer this attempt's.
+
+    The setpoints_version of a result (the compiled thresholds it was
+    calculated with) is kept in the job row as well.
+    """
+    setpoints_version = result.get('setpoints_version') if isinstance(result, dict) else None
+    return bool(Job
+                .update(status=SUCCEEDED,
+                        result=result,
+                        setpoints_version=setpoints_version,
+                        error=None,
+                        progress_done=fn.COALESCE(Job.progress_total, Job.progress_done),
+                        heartbeat_at=None,
+                        finished_at=fn.NOW())
+                .where(_owned(job_id, attempt))
+                .execute())
+
+
+def cancel_running_job(job_id, attempt):
+    """The attempt stopped on a cancel request"""
+    return bool(Job
+                .update(status=CANCELLED, heartbeat_at=None, finished_at=fn.NOW())
+                .where(_owned(job_id, attempt))
+                .execute())
+
+
+def fail_job(job_id, attempt, error, retry=True):
+    """Record a failed attempt, returns the new status or None when the job is no longer this attempt's.
+
+    With retry and attempts left the job is queued again after
+    JOB_RETRY_DELAY_SECONDS * 2^(attempt - 1); a job with a pending cancel
+    request is cancelled instead.
+    """
+    with db.atomic():
+        job = Job.select(*_STATUS_FIELDS).where(_owned(job_id, attempt)).for_update().first()
+        if job is None:
+            return None
+        if job.cancel_requested:
+            status, values = CANCELLED, {Job.finished_at: fn.NOW()}
+        elif retry and job.attempts < job.max_attempts:
+            delay = Config.JOB_RETRY_DELAY_SECONDS * 2 ** (job.attempts - 1)
+            status, values = QUEUED, {Job.run_after: SQL('now() + make_interval(secs => %s)', (delay,)),
+                                      Job.worker_id: None}
+        else:
+            status, values = FAILED, {Job.finished_at: fn.NOW()}
+        values.update({Job.status: status, Job.error: error, Job.heartbeat_at: None})
+        Job.update(values).where(Job.id == job_id).execute()
+        if status == QUEUED:
+            notify(db, JOBS_CHANNEL)
+    return status
+
+
+def requeue_stale_jobs(lease_seconds, error='worker stopped responding'):
+    """Return running jobs without a heartbeat for lease_seconds to the queue, returns [(id, status)]"""
+    sql = _REQUEUE_STALE_SQL.format(table=Job._meta.table_name, queued=QUEUED, running=RUNNING,
+                                    failed=FAILED, cancelled=CANCELLED)
+    with db.atomic():
+        rows = [(str(job_id), status) for job_id, status in db.execute_sql(sql, (error, lease_seconds)).fetchall()]
+        if any(status == QUEUED for _, status in rows):
+            notify(db, JOBS_CHANNEL)
+    return rows
+
+
+def cancel_job(job_id):
+    """Cancel a job: a queued one at once, a running one at its next progress report.
+
+    Returns the job, {} when it does not exist; finished jobs raise JobStateError.
+    """
+    try:
+        with db.atomic():
+            job = Job.select(Job.id, Job.status).where(Job.id == job_id).for_update().first()
+            if job is None:
+                return {}
+            if job.status == QUEUED:
+                Job.update(status=CANCELLED, finished_at=fn.NOW()).where(Job.id == job_id).execute()
+            elif job.status == RUNNING:
+                Job.update(cancel_requested=True).where(Job.id == job_id).execute()
+            else:
+                raise JobStateError(job_id, job.status, 'cancelled')
+    except peewee.PeeweeException as px:
+        raise SetpointsOperationError(message=str(px),
+                                      item_type=Job.__name__)
+    return get_job_by_id(job_id)
+
+
+def cancel_group(group_id):
+    """Cancel every unfinished job of a group run, returns the number of jobs affected"""
+    try:
+        with db.atomic():
+            cancelled = (Job
+                         .update(status=CANCELLED, finished_at=fn.NOW())
+                         .where((Job.group_id == group_id) & (Job.status == QUEUED))
+                         .execute())
+            requested = (Job
+                         .update(cancel_requested=True)
+                         .where((Job.group_id == group_id) & (Job.status == RUNNING))
+                         .execute())
+    except peewee.PeeweeException as px:
+        raise SetpointsOperationError(message=str(px),
+                                      item_type=Job.__name__)
+    return cancelled + requested
+
+
+def retry_job(job_id):
+    """Queue a failed or cancelled job again with JOB_MAX_ATTEMPTS more attempts.
+
+    The attempt counter keeps growing, it is the lease of a running attempt:
+    an attempt of the previous run still finishing writes nothing.
+    """
+    try:
+        with db.atomic():
+            job = Job.select(Job.id, Job.status).where(Job.id == job_id).for_update().first()
+            if job is None:
+                return {}
+            if job.status not in (FAILED, CANCELLED):
+                raise JobStateError(job_id, job.status, 'retried')
+            (Job
+             .update(status=QUEUED, max_attempts=Job.attempts + Config.JOB_MAX_ATTEMPTS, cancel_requested=False,
+                     result=None, setpoints_version=None, progress_done=0, progress_total=None, worker_id=None,
+                     run_after=fn.NOW(), started_at=None, finished_at=None)
+             .where(Job.id == job_id)
+             .execute())
+            notify(db, JOBS_CHANNEL)
+    except peewee.PeeweeException as px:
+        raise SetpointsOperationError(message=str(px),
+                                      item_type=Job.__name__)
+    return get_job_by_id(job_id)
+
+
+def get_job_by_id(item_id):
+    try:
+        data = _dict_for_job(Job.select(*_STATUS_FIELDS).where(Job.id == item_id))
+        return data[0] if data else {}
+    except peewee.PeeweeException as px:
+        raise SetpointsOperationError(message=str(px),
+                                      item_type=Job.__name__)
+
+
+def get_jobs(status=None, kind=None, group_id=None, threshold_set_id=None, limit=100):
+    """Jobs newest first"""
+    filters = []
+    if status is not None:
+        filters.append(Job.status == status)
+    if kind is not None:
+        filters.append(Job.kind == kind)
+    if group_id is not None:
+        filters.append(Job.group_id == group_id)
+    if threshold_set_id is not None:
+        filters.append(Job.threshold_set_id == threshold_set_id)
+    try:
+        query = Job.select(*_STATUS_FIELDS)
+        if filters:
+            query = query.where(*filters)
+        return _dict_for_job(query.order_by(Job.created_at.desc(), Job.id).limit(limit))
+    except peewee.PeeweeException as px:
+        raise SetpointsOperationError(message=str(px),
+                                      item_type=Job.__name__)
+
+
+def get_group(group_id):
+    """Progress of a group run: jobs per status and summed progress, {} for an unknown group"""
+    try:
+        rows = (Job
+                .select(Job.status, fn.COUNT(Job.id), fn.SUM(Job.progress_done), fn.SUM(Job.progress_total),
+                        fn.MIN(Job.created_at), fn.MAX(Job.finished_at))
+                .where(Job.group_id == group_id)
+                .group_by(Job.status)
+                .tuples())
+        rows = list(rows)
+    except peewee.PeeweeException as px:
+        raise SetpointsOperationError(message=str(px),
+                                      item_type=Job.__name__)
+    if not rows:
+        return {}
+
+    counts = dict.fromkeys(JOB_STATUSES, 0)
+    for status, count, _, _, _, _ in rows:
+        counts[status] = count
+    finished = sum(counts[status] for status in FINISHED_STATUSES)
+    if counts[RUNNING] or counts[QUEUED]:
+        status = RUNNING if counts[RUNNING] or finished else QUEUED
+    elif counts[FAILED]:
+        status = FAILED
+    elif counts[CANCELLED]:
+        status = CANCELLED
+    else:
+        status = SUCCEEDED
+    return {
+        'group_id': str(group_id),
+        'status': status,
+        'jobs': sum(counts.values()),
+        'counts': counts,
+        'progress_done': sum(row[2] or 0 for row in rows),
+        'progress_total': sum(row[3] or 0 for row in rows),
+        'created_at': min(row[4] for row in rows),
+        'finished_at': max(row[5] for row in rows if row[5] is not None) if status in FINISHED_STATUSES else None,
+    }
@@ -0,0 +1,158 @@
+import peewee
+from datetime import datetime, timezone
+from app.manage_app.config import Config
+from app.model.models import (db, Feature, ThresholdSet, Threshold, IdempotencyKey, StreamCheckpoint, Job,
+                              SchemaMigration, create_all_tables)
+from app.model.partitions import migrate_changelog_to_partitions, create_changelog_partitions
+from app.model.versioning import install_version_triggers
+from app.model.setpoints.feature import install_feature_cache_triggers
+
+# Любой процесс, применяющий миграции, сначала берет эту advisory-блокировку
+MIGRATION_LOCK_ID = 7_104_202_501
+# необязательный уникальный индекс на имя признака (FEATURE_UNIQUE_NAMES)
+FEATURE_NAME_INDEX = 'feature_name_unique'
+# номер версии уникален в пределах набора (первая версия и все ее копии)
+THRESHOLD_SET_VERSION_INDEX = 'thresholdset_origin_version_unique'
+# GiST-индекс по окну порога, см. app.model.setpoints.threshold.threshold_window
+THRESHOLD_WINDOW_INDEX = 'threshold_window_gist'
+# частичные индексы очереди расчетов: выборка готовых задач и поиск зависших
+JOB_QUEUE_INDEX = 'job_queued_claim'
+JOB_LEASE_INDEX = 'job_running_heartbeat'
+
+# окно [start, end) как int8range; NULL - открытая граница, перевернутое окно пусто
+_THRESHOLD_WINDOW_FUNCTION = """
+CREATE OR REPLACE FUNCTION threshold_window(start_ms INTEGER, end_ms INTEGER) RETURNS int8range AS $$
+    SELECT CASE WHEN start_ms IS NULL OR end_ms IS NULL OR start_ms < end_ms
+                THEN int8range(start_ms, end_ms)
+                ELSE 'empty'::int8range END
+$$ LANGUAGE sql IMMUTABLE PARALLEL SAFE
+"""
+
+
+class SchemaVersionError(Exception):
+    def __init__(self, found, expected):
+        self.found = found
+        self.expected = expected
+        super().__init__(f"Database schema version is {found}, the application needs {expected}; "
+                         f"run `python processing_migrate.py` first")
+
+
+def _baseline():
+    # idempotent: also adopts databases created by the old create_tables() on app start
+    migrate_changelog_to_partitions(Config.CHANGELOG_PARTITION_MONTHS_AHEAD)
+    create_all_tables()
+    create_changelog_partitions(Config.CHANGELOG_PARTITION_MONTHS_AHEAD)
+    install_version_triggers()
+
+
+def _idempotency_keys():
+    IdempotencyKey.create_table()
+
+
+def _threshold_set_versions():
+    # IF NOT EXISTS: databases created by a newer baseline already have the columns
+    table = ThresholdSet._meta.table_name
+    db.execute_sql(f'ALTER TABLE "{table}" '
+                   f'ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1, '
+                   f'ADD COLUMN IF NOT EXISTS origin_id UUID NULL')
+    db.execute_sql(f'CREATE UNIQUE INDEX IF NOT EXISTS "{THRESHOLD_SET_VERSION_INDEX}" '
+                   f'ON "{table}" ((COALESCE(origin_id, id)), version)')
+
+
+def _threshold_windows():
+    db.execute_sql(_THRESHOLD_WINDOW_FUNCTION)
+    db.execute_sql(f'CREATE INDEX IF NOT EXISTS "{THRESHOLD_WINDOW_INDEX}" ON "{Threshold._meta.table_name}" '
+                   f'USING gist (threshold_window(time_point_start_ms, time_point_end_ms))')
+
+
+def _stream_checkpoints():
+    StreamCheckpoint.create_table()
+
+
+def _stream_checkpoint_tokens():
+    db.execute_sql(f'ALTER TABLE "{StreamCheckpoint._meta.table_name}" ADD COLUMN IF NOT EXISTS token UUID NULL')
+
+
+def _job_setpoints_versions():
+    db.execute_sql(f'ALTER TABLE "{Job._meta.table_name}" ADD COLUMN IF NOT EXISTS setpoints_version BIGINT NULL')
+
+
+def _calculation_jobs():
+    Job.create_table()
+    table = Job._meta.table_name
+    # only queued rows are indexed, the finished history does not slow the claim down
+    db.execute_sql(f'CREATE INDEX IF NOT EXISTS "{JOB_QUEUE_INDEX}" ON "{table}" '
+                   f'(priority DESC, run_after, created_at) WHERE status = \'queued\'')
+    db.execute_sql(f'CREATE INDEX IF NOT EXISTS "{JOB_LEASE_INDEX}" ON "{table}" '
+                   f'(heartbeat_at) WHERE status = \'running\'')
+
+
+# (version, name, function); append only, never renumber or edit an applied migration
+MIGRATIONS = [
+    (1, 'baseline: setpoints, change log partitions, version triggers', _baseline),
+    (2, 'idempotency keys of POST requests', _idempotency_keys),
+    (3, 'threshold set versions', _threshold_set_versions),
+    (4, 'GiST index on threshold time windows', _threshold_windows),
+    (5, 'streaming evaluation checkpoints', _stream_checkpoints),
+    (6, 'calculation jobs queue', _calculation_jobs),
+    (7, 'setpoints version sequence, triggers skip empty statements', install_version_triggers),
+    (8, 'streaming checkpoint tokens', _stream_checkpoint_tokens),
+    (9, 'feature cache NOTIFY triggers', install_feature_cache_triggers),
+    (10, 'setpoints version used by a job', _job_setpoints_versions),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version():
+    """Latest applied migration, None when the database was never migrated"""
+    if not SchemaMigration.table_exists():
+        return None
+    row = SchemaMigration.select(SchemaMigration.version).order_by(SchemaMigration.version.desc()).first()
+    return row.version if row else None
+
+
+def _lock_migrations():
+    # workers or deploy jobs started in parallel wait here instead of racing the DDL
+    db.execute_sql('SELECT pg_advisory_xact_lock(%s)', (MIGRATION_LOCK_ID,))
+
+
+def apply_migrations():
+    """Apply pending migrations in order, each in its own transaction; returns applied versions"""
+    applied = []
+    with db.atomic():
+        _lock_migrations()
+        SchemaMigration.create_table()
+    for version, name, migrate in MIGRATIONS:
+        with db.atomic():
+            _lock_migrations()
+            if SchemaMigration.get_or_none(SchemaMigration.version == version) is not None:
+                continue
+            migrate()
+            SchemaMigration.create(version=version, name=name, applied_at=datetime.now(timezone.utc))
+        applied.append(version)
+        print(f"migration {version} ({name}) was applied")
+    return applied
+
+
+def sync_feature_name_index(unique):
+    """Create or drop the optional unique index on feature names"""
+    if unique:
+        db.execute_sql(f'CREATE UNIQUE INDEX IF NOT EXISTS "{FEATURE_NAME_INDEX}" '
+                       f'ON "{Feature._meta.table_name}" (name)')
+    else:
+        db.execute_sql(f'DROP INDEX IF EXISTS "{FEATURE_NAME_INDEX}"')
+
+
+def check_schema_version():
+    """The only schema work on app start: one query comparing the applied version"""
+    try:
+        cursor = db.execute_sql(f'SELECT MAX(version) FROM "{SchemaMigration._meta.table_name}"')
+        found = cursor.fetchone()[0]
+    except peewee.ProgrammingError:
+        db.rollback()
+        found = None
+    # a newer schema is fine: old workers keep serving during a rolling deploy
+    if found is None or found < SCHEMA_VERSION:
+        raise SchemaVersionError(found, SCHEMA_VERSION)
+    return found
@@ -1,7 +1,8 @@
 from peewee import *
 from playhouse.postgres_ext import DateTimeTZField, JSONField
 import peewee
-db = PostgresqlDatabase(None)
+from app.model.database import ProcessingDatabase
+db = ProcessingDatabase(None)
 
 
 class BaseModel(Model):
@@ -15,8 +16,8 @@ class Feature(BaseModel):
     id = UUIDField(primary_key=True)
     name = CharField(max_length=50, null=False)
     description = CharField(max_length=250, null=True)
-    type = CharField(max_length=50, null=True)
-    priority = CharField(max_length=50, null=True)
+    type = CharField(max_length=50, null=True, index=True)
+    priority = CharField(max_length=50, null=True, index=True)
     default_threshold = FloatField(null=True)
     active = BooleanField(null=False)
 
@@ -27,6 +28,9 @@ class ThresholdSet(BaseModel):
     description = CharField(max_length=250, null=True)
     group = CharField(max_length=50, null=True)
     active = BooleanField(null=False)
+    # версии одного набора: origin_id - первая версия (NULL у нее самой), см. app.model.setpoints.threshold
+    version = IntegerField(null=False, default=1, constraints=[SQL('DEFAULT 1')])
+    origin_id = UUIDField(null=True)
 
 
 class Threshold(BaseModel):
@@ -44,9 +48,17 @@ class Threshold(BaseModel):
     active = BooleanField(null=False)
 
 
+class DataVersion(BaseModel):
+    """Named counters, e.g. the change log archive horizon (see app.model.history)"""
+    name = CharField(max_length=50, primary_key=True)
+    version = BigIntegerField(null=False, default=0)
+
+
 # change log models-----------------------------------------------------------------------------------------------------
+# Таблица секционирована помесячно по changed_at (см. app.model.partitions),
+# поэтому первичный ключ включает ключ секционирования
 class ChangeLog(BaseModel):
-    id = AutoField()
+    id = BigIntegerField(sequence='changelog_id_seq')
     entity_type = CharField(null=False)
     entity_id = UUIDField(null=False)
     field_name = CharField(null=False)
@@ -56,6 +68,97 @@ class ChangeLog(BaseModel):
     changed_by = CharField(null=False)
     comment = CharField(null=True)
 
+    class Meta:
+        primary_key = CompositeKey('id', 'changed_at')
+        table_settings = ['PARTITION BY RANGE (changed_at)']
+        indexes = (
+            (('entity_type', 'entity_id', 'changed_at'), False),
+            (('changed_by', 'changed_at'), False),
+        )
+
+
+class EntitySnapshot(BaseModel):
+    """Full state of an entity at taken_at, the starting point for change log replay"""
+    id = BigAutoField()
+    entity_type = CharField(null=False)
+    entity_id = UUIDField(null=False)
+    taken_at = DateTimeTZField(null=False)
+    data = JSONField(null=False)
+
+    class Meta:
+        indexes = (
+            (('entity_type', 'entity_id', 'taken_at'), False),
+        )
+
+
+# idempotency keys -----------------------------------------------------------------------------------------------------
+class IdempotencyKey(BaseModel):
+    """Response of a POST sent with an Idempotency-Key header, replayed on retries (see app.model.idempotency)"""
+    scope = CharField(max_length=100, null=False)
+    key = CharField(max_length=255, null=False)
+    request_hash = CharField(max_length=64, null=False)
+    status = IntegerField(null=True)
+    response = JSONField(null=True)
+    expires_at = DateTimeTZField(null=False, index=True)
+
+    class Meta:
+        primary_key = CompositeKey('scope', 'key')
+
+
+class StreamCheckpoint(BaseModel):
+    """Saved state of a streaming evaluation run (see app.model.setpoints.streaming)"""
+    threshold_set_id = UUIDField(null=False)
+    run_id = CharField(max_length=255, null=False)
+    # последняя примененная микро-пачка и номер сохранения состояния
+    seq = BigIntegerField(null=True)
+    revision = IntegerField(null=False)
+    # новый при каждом сохранении: номер начинается заново после удаления прогона, токен нет
+    token = UUIDField(null=True)
+    state = JSONField(null=False)
+    updated_at = DateTimeTZField(null=False, index=True)
+
+    class Meta:
+        primary_key = CompositeKey('threshold_set_id', 'run_id')
+
+
+# calculation jobs -----------------------------------------------------------------------------------------------------
+class Job(BaseModel):
+    """Calculation run queued for processing_worker.py (see app.model.jobs)"""
+    id = UUIDField(primary_key=True)
+    kind = CharField(max_length=100, null=False)
+    params = JSONField(null=False)
+    threshold_set_id = UUIDField(null=True, index=True)
+    threshold_set_version = IntegerField(null=True)
+    # версия уставок скомпилированного набора, по которому посчитан результат
+    setpoints_version = BigIntegerField(null=True)
+    # задачи одного группового прогона
+    group_id = UUIDField(null=True, index=True)
+    initiator = CharField(max_length=255, null=True)
+    status = CharField(max_length=20, null=False)
+    priority = IntegerField(null=False, default=0)
+    attempts = IntegerField(null=False, default=0)
+    max_attempts = IntegerField(null=False)
+    progress_done = BigIntegerField(null=False, default=0)
+    progress_total = BigIntegerField(null=True)
+    cancel_requested = BooleanField(null=False, default=False)
+    result = JSONField(null=True)
+    error = TextField(null=True)
+    # воркер, выполняющий задачу, и время его последнего пульса
+    worker_id = CharField(max_length=255, null=True)
+    heartbeat_at = DateTimeTZField(null=True)
+    run_after = DateTimeTZField(null=False)
+    created_at = DateTimeTZField(null=False, index=True)
+    started_at = DateTimeTZField(null=True)
+    finished_at = DateTimeTZField(null=True)
+
+
+# schema migrations ----------------------------------------------------------------------------------------------------
+class SchemaMigration(BaseModel):
+    """Applied schema migrations (see app.model.migrations)"""
+    version = IntegerField(primary_key=True)
+    name = CharField(max_length=100, null=False)
+    applied_at = DateTimeTZField(null=False)
+
 
 # --- create/drop/delete all -------------------------------------------------------------------------------------------
 def create_all_tables():
@@ -66,9 +169,13 @@ def create_all_tables():
         print("table \"ThresholdSet\" was created")
         Threshold.create_table()
         print("table \"Threshold\" was created")
+        DataVersion.create_table()
+        print("table \"DataVersion\" was created")
 
         ChangeLog.create_table()
         print("table \"ChangeLog\" was created")
+        EntitySnapshot.create_table()
+        print("table \"EntitySnapshot\" was created")
 
     except peewee.InternalError as px:
         print(str(px))
@@ -77,24 +184,41 @@ def create_all_tables():
 
 def drop_all_tables():
     try:
+        EntitySnapshot.drop_table()
+        print("table \"EntitySnapshot\" was dropped")
         ChangeLog.drop_table()
         print("table \"ChangeLog\" was dropped")
 
+        DataVersion.drop_table()
+        print("table \"DataVersion\" was dropped")
         Threshold.drop_table()
         print("table \"Threshold\" was dropped")
         Feature.drop_table()
         print("table \"Feature\" was dropped")
         ThresholdSet.drop_table()
         print("table \"ThresholdSet\" was dropped")
+        IdempotencyKey.drop_table()
+        print("table \"IdempotencyKey\" was dropped")
+        StreamCheckpoint.drop_table()
+        print("table \"StreamCheckpoint\" was dropped")
+        Job.drop_table()
+        print("table \"Job\" was dropped")
+        SchemaMigration.drop_table()
+        print("table \"SchemaMigration\" was dropped")
     except peewee.InternalError as px:
         print(str(px))
     print("Success. All tables were dropped")
 
 
 def delete_all_tables():
+    EntitySnapshot.delete().execute()
     ChangeLog.delete().execute()
 
+    DataVersion.delete().execute()
     Threshold.delete().execute()
     Feature.delete().execute()
     ThresholdSet.delete().execute()
+    IdempotencyKey.delete().execute()
+    StreamCheckpoint.delete().execute()
+    Job.delete().execute()
     print("Success. All tables were deleted")
@@ -0,0 +1,51 @@
+import select
+import threading
+import time
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from app.manage_app.logging import processes_logger
+
+
+def notify(db, channel, payload=''):
+    """Send a Postgres NOTIFY, delivered to listeners when the current transaction commits."""
+    db.execute_sql("SELECT pg_notify(%s, %s)", (channel, payload))
+
+
+class NotifyListener(threading.Thread):
+    """Daemon thread with its own connection, calls callback(payload) for every NOTIFY on channel."""
+
+    def __init__(self, channel, callback, connect_params, poll_timeout=5.0, reconnect_delay=5.0):
+        super().__init__(name=f"listen-{channel}", daemon=True)
+        self.channel = channel
+        self.callback = callback
+        self.connect_params = connect_params
+        self.poll_timeout = poll_timeout
+        self.reconnect_delay = reconnect_delay
+        self._stopped = threading.Event()
+
+    def stop(self):
+        self._stopped.set()
+
+    def run(self):
+        while not self._stopped.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(**self.connect_params)
+                conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cursor:
+                    cursor.execute(f'LISTEN "{self.channel}";')
+                # notifications may have been missed while disconnected
+                self.callback(None)
+
+                while not self._stopped.is_set():
+                    if select.select([conn], [], [], self.poll_timeout) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        self.callback(conn.notifies.pop(0).payload)
+            except Exception as e:
+                processes_logger.error(f"NOTIFY listener on {self.channel} failed: {e}")
+                time.sleep(self.reconnect_delay)
+            finally:
+                if conn is not None:
+                    conn.close()
@@ -0,0 +1,185 @@
+import os
+import gzip
+import json
+import re
+from datetime import date, datetime, timezone
+from playhouse.postgres_ext import ServerSide
+from app.model.models import db, ChangeLog
+from app.model.history import snapshot_history_before
+
+CHANGELOG_TABLE = ChangeLog._meta.table_name
+CHANGELOG_LEGACY_TABLE = f'{CHANGELOG_TABLE}_legacy'
+CHANGELOG_DEFAULT_PARTITION = f'{CHANGELOG_TABLE}_default'
+PARTITION_NAME_RE = re.compile(rf'^{CHANGELOG_TABLE}_p(\d{{4}})(\d{{2}})$')
+# Создание и удаление партиций журнала идет под этой advisory-блокировкой транзакции
+CHANGELOG_PARTITION_LOCK_ID = 7_104_202_509
+
+
+def _month_start(value):
+    if isinstance(value, datetime) and value.tzinfo is not None:
+        value = value.astimezone(timezone.utc)
+    return date(value.year, value.month, 1)
+
+
+def _month_datetime(month):
+    return datetime(month.year, month.month, 1, tzinfo=timezone.utc)
+
+
+def _add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _partition_name(month):
+    return f'{CHANGELOG_TABLE}_p{month:%Y%m}'
+
+
+def _bound(month):
+    return f"'{month.isoformat()} 00:00:00+00'"
+
+
+def is_changelog_partitioned():
+    cursor = db.execute_sql(
+        "SELECT 1 FROM pg_partitioned_table pt "
+        "JOIN pg_class c ON c.oid = pt.partrelid WHERE c.relname = %s",
+        (CHANGELOG_TABLE,))
+    return cursor.fetchone() is not None
+
+
+def list_changelog_partitions():
+    """Months that currently have an attached range partition, ascending"""
+    cursor = db.execute_sql(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid "
+        "JOIN pg_class p ON p.oid = i.inhparent WHERE p.relname = %s",
+        (CHANGELOG_TABLE,))
+    months = []
+    for (name,) in cursor.fetchall():
+        match = PARTITION_NAME_RE.match(name)
+        if match:
+            months.append(date(int(match.group(1)), int(match.group(2)), 1))
+    return sorted(months)
+
+
+def _table_exists(name):
+    return db.execute_sql('SELECT to_regclass(%s) IS NOT NULL', (f'"{name}"',)).fetchone()[0]
+
+
+def _lock_partitions():
+    # processes creating the same partition wait here and see it exists once the first commits
+    db.execute_sql('SELECT pg_advisory_xact_lock(%s)', (CHANGELOG_PARTITION_LOCK_ID,))
+
+
+def create_changelog_partition(month):
+    """Create the partition of month, moving its rows out of the default partition first.
+
+    Postgres refuses to create a range partition while the default partition
+    holds rows of that range, so they are taken out and inserted back once
+    the partition exists, in one transaction.
+    """
+    name = _partition_name(month)
+    bounds = (_month_datetime(month), _month_datetime(_add_months(month, 1)))
+    moved_table = f'{CHANGELOG_TABLE}_moved'
+    with db.atomic():
+        _lock_partitions()
+        if _table_exists(name):
+            return
+        has_default = _table_exists(CHANGELOG_DEFAULT_PARTITION)
+        if has_default:
+            db.execute_sql(
+                f'CREATE TEMP TABLE "{moved_table}" AS '
+                f'WITH moved AS (DELETE FROM "{CHANGELOG_DEFAULT_PARTITION}" '
+                f'WHERE changed_at >= %s AND changed_at < %s RETURNING *) SELECT * FROM moved',
+                bounds)
+        db.execute_sql(
+            f'CREATE TABLE "{name}" PARTITION OF "{CHANGELOG_TABLE}" '
+            f'FOR VALUES FROM ({_bound(month)}) TO ({_bound(_add_months(month, 1))})')
+        if has_default:
+            columns = ', '.join(f'"{field.column_name}"' for field in ChangeLog._meta.sorted_fields)
+            db.execute_sql(f'INSERT INTO "{CHANGELOG_TABLE}" ({columns}) '
+                           f'SELECT {columns} FROM "{moved_table}"')
+            db.execute_sql(f'DROP TABLE "{moved_table}"')
+
+
+def create_changelog_partitions(months_ahead, start=None, today=None):
+    """Create monthly partitions from start (default: current month) up to months_ahead months ahead"""
+    current = _month_start(today or datetime.now(timezone.utc))
+    month = _month_start(start) if start else current
+    last = _add_months(current, months_ahead)
+    while month <= last:
+        create_changelog_partition(month)
+        month = _add_months(month, 1)
+    with db.atomic():
+        _lock_partitions()
+        db.execute_sql(
+            f'CREATE TABLE IF NOT EXISTS "{CHANGELOG_DEFAULT_PARTITION}" '
+            f'PARTITION OF "{CHANGELOG_TABLE}" DEFAULT')
+
+
+def migrate_changelog_to_partitions(months_ahead):
+    """Move a plain (pre-partitioning) change log table into the partitioned layout, once"""
+    if not ChangeLog.table_exists() or is_changelog_partitioned():
+        return False
+
+    with db.atomic():
+        db.execute_sql(f'ALTER TABLE "{CHANGELOG_TABLE}" RENAME TO "{CHANGELOG_LEGACY_TABLE}"')
+        db.execute_sql(f'ALTER TABLE "{CHANGELOG_LEGACY_TABLE}" '
+                       f'RENAME CONSTRAINT "{CHANGELOG_TABLE}_pkey" TO "{CHANGELOG_LEGACY_TABLE}_pkey"')
+        for index in ChangeLog._meta.fields_to_index():
+            db.execute_sql(f'DROP INDEX IF EXISTS "{index._name}"')
+        # the id sequence is kept and reused by the partitioned table
+        db.execute_sql(f'ALTER SEQUENCE "{CHANGELOG_TABLE}_id_seq" OWNED BY NONE')
+
+        ChangeLog.create_table()
+        first = db.execute_sql(f'SELECT MIN(changed_at) FROM "{CHANGELOG_LEGACY_TABLE}"').fetchone()[0]
+        create_changelog_partitions(months_ahead, start=first)
+
+        columns = ', '.join(f'"{field.column_name}"' for field in ChangeLog._meta.sorted_fields)
+        db.execute_sql(f'INSERT INTO "{CHANGELOG_TABLE}" ({columns}) '
+                       f'SELECT {columns} FROM "{CHANGELOG_LEGACY_TABLE}"')
+        db.execute_sql(f'DROP TABLE "{CHANGELOG_LEGACY_TABLE}"')
+    return True
+
+
+def archive_changelog_partitions(retention_months, archive_dir, today=None):
+    """Export partitions older than retention_months to gzipped JSON lines, then detach and drop them.
+
+    Before anything is dropped every entity is snapshotted as of the cutoff,
+    so history from the cutoff on stays rebuildable. Returns the list of
+    written archive files.
+    """
+    cutoff = _add_months(_month_start(today or datetime.now(timezone.utc)), -retention_months)
+    expired = [month for month in list_changelog_partitions() if month < cutoff]
+    if not expired:
+        return []
+    snapshot_history_before(_month_datetime(cutoff))
+    os.makedirs(archive_dir, exist_ok=True)
+    archived = []
+
+    for month in expired:
+        name = _partition_name(month)
+        path = os.path.join(archive_dir, f'{name}.jsonl.gz')
+        tmp_path = f'{path}.tmp'
+
+        query = (ChangeLog
+                 .select()
+                 .where((ChangeLog.changed_at >= _month_datetime(month)) &
+                        (ChangeLog.changed_at < _month_datetime(_add_months(month, 1))))
+                 .order_by(ChangeLog.changed_at, ChangeLog.id)
+                 .dicts())
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+            for row in ServerSide(query, array_size=5000):
+                f.write(json.dumps(row, ensure_ascii=False, default=str))
+                f.write('\n')
+        os.replace(tmp_path, path)
+
+        with db.atomic():
+            _lock_partitions()
+            if not _table_exists(name):
+                # archived by a concurrent run
+                continue
+            db.execute_sql(f'ALTER TABLE "{CHANGELOG_TABLE}" DETACH PARTITION "{name}"')
+            db.execute_sql(f'DROP TABLE "{name}"')
+        archived.append(path)
+
+    return archived
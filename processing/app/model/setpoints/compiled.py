@@ -0,0 +1,322 @@
+import math
+import bisect
+import time
+import threading
+import peewee
+from app.manage_app.config import Config
+from app.model.models import Feature, Threshold, ThresholdSet
+from app.model.exeptions import SetpointsOperationError
+from app.model.notify import NotifyListener
+from app.model.versioning import get_setpoints_version, get_settled_setpoints_version, SETPOINTS_VERSION_CHANNEL
+
+# step_indicator values meaning "violation when the signal falls below the threshold",
+# anything else (including empty) is an upper threshold
+LOWER_STEP_INDICATORS = {'down', 'below', 'low', 'min', 'lower', '<', '<='}
+
+
+class SampleThresholds:
+    """Thresholds of one feature as Python lists, for checking one sample at a time.
+
+    level and clear_level are value and value - deadband in the direction of
+    sign, so one comparison of value * sign decides for lower and upper
+    thresholds alike. by_start/by_end hold the columns of non-empty windows
+    ordered by start and by end, start_keys/end_keys their bounds: a reader
+    moving forward in time opens and closes windows with two cursors.
+    """
+    __slots__ = ('threshold_ids', 'level', 'clear_level', 'sign', 'start', 'end', 'column_by_id',
+                 'by_start', 'start_keys', 'by_end', 'end_keys')
+
+    def __init__(self, threshold_ids=(), level=(), clear_level=(), sign=(), start=(), end=(),
+                 by_start=(), start_keys=(), by_end=(), end_keys=()):
+        self.threshold_ids = threshold_ids
+        self.level = level
+        self.clear_level = clear_level
+        self.sign = sign
+        self.start = start
+        self.end = end
+        self.column_by_id = {threshold_id: column for column, threshold_id in enumerate(threshold_ids)}
+        self.by_start = by_start
+        self.start_keys = start_keys
+        self.by_end = by_end
+        self.end_keys = end_keys
+
+    def open_at(self, t):
+        """Columns of the windows containing t, with the cursors (next start, next end) past t"""
+        next_start = bisect.bisect_right(self.start_keys, t)
+        next_end = bisect.bisect_right(self.end_keys, t)
+        closed = set(self.by_end[:next_end])
+        return {column for column in self.by_start[:next_start] if column not in closed}, next_start, next_end
+
+
+class FeatureThresholds:
+    """Thresholds of one feature as parallel NumPy arrays, sorted by time window.
+
+    rows holds the resolved threshold dicts in the same order, windows an
+    interval index over start/end.
+    """
+    __slots__ = ('threshold_ids', 'value', 'deadband', 'sign', 'start', 'end', 'rows', 'windows', '_sample_view')
+
+    def __init__(self, threshold_ids, value, deadband, sign, start, end, rows=(), windows=None):
+        self.threshold_ids = threshold_ids
+        self.value = value
+        self.deadband = deadband
+        self.sign = sign
+        self.start = start
+        self.end = end
+        self.rows = rows
+        self.windows = windows
+        self._sample_view = None
+
+    def __len__(self):
+        return len(self.threshold_ids)
+
+    def sample_view(self):
+        """The thresholds as SampleThresholds, built on first use (the snapshot is read-only)"""
+        if self._sample_view is None:
+            valid = (self.start < self.end).nonzero()[0]
+            by_start = valid[self.start[valid].argsort(kind='stable')]
+            by_end = valid[self.end[valid].argsort(kind='stable')]
+            self._sample_view = SampleThresholds(
+                threshold_ids=self.threshold_ids,
+                level=(self.value * self.sign).tolist(),
+                clear_level=(self.value * self.sign - self.deadband).tolist(),
+                sign=self.sign.tolist(),
+                start=self.start.tolist(),
+                end=self.end.tolist(),
+                by_start=by_start.tolist(),
+                start_keys=self.start[by_start].tolist(),
+                by_end=by_end.tolist(),
+                end_keys=self.end[by_end].tolist(),
+            )
+        return self._sample_view
+
+    def take(self, columns):
+        """The thresholds at positions columns, without the interval index"""
+        return FeatureThresholds(
+            threshold_ids=[self.threshold_ids[column] for column in columns],
+            value=self.value[columns],
+            deadband=self.deadband[columns],
+            sign=self.sign[columns],
+            start=self.start[columns],
+            end=self.end[columns],
+            rows=tuple(self.rows[column] for column in columns),
+        )
+
+
+class CompiledThresholdSet:
+    """Read-only view of one threshold set as of a setpoints version.
+
+    thresholds holds the resolved rows (defaults applied, inactive rows dropped)
+    sorted by feature and time window; features holds the same data as arrays.
+    """
+
+    def __init__(self, threshold_set_id, version, name, active, thresholds, features):
+        self.threshold_set_id = threshold_set_id
+        self.version = version
+        self.name = name
+        self.active = active
+        self.thresholds = thresholds
+        self.features = features
+
+    def thresholds_at(self, feature_id, t_ms):
+        """Resolved thresholds of the feature whose window contains t_ms"""
+        feature = self.features.get(str(feature_id))
+        if feature is None:
+            return []
+        return [feature.rows[column] for column in feature.windows.at(t_ms)]
+
+    def thresholds_overlapping(self, feature_id, from_ms, to_ms):
+        """Resolved thresholds of the feature whose window intersects [from_ms, to_ms)"""
+        feature = self.features.get(str(feature_id))
+        if feature is None:
+            return []
+        return [feature.rows[column] for column in feature.windows.overlapping(from_ms, to_ms)]
+
+
+def direction_sign(step_indicator):
+    if step_indicator and step_indicator.strip().lower() in LOWER_STEP_INDICATORS:
+        return -1.0
+    return 1.0
+
+
+def build_feature_thresholds(rows):
+    """rows: resolved threshold dicts of one feature, already sorted by time window"""
+    # numpy is loaded with the first compiled set, not at worker boot
+    import numpy as np
+    from app.model.setpoints.intervals import IntervalIndex
+    start = np.array([-np.inf if row['time_point_start_ms'] is None else row['time_point_start_ms']
+                      for row in rows], dtype=np.float64)
+    end = np.array([np.inf if row['time_point_end_ms'] is None else row['time_point_end_ms']
+                    for row in rows], dtype=np.float64)
+    return FeatureThresholds(
+        threshold_ids=[row['id'] for row in rows],
+        value=np.array([row['value'] for row in rows], dtype=np.float64),
+        deadband=np.array([row['deadband'] or 0.0 for row in rows], dtype=np.float64),
+        sign=np.array([direction_sign(row['step_indicator']) for row in rows], dtype=np.float64),
+        start=start,
+        end=end,
+        rows=tuple(rows),
+        windows=IntervalIndex(start, end),
+    )
+
+
+def _window_key(row):
+    start = row['time_point_start_ms']
+    end = row['time_point_end_ms']
+    return (row['feature_id'],
+            -math.inf if start is None else start,
+            math.inf if end is None else end)
+
+
+def compile_threshold_set(threshold_set_id, version):
+    try:
+        threshold_set = ThresholdSet.get_or_none(ThresholdSet.id == threshold_set_id)
+        if threshold_set is None:
+            raise SetpointsOperationError(message=f'Error: threshold set {threshold_set_id} does not exist',
+                                          item_type=ThresholdSet.__name__)
+        rows = (Threshold
+                .select(Threshold.id, Threshold.feature_id, Threshold.default, Threshold.value,
+                        Threshold.deadband, Threshold.step_indicator,
+                        Threshold.time_point_start_ms, Threshold.time_point_end_ms,
+                        Feature.default_threshold)
+                .join(Feature, on=(Threshold.feature_id == Feature.id))
+                .where((Threshold.threshold_set_id == threshold_set_id) &
+                       (Threshold.active == True) &
+                       (Feature.active == True))
+                .tuples())
+        thresholds = []
+        for (threshold_id, feature_id, default, value, deadband, step_indicator,
+             start_ms, end_ms, default_threshold) in rows:
+            if default and default_threshold is not None:
+                value = default_threshold
+            thresholds.append({
+                'id': str(threshold_id),
+                'feature_id': str(feature_id),
+                'value': value,
+                'deadband': deadband,
+                'step_indicator': step_indicator,
+                'time_point_start_ms': start_ms,
+                'time_point_end_ms': end_ms,
+            })
+    except peewee.PeeweeException as px:
+        raise SetpointsOperationError(message=str(px),
+                                      item_type=ThresholdSet.__name__)
+
+    thresholds.sort(key=_window_key)
+    by_feature = {}
+    for row in thresholds:
+        by_feature.setdefault(row['feature_id'], []).append(row)
+
+    return CompiledThresholdSet(
+        threshold_set_id=str(threshold_set_id),
+        version=version,
+        name=threshold_set.name,
+        active=threshold_set.active,
+        thresholds=tuple(thresholds),
+        features={feature_id: build_feature_thresholds(feature_rows)
+                  for feature_id, feature_rows in by_feature.items()})
+
+
+class CompiledThresholdSetStore:
+    """Compiled threshold sets keyed by set id, rebuilt lazily once the setpoints version moves.
+
+    The known version is refreshed from the database at most every check_interval
+    seconds, immediately after invalidate(), or pushed by the NOTIFY listener.
+    Snapshots are replaced by a single dict assignment, so readers never wait
+    for a rebuild when a previous snapshot exists. Every set has its own build
+    lock, a slow build of one set does not hold back the others.
+    """
+
+    def __init__(self, check_interval):
+        self.check_interval = check_interval
+        self._snapshots = {}
+        self._version = None
+        self._checked_at = 0.0
+        self._build_locks = {}
+
+    def invalidate(self, version=None):
+        self._version = version
+        self._checked_at = time.monotonic() if version is not None else 0.0
+
+    def current_version(self):
+        version = self._version
+        if version is None or time.monotonic() - self._checked_at >= self.check_interval:
+            version = get_setpoints_version()
+            self._version = version
+            self._checked_at = time.monotonic()
+        return version
+
+    def get(self, threshold_set_id):
+        key = str(threshold_set_id)
+        try:
+            version = self.current_version()
+        except peewee.PeeweeException as px:
+            raise SetpointsOperationError(message=str(px),
+                                          item_type=ThresholdSet.__name__)
+        snapshot = self._snapshots.get(key)
+        if snapshot is not None and snapshot.version >= version:
+            return snapshot
+
+        build_lock = self._build_locks.setdefault(key, threading.Lock())
+        # someone else is rebuilding this set, the previous snapshot is good enough meanwhile
+        if snapshot is not None and not build_lock.acquire(blocking=False):
+            return snapshot
+        if snapshot is None:
+            build_lock.acquire()
+        try:
+            snapshot = self._snapshots.get(key)
+            if snapshot is not None and snapshot.version >= version:
+                return snapshot
+            # the writes behind the version must be committed before the set is read;
+            # with a previous snapshot at hand it is served instead of waiting long for them
+            settled = get_settled_setpoints_version(None if snapshot is None else self.check_interval)
+            if settled is None:
+                return snapshot
+            snapshot = compile_threshold_set(threshold_set_id, settled)
+            snapshots = dict(self._snapshots)
+            snapshots[key] = snapshot
+            self._snapshots = snapshots
+            return snapshot
+        except peewee.PeeweeException as px:
+            raise SetpointsOperationError(message=str(px),
+                                          item_type=ThresholdSet.__name__)
+        finally:
+            build_lock.release()
+
+
+_store = CompiledThresholdSetStore(Config.THRESHOLD_VERSION_CHECK_SECONDS)
+
+
+def get_compiled_threshold_set(threshold_set_id):
+    return _store.get(threshold_set_id)
+
+
+def get_active_thresholds(threshold_set_id, feature_id, t_ms=None, from_ms=None, to_ms=None):
+    """Resolved thresholds of a feature in an active set applying at t_ms, or within [from_ms, to_ms).
+
+    Answered from the compiled snapshot by the feature's interval index.
+    """
+    compiled = get_compiled_threshold_set(threshold_set_id)
+    if not compiled.active:
+        raise SetpointsOperationError(message=f'Error: threshold set {threshold_set_id} is not active',
+                                      item_type=ThresholdSet.__name__)
+    if t_ms is not None:
+        return compiled.thresholds_at(feature_id, t_ms)
+    return compiled.thresholds_overlapping(feature_id,
+                                           -math.inf if from_ms is None else from_ms,
+                                           math.inf if to_ms is None else to_ms)
+
+
+def invalidate_compiled_threshold_sets():
+    """Make the next access re-read the setpoints version (call after local writes)"""
+    _store.invalidate()
+
+
+def _on_version_notify(payload):
+    _store.invalidate(int(payload) if payload else None)
+
+
+def start_threshold_version_listener(connect_params):
+    listener = NotifyListener(SETPOINTS_VERSION_CHANNEL, _on_version_notify, connect_params)
+    listener.start()
+    return listener
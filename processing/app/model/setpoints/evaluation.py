@@ -0,0 +1,115 @@
+import math
+import numpy as np
+from app.model.exeptions import SetpointsOperationError
+from app.model.models import ThresholdSet
+from app.model.setpoints.compiled import get_compiled_threshold_set
+
+
+def evaluate_feature(thresholds, t_ms, values, series_starts):
+    """Alarm state transitions of one feature over concatenated series.
+
+    t_ms/values hold the samples of all series of this feature back to back, each
+    series sorted by time; series_starts are the row indexes where a series begins.
+    A threshold is violated while the sample is inside its time window and beyond
+    the threshold value; with a deadband the violation only clears once the signal
+    is back by more than deadband (hysteresis).
+
+    Returns (row, column, is_start) arrays for every transition.
+    """
+    n = len(t_ms)
+    t = t_ms[:, None]
+    in_window = (t >= thresholds.start[None, :]) & (t < thresholds.end[None, :])
+    signal = values[:, None] * thresholds.sign[None, :]
+    level = (thresholds.value * thresholds.sign)[None, :]
+
+    enter = in_window & (signal > level)
+    leave = ~in_window | (signal <= level - thresholds.deadband[None, :])
+    # state never carries over from the previous series
+    leave[series_starts] |= ~enter[series_starts]
+
+    # last decisive sample for every row, samples inside the band keep the previous state
+    last_event = np.where(enter | leave, np.arange(n)[:, None], -1)
+    np.maximum.accumulate(last_event, axis=0, out=last_event)
+    state = np.take_along_axis(enter, np.maximum(last_event, 0), axis=0) & (last_event >= 0)
+
+    previous = np.zeros_like(state)
+    previous[1:] = state[:-1]
+    previous[series_starts] = False
+
+    changed_rows, changed_columns = np.nonzero(state != previous)
+    return changed_rows, changed_columns, state[changed_rows, changed_columns]
+
+
+def get_active_compiled_threshold_set(threshold_set_id):
+    compiled = get_compiled_threshold_set(threshold_set_id)
+    if not compiled.active:
+        raise SetpointsOperationError(message=f'Error: threshold set {threshold_set_id} is not active',
+                                      item_type=ThresholdSet.__name__)
+    return compiled
+
+
+def evaluate_batch(threshold_set_id, series):
+    """Evaluate a batch of series [{feature_id, series_id, t_ms, values}] against a threshold set.
+
+    Returns violation events ({series_id, feature_id, threshold_id, event, t_ms, value, threshold}),
+    event is 'start' when a violation begins and 'end' when it clears.
+    """
+    return evaluate_compiled(get_active_compiled_threshold_set(threshold_set_id), series)
+
+
+def evaluate_compiled(compiled, series):
+    """evaluate_batch against an already compiled snapshot, e.g. one kept for a whole job"""
+    grouped = {}
+    for index, item in enumerate(series):
+        grouped.setdefault(str(item['feature_id']), []).append(index)
+
+    events = []
+    for feature_id, indexes in grouped.items():
+        thresholds = compiled.features.get(feature_id)
+        if thresholds is None or not len(thresholds):
+            continue
+
+        t_parts, value_parts, owners, series_starts = [], [], [], []
+        offset = 0
+        for index in indexes:
+            t = np.asarray(series[index]['t_ms'], dtype=np.float64)
+            x = np.asarray(series[index]['values'], dtype=np.float64)
+            order = np.argsort(t, kind='stable')
+            t_parts.append(t[order])
+            value_parts.append(x[order])
+            owners.append(np.full(len(t), index))
+            series_starts.append(offset)
+            offset += len(t)
+        if not offset:
+            continue
+
+        t_ms = np.concatenate(t_parts)
+        values = np.concatenate(value_parts)
+        owner = np.concatenate(owners)
+        series_starts = np.array([start for start in series_starts if start < offset], dtype=np.int64)
+
+        # thresholds whose window misses the batch never fire, the matrices only get the rest
+        columns = thresholds.windows.overlapping(t_ms.min().item(), math.nextafter(t_ms.max().item(), math.inf))
+        if not len(columns):
+            continue
+        if len(columns) < len(thresholds):
+            thresholds = thresholds.take(columns)
+
+        rows, columns, starts = evaluate_feature(thresholds, t_ms, values, series_starts)
+        for row, column, is_start in zip(rows.tolist(), columns.tolist(), starts.tolist()):
+            item = series[owner[row]]
+            events.append({
+                'series_id': item.get('series_id'),
+                'feature_id': feature_id,
+                'threshold_id': thresholds.threshold_ids[column],
+                'event': 'start' if is_start else 'end',
+                't_ms': t_ms[row].item(),
+                'value': values[row].item(),
+                'threshold': thresholds.value[column].item(),
+                '_order': (int(owner[row]), row),
+            })
+
+    events.sort(key=lambda event: event['_order'])
+    for event in events:
+        del event['_order']
+    return events
@@ -1,22 +1,29 @@
+import json
 import uuid
+import hashlib
 import peewee
 from typing import List, Dict
-from app.model.models import Feature
+from app.manage_app.config import Config
+from app.manage_app.cache import TTLCache
+from app.model.models import db, Feature
+from app.model.notify import NotifyListener
+from app.model.history import get_entities_as_of
+from app.model.setpoints.compiled import invalidate_compiled_threshold_sets
 from app.model.exeptions import SetpointsOperationError
-from app.model.changelog import log_entity_change, get_comment, get_changed_by
+from app.model.changelog import build_changes, clone_instance, log_changes, log_changes_many
 
+BULK_CHUNK_SIZE = 500
 
-def _get_instance(*args, **kwargs):
-    try:
-        result = kwargs.get('result')
-        if isinstance(result, dict) and 'id' in result:
-            return Feature.get(Feature.id == result['id'])
-        if 'item_id' in kwargs:
-            return Feature.get(Feature.id == kwargs['item_id'])
-        else:
-            return Feature.get(Feature.id == result)
-    except Exception:
-        raise ValueError("Entity ID was not defined")
+FEATURE_FIELDS = ('name', 'description', 'type', 'priority', 'default_threshold', 'active')
+
+FEATURE_CACHE_CHANNEL = 'feature_cache'
+# NOTIFY payload is limited to 8000 bytes, larger statements invalidate everything
+FEATURE_CACHE_NOTIFY_MAX_IDS = 100
+
+# кэш хранит пары (результат, etag); списки сбрасываются при любом изменении
+_feature_cache = TTLCache(Config.FEATURE_CACHE_SIZE, Config.FEATURE_CACHE_TTL)
+_feature_list_cache = TTLCache(Config.FEATURE_CACHE_SIZE, Config.FEATURE_CACHE_TTL)
+_cache_generation = 0
 
 
 def _dict_for_data(data) -> List[Dict]:
@@ -34,13 +41,103 @@ def _dict_for_data(data) -> List[Dict]:
     return data_dict
 
 
+def _etag(result):
+    return hashlib.sha1(json.dumps(result, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _read_through(cache, key, loader):
+    entry = cache.get(key)
+    if entry is not None:
+        return entry
+    generation = _cache_generation
+    result = loader()
+    entry = (result, _etag(result))
+    # a write that happened while loading makes the result possibly stale
+    if result and generation == _cache_generation:
+        cache.put(key, entry)
+    return entry
+
+
+def invalidate_feature_cache(item_ids=None):
+    """Drop cached features (all of them if item_ids is None) and every cached list"""
+    global _cache_generation
+    _cache_generation += 1
+    if item_ids is None:
+        _feature_cache.clear()
+    else:
+        for item_id in item_ids:
+            _feature_cache.pop(str(item_id))
+    _feature_list_cache.clear()
+
+
+def _publish_invalidation(item_ids):
+    # inside an outer transaction (idempotent requests) caches are dropped once it commits;
+    # other workers are told by the NOTIFY of the feature cache trigger
+    db.on_commit(lambda: _invalidate(item_ids))
+
+
+def _invalidate(item_ids):
+    invalidate_feature_cache(item_ids)
+    invalidate_compiled_threshold_sets()
+
+
+def _on_feature_cache_notify(payload):
+    invalidate_feature_cache(payload.split(',') if payload else None)
+
+
+_FEATURE_CACHE_FUNCTION = """
+CREATE OR REPLACE FUNCTION notify_feature_cache() RETURNS trigger AS $$
+DECLARE
+    payload TEXT;
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        PERFORM pg_notify('{channel}', '');
+        RETURN NULL;
+    END IF;
+    SELECT CASE WHEN count(*) <= {max_ids} THEN string_agg(id::text, ',') ELSE '' END
+    INTO payload FROM changed_rows;
+    -- NULL: the statement changed no rows
+    IF payload IS NOT NULL THEN
+        PERFORM pg_notify('{channel}', payload);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+"""
+
+
+def install_feature_cache_triggers():
+    """Statement-level triggers sending the changed feature ids on FEATURE_CACHE_CHANNEL.
+
+    The NOTIFY is part of the writing transaction and delivered on commit,
+    whichever app (WSGI, ASGI, scripts) made the change.
+    """
+    table = Feature._meta.table_name
+    with db.atomic():
+        db.execute_sql(_FEATURE_CACHE_FUNCTION.format(channel=FEATURE_CACHE_CHANNEL,
+                                                      max_ids=FEATURE_CACHE_NOTIFY_MAX_IDS))
+        for event, rows in (('INSERT', 'NEW'), ('UPDATE', 'NEW'), ('DELETE', 'OLD')):
+            db.execute_sql(f'CREATE OR REPLACE TRIGGER "{table}_cache_{event.lower()}" '
+                           f'AFTER {event} ON "{table}" REFERENCING {rows} TABLE AS changed_rows '
+                           f'FOR EACH STATEMENT EXECUTE FUNCTION notify_feature_cache()')
+        db.execute_sql(f'CREATE OR REPLACE TRIGGER "{table}_cache_truncate" AFTER TRUNCATE ON "{table}" '
+                       f'FOR EACH STATEMENT EXECUTE FUNCTION notify_feature_cache()')
+
+
+def start_feature_cache_listener(connect_params):
+    """Invalidate this worker's cache on changes made by other workers (LISTEN/NOTIFY)"""
+    listener = NotifyListener(FEATURE_CACHE_CHANNEL, _on_feature_cache_notify, connect_params)
+    listener.start()
+    return listener
+
+
+def get_feature_cache_stats():
+    return {'features': _feature_cache.stats(), 'lists': _feature_list_cache.stats()}
+
+
 # ---------------------------------------------------------------------------------------------------------------------
 
 
-@log_entity_change(
-    get_instance=_get_instance,
-    changed_by_getter=get_changed_by,
-    comment_getter=get_comment)
 def add_feature(name,
                 description=None,
                 type=None,
@@ -62,7 +159,11 @@ def add_feature(name,
             default_threshold=default_threshold,
             active=active,
         )
-        row.save(force_insert=True)
+        # INSERT + один INSERT в журнал изменений, без перечитывания строки
+        with db.atomic():
+            row.save(force_insert=True)
+            log_changes(None, row, changed_by=changed_by, comment=comment)
+        _publish_invalidation([u])
         return u
     except peewee.PeeweeException as px:
         raise SetpointsOperationError(message=str(px),
@@ -75,10 +176,41 @@ def add_feature(name,
                                             "active": active})
 
 
-@log_entity_change(
-    get_instance=_get_instance,
-    changed_by_getter=get_changed_by,
-    comment_getter=get_comment)
+def update_returning_old_query(item_id, values, where=None):
+    """UPDATE ... FROM (old row) ... RETURNING both old and new values in one statement.
+
+    where selects the row instead of item_id (upsert by name).
+    """
+    returning = [getattr(Feature, name) for name in ('id',) + FEATURE_FIELDS]
+    old = (Feature
+           .select(*returning)
+           .where(Feature.id == item_id if where is None else where)
+           # NO KEY: the update changes no keys, inserts referencing the row (FOR KEY SHARE) do not wait
+           .for_update('FOR NO KEY UPDATE')
+           .alias('old'))
+    returning += [getattr(old.c, name).alias(f'old_{name}') for name in FEATURE_FIELDS]
+    return (Feature
+            .update(values)
+            .from_(old)
+            .where(Feature.id == old.c.id)
+            .returning(*returning)
+            .dicts())
+
+
+def instances_from_returning(row):
+    """(old, new) Feature instances from a row of update_returning_old_query"""
+    new_instance = Feature(id=row['id'], **{name: row[name] for name in FEATURE_FIELDS})
+    old_instance = Feature(id=row['id'], **{name: row[f'old_{name}'] for name in FEATURE_FIELDS})
+    return old_instance, new_instance
+
+
+def _update_returning_old(item_id, values, where=None):
+    rows = list(update_returning_old_query(item_id, values, where).execute())
+    if not rows:
+        return None, None
+    return instances_from_returning(rows[0])
+
+
 def modify_feature(item_id,
                    name,
                    description=None,
@@ -91,29 +223,237 @@ def modify_feature(item_id,
                    ):
 
     try:
-        item = Feature.get(Feature.id == item_id)
-        item.name = name
-        item.description = description
-        item.type = type
-        item.priority = priority
-        item.default_threshold = default_threshold
-        item.active = active
-
-        item.save()
-        result = get_feature_by_id(item_id)
-        return result
-    except peewee.DoesNotExist:
-        raise SetpointsOperationError(message=f'Error: {item_id} does not exist',
+        # UPDATE ... RETURNING + один INSERT в журнал изменений
+        with db.atomic():
+            old_instance, new_instance = _update_returning_old(item_id, {
+                Feature.name: name,
+                Feature.description: description,
+                Feature.type: type,
+                Feature.priority: priority,
+                Feature.default_threshold: default_threshold,
+                Feature.active: active,
+            })
+            if new_instance is None:
+                raise SetpointsOperationError(message=f'Error: {item_id} does not exist',
+                                              item_type=Feature.__name__)
+            log_changes(old_instance, new_instance, changed_by=changed_by, comment=comment)
+        _publish_invalidation([item_id])
+        return _dict_for_data([new_instance])[0]
+    except peewee.PeeweeException as px:
+        raise SetpointsOperationError(message=str(px),
                                       item_type=Feature.__name__)
+
+
+def upsert_feature(name,
+                   description=None,
+                   type=None,
+                   priority=None,
+                   default_threshold=None,
+                   active=True,
+                   changed_by='system',
+                   comment=None
+                   ):
+    """Update the feature called name or create it, returns (feature, created).
+
+    Needs the unique index on names (FEATURE_UNIQUE_NAMES). The insert is
+    INSERT ... ON CONFLICT DO NOTHING, so two requests creating the same name
+    never both insert: the loser waits for the winner and updates its row.
+    """
+    if not Config.FEATURE_UNIQUE_NAMES:
+        raise SetpointsOperationError(message='Upsert by name needs FEATURE_UNIQUE_NAMES=1',
+                                      item_type=Feature.__name__)
+    values = {
+        Feature.name: name,
+        Feature.description: description,
+        Feature.type: type,
+        Feature.priority: priority,
+        Feature.default_threshold: default_threshold,
+        Feature.active: active,
+    }
+    try:
+        with db.atomic():
+            old_instance, new_instance = _update_returning_old(None, values, where=Feature.name == name)
+            created = new_instance is None
+            if created:
+                new_instance = Feature(id=uuid.uuid4(), **{field.name: value for field, value in values.items()})
+                inserted = list(Feature
+                                .insert({Feature.id: new_instance.id, **values})
+                                .on_conflict_ignore()
+                                .returning(Feature.id)
+                                .tuples()
+                                .execute())
+                if not inserted:
+                    # a concurrent request created it first, its row is committed by now
+                    created = False
+                    old_instance, new_instance = _update_returning_old(None, values, where=Feature.name == name)
+                    if new_instance is None:
+                        raise SetpointsOperationError(message=f'Error: feature {name} was deleted concurrently',
+                                                      item_type=Feature.__name__)
+            log_changes(None if created else old_instance, new_instance, changed_by=changed_by, comment=comment)
+        _publish_invalidation([new_instance.id])
+        return _dict_for_data([new_instance])[0], created
     except peewee.PeeweeException as px:
         raise SetpointsOperationError(message=str(px),
                                       item_type=Feature.__name__)
 
 
+def add_features(items, changed_by='system', comment=None):
+    """Create many features in one transaction, returns per-item results"""
+    rows = []
+    for item in items:
+        rows.append(Feature(
+            id=uuid.uuid4(),
+            name=item.get('name'),
+            description=item.get('description'),
+            type=item.get('type'),
+            priority=item.get('priority'),
+            default_threshold=item.get('default_threshold'),
+            active=item.get('active', True),
+        ))
+
+    try:
+        with db.atomic():
+            Feature.bulk_create(rows, batch_size=BULK_CHUNK_SIZE)
+            log_changes_many([(None, row) for row in rows], changed_by=changed_by, comment=comment)
+        _publish_invalidation([row.id for row in rows])
+    except peewee.PeeweeException as px:
+        raise SetpointsOperationError(message=str(px),
+                                      item_type=Feature.__name__)
+
+    return [{'index': index, 'id': str(row.id), 'status': 'created'}
+            for index, row in enumerate(rows)]
+
+
+def _bulk_update_features(rows):
+    """UPDATE ... FROM (VALUES ...) per chunk; unlike CASE-based bulk_update it keeps column types for NULLs"""
+    columns = ('id',) + FEATURE_FIELDS
+    for chunk in peewee.chunked(rows, BULK_CHUNK_SIZE):
+        new = peewee.ValuesList([tuple(getattr(row, name) for name in columns) for row in chunk],
+                                columns=columns,
+                                alias='new')
+        (Feature
+         .update({getattr(Feature, name): getattr(new.c, name).cast(db.column_type(getattr(Feature, name)))
+                  for name in FEATURE_FIELDS})
+         .from_(new)
+         .where(Feature.id == new.c.id.cast(db.column_type(Feature.id)))
+         .execute())
+
+
+def modify_features(items, changed_by='system', comment=None):
+    """Update many features in one transaction, returns per-item results"""
+    ids = list({item['id'] for item in items})
+    results = []
+    pairs = []
+    try:
+        with db.atomic():
+            existing = {}
+            for chunk in peewee.chunked(ids, BULK_CHUNK_SIZE):
+                for row in Feature.select().where(Feature.id.in_(chunk)).for_update('FOR NO KEY UPDATE'):
+                    existing[row.id] = row
+
+            changed = {}
+            for index, item in enumerate(items):
+                row = existing.get(item['id'])
+                if row is None:
+                    results.append({'index': index, 'id': str(item['id']), 'status': 'not_found'})
+                    continue
+
+                old_row = clone_instance(row)
+                for field_name in FEATURE_FIELDS:
+                    setattr(row, field_name, item.get(field_name))
+                if not build_changes(old_row, row, changed_by):
+                    results.append({'index': index, 'id': str(row.id), 'status': 'unchanged'})
+                    continue
+
+                pairs.append((old_row, clone_instance(row)))
+                changed[row.id] = row
+                results.append({'index': index, 'id': str(row.id), 'status': 'updated'})
+
+            if changed:
+                _bulk_update_features(list(changed.values()))
+                log_changes_many(pairs, changed_by=changed_by, comment=comment)
+        if changed:
+            _publish_invalidation(list(changed))
+    except peewee.PeeweeException as px:
+        raise SetpointsOperationError(message=str(px),
+                                      item_type=Feature.__name__)
+
+    return results
+
+
 def get_feature_list(amount=None):
+    return get_feature_list_with_etag(amount)[0]
+
+
+def get_feature_list_with_etag(amount=None):
     try:
-        data = Feature.select().limit(amount)
-        result = _dict_for_data(data)
+        return _read_through(
+            _feature_list_cache, ('list', amount),
+            lambda: _dict_for_data(Feature.select().order_by(Feature.id).limit(amount)))
+    except peewee.PeeweeException as px:
+        raise SetpointsOperationError(message=str(px),
+                                      item_type=Feature.__name__)
+
+
+def get_feature_page(after=None,
+                     limit=100,
+                     type=None,
+                     priority=None,
+                     active=None,
+                     name_prefix=None,
+                     with_total=False):
+    """Keyset page of features ordered by id, `after` is the last id of the previous page"""
+    return get_feature_page_with_etag(after, limit, type, priority, active, name_prefix, with_total)[0]
+
+
+def get_feature_page_with_etag(after=None,
+                               limit=100,
+                               type=None,
+                               priority=None,
+                               active=None,
+                               name_prefix=None,
+                               with_total=False):
+    key = ('page', str(after) if after else None, limit, type, priority, active, name_prefix, with_total)
+    return _read_through(
+        _feature_list_cache, key,
+        lambda: _load_feature_page(after, limit, type, priority, active, name_prefix, with_total))
+
+
+def feature_filters(type=None, priority=None, active=None, name_prefix=None):
+    """WHERE conditions of the feature page, shared with the ASGI app"""
+    filters = []
+    if type is not None:
+        filters.append(Feature.type == type)
+    if priority is not None:
+        filters.append(Feature.priority == priority)
+    if active is not None:
+        filters.append(Feature.active == active)
+    if name_prefix:
+        filters.append(Feature.name.startswith(name_prefix))
+    return filters
+
+
+def _load_feature_page(after, limit, type, priority, active, name_prefix, with_total):
+    try:
+        filters = feature_filters(type, priority, active, name_prefix)
+
+        query = Feature.select()
+        if filters:
+            query = query.where(*filters)
+
+        page_query = query
+        if after is not None:
+            page_query = page_query.where(Feature.id > after)
+        rows = list(page_query.order_by(Feature.id).limit(limit + 1))
+
+        has_more = len(rows) > limit
+        items = _dict_for_data(rows[:limit])
+        result = {
+            'items': items,
+            'next_cursor': items[-1]['id'] if has_more else None,
+        }
+        if with_total:
+            result['total'] = query.count()
         return result
     except peewee.PeeweeException as px:
         raise SetpointsOperationError(message=str(px),
@@ -121,11 +461,29 @@ def get_feature_list(amount=None):
 
 
 def get_feature_by_id(item_id):
+    return get_feature_by_id_with_etag(item_id)[0]
+
+
+def _load_feature_by_id(item_id):
+    data = _dict_for_data(Feature.select().where(Feature.id == item_id))
+    return data[0] if data else {}
+
+
+def get_feature_by_id_with_etag(item_id):
     try:
-        data = Feature.select().where(Feature.id == item_id)
-        result = _dict_for_data(data)[0] if _dict_for_data(data) else {}
-        return result
+        return _read_through(_feature_cache, str(item_id), lambda: _load_feature_by_id(item_id))
     except peewee.PeeweeException as px:
         raise SetpointsOperationError(message=str(px),
                                       item_type=Feature.__name__)
 
+
+def get_features_as_of(item_ids, ts):
+    """Features as they were at moment ts (from snapshots and the change log)"""
+    states = get_entities_as_of(Feature, item_ids, ts)
+    return [{'id': item_id, **{name: state.get(name) for name in FEATURE_FIELDS}}
+            for item_id, state in states.items()]
+
+
+def get_feature_as_of(item_id, ts):
+    result = get_features_as_of([item_id], ts)
+    return result[0] if result else {}
@@ -0,0 +1,118 @@
+import numpy as np
+
+_NONE = np.empty(0, dtype=np.int64)
+# nodes with at most this many windows are leaves scanned with a mask,
+# below that a binary search per node costs more than comparing every window
+LEAF_SIZE = 2048
+
+
+class IntervalIndex:
+    """Static centered interval tree over half-open windows [start, end).
+
+    Windows are given as parallel arrays of bounds (-inf/inf for open ends)
+    and identified by their position. at(t) returns the windows containing t,
+    overlapping(t0, t1) the windows intersecting [t0, t1), both as sorted
+    position arrays in O(log n + k): every node on the search path answers
+    with one binary search and a slice, small leaves with a mask. Empty or
+    reversed windows never match, as in evaluation (start <= t < end).
+    """
+    __slots__ = ('_centers', '_start_keys', '_start_positions', '_end_keys', '_end_positions',
+                 '_left', '_right', '_starts', '_positions')
+
+    def __init__(self, start, end):
+        start = np.asarray(start, dtype=np.float64)
+        end = np.asarray(end, dtype=np.float64)
+        valid = np.nonzero(start < end)[0]
+        # per node: the center and the windows containing it, sorted by start and by end descending
+        self._centers, self._left, self._right = [], [], []
+        self._start_keys, self._start_positions, self._end_keys, self._end_positions = [], [], [], []
+        self._build(start, end, valid)
+        order = np.argsort(start[valid], kind='stable')
+        self._starts = start[valid][order]
+        self._positions = valid[order]
+
+    def __len__(self):
+        return len(self._positions)
+
+    def _build(self, start, end, valid):
+        # iterative: a skewed set of windows must not hit the recursion limit
+        pending = [(valid, -1, None)] if len(valid) else []
+        while pending:
+            members, parent, children = pending.pop()
+            node = len(self._centers)
+            if parent >= 0:
+                children[parent] = node
+            self._left.append(-1)
+            self._right.append(-1)
+            member_start, member_end = start[members], end[members]
+            if len(members) <= LEAF_SIZE:
+                self._centers.append(None)
+                self._start_keys.append(member_start)
+                self._end_keys.append(member_end)
+                self._start_positions.append(members)
+                self._end_positions.append(members)
+                continue
+            bounds = np.concatenate([member_start, member_end])
+            bounds = bounds[np.isfinite(bounds)]
+            median = (len(bounds) - 1) // 2
+            center = np.partition(bounds, median)[median].item() if len(bounds) else 0.0
+            left, right = member_end <= center, member_start > center
+            if left.all() or right.all():
+                # e.g. many windows ending at the median; the largest start lies in its own window
+                center = member_start.max().item()
+                left, right = member_end <= center, member_start > center
+            here = members[~(left | right)]
+
+            self._centers.append(center)
+            order = np.argsort(start[here], kind='stable')
+            self._start_keys.append(start[here][order])
+            self._start_positions.append(here[order])
+            order = np.argsort(-end[here], kind='stable')
+            self._end_keys.append(-end[here][order])
+            self._end_positions.append(here[order])
+            if left.any():
+                pending.append((members[left], node, self._left))
+            if right.any():
+                pending.append((members[right], node, self._right))
+
+    def _stab(self, t):
+        parts = []
+        node = 0 if self._centers else -1
+        while node >= 0:
+            center = self._centers[node]
+            if center is None:
+                # leaf, windows in build order so the mask keeps positions ascending
+                mask = (self._start_keys[node] <= t) & (t < self._end_keys[node])
+                parts.append(self._start_positions[node][mask])
+                break
+            if t < center:
+                # every window of the node ends after the center, so after t
+                count = np.searchsorted(self._start_keys[node], t, side='right')
+                parts.append(self._start_positions[node][:count])
+                node = self._left[node]
+            else:
+                # every window of the node starts at or before the center, so at or before t
+                count = np.searchsorted(self._end_keys[node], -t, side='left')
+                parts.append(self._end_positions[node][:count])
+                node = self._right[node] if t > center else -1
+        return parts
+
+    def at(self, t):
+        """Positions of the windows with start <= t < end"""
+        parts = self._stab(t)
+        return np.sort(np.concatenate(parts)) if parts else _NONE
+
+    def overlapping(self, t0, t1):
+        """Positions of the windows intersecting [t0, t1)"""
+        if not t0 < t1:
+            return _NONE
+        if self._centers and self._centers[0] is None:
+            # a single leaf, one mask answers
+            start, end = self._start_keys[0], self._end_keys[0]
+            return self._start_positions[0][(start < t1) & (end > t0)]
+        parts = self._stab(t0)
+        # plus the windows starting inside (t0, t1)
+        first = np.searchsorted(self._starts, t0, side='right')
+        last = np.searchsorted(self._starts, t1, side='left')
+        parts.append(self._positions[first:last])
+        return np.sort(np.concatenate(parts))
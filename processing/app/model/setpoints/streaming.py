@@ -0,0 +1,338 @@
+import time
+import uuid
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import peewee
+from app.manage_app.config import Config
+from app.model.models import db, ThresholdSet, StreamCheckpoint
+from app.model.exeptions import SetpointsOperationError
+from app.model.setpoints.compiled import SampleThresholds, get_compiled_threshold_set
+
+_NO_THRESHOLDS = SampleThresholds()
+
+
+class StreamBusyError(SetpointsOperationError):
+    """Another request is feeding the same run"""
+
+    def __init__(self, threshold_set_id, run_id):
+        super().__init__(message=f'Error: run {run_id} of threshold set {threshold_set_id} '
+                                 f'is being fed by another request',
+                         item_type=StreamCheckpoint.__name__)
+
+
+class FeatureStream:
+    """State of one feature in a run: thresholds in violation, last sample time, samples seen.
+
+    violated maps threshold ids to their column in the compiled snapshot of
+    version. The hysteresis band is not copied: every sample reads value and
+    deadband of the current snapshot, so threshold edits apply mid-run.
+    open_windows and the two cursors are where the sweep over the windows
+    stands; they are not saved, the first sample after a restore or a new
+    snapshot positions them again.
+    """
+    __slots__ = ('violated', 'version', 'last_t_ms', 'samples', 'open_windows', 'next_start', 'next_end')
+
+    def __init__(self, violated=None, version=None, last_t_ms=None, samples=0):
+        self.violated = violated or {}
+        self.version = version
+        self.last_t_ms = last_t_ms
+        self.samples = samples
+        self.open_windows = None
+        self.next_start = 0
+        self.next_end = 0
+
+    def to_json(self):
+        return {'violated': sorted(self.violated), 'last_t_ms': self.last_t_ms, 'samples': self.samples}
+
+    @classmethod
+    def from_json(cls, data):
+        # columns are resolved against the snapshot with the next sample
+        return cls(violated=dict.fromkeys(data['violated']), last_t_ms=data['last_t_ms'], samples=data['samples'])
+
+
+def feed_feature(state, thresholds, version, feature_id, series_id, t_ms, values, events):
+    """Apply the samples of one series to the feature state, appending violation events.
+
+    Same rules as evaluate_feature(): a threshold is violated from the first
+    sample inside its window beyond value, and clears once a sample is outside
+    the window or back by more than deadband; samples inside the band keep the
+    state. Samples are taken in time order, those older than the last sample
+    of the feature are skipped. Windows are opened and closed by a sweep as
+    time moves on, so a sample costs O(1) plus the thresholds it can touch.
+    Returns the number of skipped samples.
+    """
+    view = thresholds.sample_view() if thresholds is not None else _NO_THRESHOLDS
+    order = sorted(range(len(t_ms)), key=t_ms.__getitem__)
+
+    if state.version != version:
+        violated = {}
+        for threshold_id in state.violated:
+            column = view.column_by_id.get(threshold_id)
+            if column is not None:
+                violated[threshold_id] = column
+            elif order:
+                # deleted or deactivated while in violation, the alarm must not hang
+                events.append({'series_id': series_id, 'feature_id': feature_id, 'threshold_id': threshold_id,
+                               'event': 'end', 't_ms': t_ms[order[0]], 'value': values[order[0]],
+                               'threshold': None})
+        state.violated = violated
+        state.version = version
+        state.open_windows = None
+
+    level, clear_level, sign, start, end = view.level, view.clear_level, view.sign, view.start, view.end
+    by_start, start_keys, by_end, end_keys = view.by_start, view.start_keys, view.by_end, view.end_keys
+    active = set(state.violated.values())
+    open_windows, next_start, next_end = state.open_windows, state.next_start, state.next_end
+    last = state.last_t_ms
+    late = 0
+    for index in order:
+        t = t_ms[index]
+        if last is not None and t < last:
+            late += 1
+            continue
+        last = t
+        if open_windows is None:
+            open_windows, next_start, next_end = view.open_at(t)
+        else:
+            while next_start < len(start_keys) and start_keys[next_start] <= t:
+                open_windows.add(by_start[next_start])
+                next_start += 1
+            while next_end < len(end_keys) and end_keys[next_end] <= t:
+                open_windows.discard(by_end[next_end])
+                next_end += 1
+
+        x = values[index]
+        for column in sorted(open_windows.union(active) if active else open_windows):
+            signal = x * sign[column]
+            if start[column] <= t < end[column]:
+                if signal > level[column]:
+                    violated = True
+                elif signal <= clear_level[column]:
+                    violated = False
+                else:
+                    continue
+            else:
+                violated = False
+            if violated == (column in active):
+                continue
+            if violated:
+                active.add(column)
+            else:
+                active.discard(column)
+            events.append({'series_id': series_id, 'feature_id': feature_id,
+                           'threshold_id': view.threshold_ids[column],
+                           'event': 'start' if violated else 'end', 't_ms': t, 'value': x,
+                           'threshold': level[column] * sign[column]})
+
+    state.violated = {view.threshold_ids[column]: column for column in sorted(active)}
+    state.open_windows, state.next_start, state.next_end = open_windows, next_start, next_end
+    state.last_t_ms = last
+    state.samples += len(order) - late
+    return late
+
+
+class RunStream:
+    """Streaming evaluation of one run (an ongoing inspection) against a threshold set.
+
+    Holds a FeatureStream per feature and seq, the number of the last applied
+    micro-batch: a batch with seq at or below it is a replay and is skipped.
+    revision counts checkpoints. token is new with every checkpoint, it tells
+    whether the copy in memory is the saved one or another worker has moved
+    the run since (revisions start over once a run is deleted, tokens do not).
+    """
+
+    def __init__(self, threshold_set_id, run_id, features=None, seq=None, revision=0, token=None):
+        self.threshold_set_id = threshold_set_id
+        self.run_id = run_id
+        self.features = features or {}
+        self.seq = seq
+        self.revision = revision
+        self.token = token
+        self.dirty = False
+        self.checkpointed_at = time.monotonic()
+        self.used_at = time.monotonic()
+
+    @classmethod
+    def from_checkpoint(cls, row):
+        return cls(threshold_set_id=str(row.threshold_set_id),
+                   run_id=row.run_id,
+                   features={feature_id: FeatureStream.from_json(data) for feature_id, data in row.state.items()},
+                   seq=row.seq,
+                   revision=row.revision,
+                   token=row.token)
+
+    def apply(self, series, seq=None):
+        """Apply one micro-batch [{feature_id, series_id, t_ms, values}], returns {seq, events, late, duplicate}"""
+        if seq is not None and self.seq is not None and seq <= self.seq:
+            return {'seq': seq, 'events': [], 'late': 0, 'duplicate': True}
+        compiled = get_compiled_threshold_set(self.threshold_set_id)
+        if not compiled.active:
+            raise SetpointsOperationError(message=f'Error: threshold set {self.threshold_set_id} is not active',
+                                          item_type=ThresholdSet.__name__)
+
+        events = []
+        late = 0
+        for item in series:
+            feature_id = str(item['feature_id'])
+            state = self.features.get(feature_id)
+            if state is None:
+                state = self.features[feature_id] = FeatureStream()
+            late += feed_feature(state, compiled.features.get(feature_id), compiled.version, feature_id,
+                                 item.get('series_id'), item['t_ms'], item['values'], events)
+        if seq is not None:
+            self.seq = seq
+        self.dirty = True
+        return {'seq': seq, 'events': events, 'late': late, 'duplicate': False}
+
+    def checkpoint(self):
+        """Save the state, the next request on any worker continues from here"""
+        revision = self.revision + 1
+        token = uuid.uuid4()
+        try:
+            (StreamCheckpoint
+             .insert(threshold_set_id=self.threshold_set_id,
+                     run_id=self.run_id,
+                     seq=self.seq,
+                     revision=revision,
+                     token=token,
+                     state={feature_id: state.to_json() for feature_id, state in self.features.items()},
+                     updated_at=datetime.now(timezone.utc))
+             .on_conflict(conflict_target=[StreamCheckpoint.threshold_set_id, StreamCheckpoint.run_id],
+                          preserve=[StreamCheckpoint.seq, StreamCheckpoint.revision, StreamCheckpoint.token,
+                                    StreamCheckpoint.state, StreamCheckpoint.updated_at])
+             .execute())
+        except peewee.PeeweeException as px:
+            raise SetpointsOperationError(message=str(px),
+                                          item_type=StreamCheckpoint.__name__)
+        self.revision = revision
+        self.token = token
+        self.dirty = False
+        self.checkpointed_at = time.monotonic()
+
+    def checkpoint_due(self):
+        """Checkpoint when STREAM_CHECKPOINT_INTERVAL_MS has passed since the last one, returns True if saved"""
+        if self.dirty and (time.monotonic() - self.checkpointed_at) * 1000 >= Config.STREAM_CHECKPOINT_INTERVAL_MS:
+            self.checkpoint()
+            return True
+        return False
+
+    def summary(self):
+        return {
+            'threshold_set_id': self.threshold_set_id,
+            'run_id': self.run_id,
+            'seq': self.seq,
+            'revision': self.revision,
+            'features': [{'feature_id': feature_id, **state.to_json()}
+                         for feature_id, state in sorted(self.features.items())],
+        }
+
+
+class RunStreamRegistry:
+    """Runs held in memory by this process, keyed by (threshold_set_id, run_id).
+
+    A run is fed by one request at a time across all workers: open() takes a
+    Postgres advisory lock on the run, then continues from the copy in memory
+    when its checkpoint token is the saved one, otherwise from the checkpoint (another
+    worker fed the run meanwhile, or this one restarted). The run is saved
+    when the request ends. Runs idle for STREAM_IDLE_SECONDS are dropped from
+    memory, their checkpoint stays.
+    """
+
+    def __init__(self, idle_seconds):
+        self.idle_seconds = idle_seconds
+        self._runs = {}
+        self._lock = threading.Lock()
+
+    def _evict_idle(self):
+        deadline = time.monotonic() - self.idle_seconds
+        for key, run in list(self._runs.items()):
+            if run.used_at < deadline:
+                del self._runs[key]
+
+    def _restore(self, threshold_set_id, run_id):
+        match = (StreamCheckpoint.threshold_set_id == threshold_set_id) & (StreamCheckpoint.run_id == run_id)
+        saved = (StreamCheckpoint
+                 .select(StreamCheckpoint.token)
+                 .where(match)
+                 .tuples()
+                 .first())
+        with self._lock:
+            self._evict_idle()
+            run = self._runs.get((threshold_set_id, run_id))
+        # no checkpoint: only a run that was never saved is still current
+        if run is not None and (saved[0] == run.token if saved else run.revision == 0):
+            return run
+        row = StreamCheckpoint.get_or_none(match) if saved else None
+        run = RunStream.from_checkpoint(row) if row else RunStream(threshold_set_id, run_id)
+        with self._lock:
+            self._runs[(threshold_set_id, run_id)] = run
+        return run
+
+    @contextmanager
+    def open(self, threshold_set_id, run_id):
+        threshold_set_id = str(threshold_set_id)
+        lock_key = f'stream:{threshold_set_id}:{run_id}'
+        try:
+            # the session lock is released on the same connection, whatever the pool does meanwhile
+            connection = db.connection()
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_try_advisory_lock(hashtextextended(%s, 0))', (lock_key,))
+                locked = cursor.fetchone()[0]
+        except peewee.PeeweeException as px:
+            raise SetpointsOperationError(message=str(px),
+                                          item_type=StreamCheckpoint.__name__)
+        if not locked:
+            raise StreamBusyError(threshold_set_id, run_id)
+
+        run = None
+        try:
+            try:
+                run = self._restore(threshold_set_id, run_id)
+            except peewee.PeeweeException as px:
+                raise SetpointsOperationError(message=str(px),
+                                              item_type=StreamCheckpoint.__name__)
+            yield run
+        finally:
+            try:
+                if run is not None:
+                    run.used_at = time.monotonic()
+                    if run.dirty:
+                        run.checkpoint()
+            finally:
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT pg_advisory_unlock(hashtextextended(%s, 0))', (lock_key,))
+
+    def forget(self, run):
+        """Drop the run from memory and delete its checkpoint (call inside open())"""
+        run.dirty = False
+        with self._lock:
+            self._runs.pop((run.threshold_set_id, run.run_id), None)
+        try:
+            return (StreamCheckpoint
+                    .delete()
+                    .where((StreamCheckpoint.threshold_set_id == run.threshold_set_id) &
+                           (StreamCheckpoint.run_id == run.run_id))
+                    .execute())
+        except peewee.PeeweeException as px:
+            raise SetpointsOperationError(message=str(px),
+                                          item_type=StreamCheckpoint.__name__)
+
+
+_registry = RunStreamRegistry(Config.STREAM_IDLE_SECONDS)
+
+
+def open_run(threshold_set_id, run_id):
+    """with open_run(set_id, run_id) as run: run.apply(...) - the run is saved on exit"""
+    return _registry.open(threshold_set_id, run_id)
+
+
+def get_run_state(threshold_set_id, run_id):
+    with _registry.open(threshold_set_id, run_id) as run:
+        return run.summary()
+
+
+def delete_run(threshold_set_id, run_id):
+    """Forget the run in this process and its checkpoint, returns the number of deleted checkpoints"""
+    with _registry.open(threshold_set_id, run_id) as run:
+        return _registry.forget(run)
@@ -0,0 +1,459 @@
+import uuid
+import peewee
+from peewee import fn, Value
+from typing import List, Dict
+from app.model.models import db, ThresholdSet, Threshold
+from app.model.setpoints.compiled import invalidate_compiled_threshold_sets
+from app.model.exeptions import SetpointsOperationError
+from app.model.changelog import log_changes, log_rows_sql
+
+BULK_CHUNK_SIZE = 500
+
+THRESHOLD_SET_FIELDS = ('name', 'description', 'group', 'active')
+THRESHOLD_FIELDS = ('feature_id', 'default', 'value', 'deadband', 'step_indicator',
+                    'time_point_start_ms', 'time_point_end_ms', 'active')
+# поля, которые сравнивает diff; признак и окно времени - ключ сопоставления порогов
+THRESHOLD_DIFF_FIELDS = ('default', 'value', 'deadband', 'step_indicator', 'active')
+
+
+def _dict_for_set(data) -> List[Dict]:
+    data_dict = []
+    for point in data:
+        data_dict.append({
+            'id':           str(point.id),
+            'name':         point.name,
+            'description':  point.description,
+            'group':        point.group,
+            'active':       point.active,
+            'version':      point.version,
+            'origin_id':    str(point.origin_id or point.id),
+        })
+    return data_dict
+
+
+def _select_thresholds(*filters):
+    """Threshold dicts as the API returns them.
+
+    Ids are read as text: parsing three UUIDs per row into objects only to
+    print them again costs more than the query itself on large sets.
+    """
+    columns = [Threshold.id.cast('text'), Threshold.feature_id.cast('text'), Threshold.threshold_set_id.cast('text')]
+    columns += [getattr(Threshold, name) for name in THRESHOLD_FIELDS[1:]]
+    names = ('id', 'feature_id', 'threshold_set_id') + THRESHOLD_FIELDS[1:]
+    query = (Threshold
+             .select(*columns)
+             .where(*filters)
+             .order_by(Threshold.feature_id,
+                       Threshold.time_point_start_ms.asc(nulls='FIRST'),
+                       Threshold.time_point_end_ms.asc(nulls='LAST'),
+                       Threshold.id)
+             .tuples())
+    return [dict(zip(names, row)) for row in query]
+
+
+def _publish_invalidation():
+    # other workers learn about the change from the version trigger's NOTIFY
+    db.on_commit(invalidate_compiled_threshold_sets)
+
+
+def _update_returning_old(model, field_names, item_id, values):
+    """UPDATE ... FROM (old row) ... RETURNING, (old, new) instances or (None, None)"""
+    returning = [model.id] + [getattr(model, name) for name in field_names]
+    old = (model
+           .select(*returning)
+           .where(model.id == item_id)
+           # NO KEY: the update changes no keys, inserts referencing the row (FOR KEY SHARE) do not wait
+           .for_update('FOR NO KEY UPDATE')
+           .alias('old'))
+    returning += [getattr(old.c, getattr(model, name).column_name).alias(f'old_{name}') for name in field_names]
+    rows = list(model
+                .update(values)
+                .from_(old)
+                .where(model.id == old.c.id)
+                .returning(*returning)
+                .dicts()
+                .execute())
+    if not rows:
+        return None, None
+    row = rows[0]
+    new_instance = model(id=row['id'], **{name: row[name] for name in field_names})
+    old_instance = model(id=row['id'], **{name: row[f'old_{name}'] for name in field_names})
+    return old_instance, new_instance
+
+
+# threshold sets ------------------------------------------------------------------------------------------------------
+
+def add_threshold_set(name,
+                      description=None,
+                      group=None,
+                      active=True,
+                      changed_by='system',
+                      comment=None
+                      ):
+
+    u = uuid.uuid4()
+    try:
+        row = ThresholdSet(
+            id=u,
+            name=name,
+            description=description,
+            group=group,
+            active=active,
+            version=1,
+        )
+        with db.atomic():
+            row.save(force_insert=True)
+            log_changes(None, row, changed_by=changed_by, comment=comment)
+        _publish_invalidation()
+        return u
+    except peewee.PeeweeException as px:
+        raise SetpointsOperationError(message=str(px),
+                                      item_type=ThresholdSet.__name__,
+                                      data={"name": name,
+                                            "description": description,
+                                            "group": group,
+                                            "active": active})
+
+
+def modify_threshold_set(item_id,
+                         name,
+                         description=None,
+                         group=None,
+                         active=True,
+                         changed_by='system',
+                         comment=None
+                         ):
+
+    try:
+        with db.atomic():
+            old_instance, new_instance = _update_returning_old(ThresholdSet, THRESHOLD_SET_FIELDS, item_id, {
+                ThresholdSet.name: name,
+                ThresholdSet.description: description,
+                ThresholdSet.group: group,
+                ThresholdSet.active: active,
+            })
+            if new_instance is None:
+                raise SetpointsOperationError(message=f'Error: {item_id} does not exist',
+                                              item_type=ThresholdSet.__name__)
+            log_changes(old_instance, new_instance, changed_by=changed_by, comment=comment)
+        _publish_invalidation()
+        return get_threshold_set_by_id(item_id)
+    except peewee.PeeweeException as px:
+        raise SetpointsOperationError(message=str(px),
+                                      item_type=ThresholdSet.__name__)
+
+
+def delete_threshold_set(item_id, changed_by='system', comment=None):
+    """Delete a set with all its thresholds, every deleted row is logged"""
+    try:
+        with db.atomic():
+            if not ThresholdSet.select().where(ThresholdSet.id == item_id).exists():
+                raise SetpointsOperationError(message=f'Error: {item_id} does not exist',
+                                              item_type=ThresholdSet.__name__)
+            thresholds = Threshold.select(Threshold.id).where(Threshold.threshold_set_id == item_id)
+            log_rows_sql(Threshold, thresholds, changed_by=changed_by, comment=comment, deleted=True)
+            log_rows_sql(ThresholdSet, ThresholdSet.select(ThresholdSet.id).where(ThresholdSet.id == item_id),
+                         changed_by=changed_by, comment=comment, deleted=True)
+            deleted = Threshold.delete().where(Threshold.threshold_set_id == item_id).execute()
+            ThresholdSet.delete().where(ThresholdSet.id == item_id).execute()
+        _publish_invalidation()
+        return deleted
+    except peewee.PeeweeException as px:
+        raise SetpointsOperationError(message=str(px),
+                                      item_type=ThresholdSet.__name__)
+
+
+def get_threshold_sets(name_prefix=None, group=None, active=None):
+    """All sets ordered by name and version"""
+    filters = []
+    if name_prefix:
+        filters.append(ThresholdSet.name.startswith(name_prefix))
+    if group is not None:
+        filters.append(ThresholdSet.group == group)
+    if active is not None:
+        filters.append(ThresholdSet.active == active)
+    try:
+        query = ThresholdSet.select()
+        if filters:
+            query = query.where(*filters)
+        return _dict_for_set(query.order_by(ThresholdSet.name, ThresholdSet.version, ThresholdSet.id))
+    except peewee.PeeweeException as px:
+        raise SetpointsOperationError(message=str(px),
+                                      item_type=ThresholdSet.__name__)
+
+
+def get_threshold_set_by_id(item_id):
+    try:
+        data = _dict_for_set(ThresholdSet.select().where(ThresholdSet.id == item_id))
+        return data[0] if data else {}
+    except peewee.PeeweeException as px:
+        raise SetpointsOperationError(message=str(px),
+                                      item_type=ThresholdSet.__name__)
+
+
+def _origin(threshold_set):
+    return fn.COALESCE(threshold_set.origin_id, threshold_set.id)
+
+
+def get_threshold_set_versions(item_id):
+    """Every version of the set item_id belongs to, oldest first"""
+    try:
+        this = ThresholdSet.alias('this')
+        query = (ThresholdSet
+                 .select()
+                 .join(this, on=(_origin(ThresholdSet) == _origin(this)))
+                 .where(this.id == item_id)
+                 .order_by(ThresholdSet.version))
+        return _dict_for_set(query)
+    except peewee.PeeweeException as px:
+        raise SetpointsOperationError(message=str(px),
+                                      item_type=ThresholdSet.__name__)
+
+
+def clone_threshold_set(item_id, changed_by='system', comment=None):
+    """Create the next version of a set as a copy of item_id, returns (new set, number of thresholds).
+
+    The thresholds are copied by one INSERT ... SELECT with new UUIDs generated
+    by Postgres and logged by one more, in the same transaction; nothing is read
+    into Python however large the set is.
+    """
+    try:
+        with db.atomic():
+            source = ThresholdSet.get_or_none(ThresholdSet.id == item_id)
+            if source is None:
+                raise SetpointsOperationError(message=f'Error: {item_id} does not exist',
+                                              item_type=ThresholdSet.__name__)
+            origin_id = source.origin_id or source.id
+            # the version numbers of one set are handed out one clone at a time
+            db.execute_sql('SELECT pg_advisory_xact_lock(hashtextextended(%s, 0))', (f'thresholdset:{origin_id}',))
+            last_version = (ThresholdSet
+                            .select(fn.MAX(ThresholdSet.version))
+                            .where(_origin(ThresholdSet) == origin_id)
+                            .scalar())
+            new_set = ThresholdSet(
+                id=uuid.uuid4(),
+                name=source.name,
+                description=source.description,
+                group=source.group,
+                active=source.active,
+                version=last_version + 1,
+                origin_id=origin_id,
+            )
+            new_set.save(force_insert=True)
+            log_changes(None, new_set, changed_by=changed_by, comment=comment)
+
+            copied = [getattr(Threshold, name) for name in THRESHOLD_FIELDS]
+            query = (Threshold
+                     .select(fn.gen_random_uuid(), Value(str(new_set.id)).cast('uuid'), *copied)
+                     .where(Threshold.threshold_set_id == source.id))
+            count = (Threshold
+                     .insert_from(query, [Threshold.id, Threshold.threshold_set_id] + copied)
+                     .as_rowcount()
+                     .execute())
+            log_rows_sql(Threshold, Threshold.select(Threshold.id).where(Threshold.threshold_set_id == new_set.id),
+                         changed_by=changed_by, comment=comment)
+        _publish_invalidation()
+        return _dict_for_set([new_set])[0], count
+    except peewee.PeeweeException as px:
+        raise SetpointsOperationError(message=str(px),
+                                      item_type=ThresholdSet.__name__)
+
+
+def _window_bound(column, unbounded):
+    # NULL is an open window end; FULL JOIN needs plain equality, so NULL becomes the bigint limit
+    return fn.COALESCE(column.cast('bigint'), unbounded)
+
+
+def diff_threshold_sets(base_id, other_id):
+    """Thresholds that differ between two sets, computed by one FULL JOIN in Postgres.
+
+    Thresholds are matched by feature and time window. Each item is 'added'
+    (only in other), 'removed' (only in base) or 'changed' (with the list of
+    changed fields); thresholds equal in both sets are left out.
+    """
+    columns = [Threshold.id, Threshold.feature_id, Threshold.time_point_start_ms, Threshold.time_point_end_ms,
+               _window_bound(Threshold.time_point_start_ms, -2 ** 63).alias('start_key'),
+               _window_bound(Threshold.time_point_end_ms, 2 ** 63 - 1).alias('end_key')]
+    columns += [getattr(Threshold, name) for name in THRESHOLD_DIFF_FIELDS]
+    base = Threshold.select(*columns).where(Threshold.threshold_set_id == base_id).alias('base')
+    other = Threshold.select(*columns).where(Threshold.threshold_set_id == other_id).alias('other')
+
+    base_values = peewee.EnclosedNodeList([getattr(base.c, name) for name in THRESHOLD_DIFF_FIELDS])
+    other_values = peewee.EnclosedNodeList([getattr(other.c, name) for name in THRESHOLD_DIFF_FIELDS])
+    selected = [base.c.id.alias('base_id'), other.c.id.alias('other_id'),
+                fn.COALESCE(base.c.feature_id, other.c.feature_id).alias('feature_id'),
+                fn.COALESCE(base.c.time_point_start_ms, other.c.time_point_start_ms).alias('time_point_start_ms'),
+                fn.COALESCE(base.c.time_point_end_ms, other.c.time_point_end_ms).alias('time_point_end_ms')]
+    selected += [getattr(base.c, name).alias(f'base_{name}') for name in THRESHOLD_DIFF_FIELDS]
+    selected += [getattr(other.c, name).alias(f'other_{name}') for name in THRESHOLD_DIFF_FIELDS]
+
+    query = (peewee.Select([base], selected)
+             .join(other, peewee.JOIN.FULL_OUTER,
+                   on=((base.c.feature_id == other.c.feature_id) &
+                       (base.c.start_key == other.c.start_key) &
+                       (base.c.end_key == other.c.end_key)))
+             .where(base.c.id.is_null() | other.c.id.is_null() |
+                    peewee.Expression(base_values, 'IS DISTINCT FROM', other_values))
+             .order_by(peewee.SQL('feature_id'),
+                       peewee.SQL('time_point_start_ms NULLS FIRST'),
+                       peewee.SQL('time_point_end_ms NULLS LAST'))
+             .bind(db)
+             .dicts())
+    try:
+        for set_id in (base_id, other_id):
+            if not ThresholdSet.select().where(ThresholdSet.id == set_id).exists():
+                raise SetpointsOperationError(message=f'Error: {set_id} does not exist',
+                                              item_type=ThresholdSet.__name__)
+        rows = list(query)
+    except peewee.PeeweeException as px:
+        raise SetpointsOperationError(message=str(px),
+                                      item_type=ThresholdSet.__name__)
+
+    items = []
+    for row in rows:
+        sides = {}
+        for side in ('base', 'other'):
+            if row[f'{side}_id'] is None:
+                sides[side] = None
+            else:
+                sides[side] = {'id': str(row[f'{side}_id']),
+                               **{name: row[f'{side}_{name}'] for name in THRESHOLD_DIFF_FIELDS}}
+        if sides['base'] is None:
+            status, changed = 'added', []
+        elif sides['other'] is None:
+            status, changed = 'removed', []
+        else:
+            status = 'changed'
+            changed = [name for name in THRESHOLD_DIFF_FIELDS if sides['base'][name] != sides['other'][name]]
+        items.append({
+            'feature_id': str(row['feature_id']),
+            'time_point_start_ms': row['time_point_start_ms'],
+            'time_point_end_ms': row['time_point_end_ms'],
+            'status': status,
+            'changed_fields': changed,
+            **sides,
+        })
+    return {'base_id': str(base_id), 'other_id': str(other_id), 'items': items}
+
+
+# thresholds ----------------------------------------------------------------------------------------------------------
+
+def threshold_window():
+    """int8range of the threshold window, the expression of the GiST index (migration 4)"""
+    return fn.threshold_window(Threshold.time_point_start_ms, Threshold.time_point_end_ms)
+
+
+def get_thresholds(threshold_set_id, feature_id=None, t_ms=None, from_ms=None, to_ms=None):
+    """Thresholds of a set ordered by feature and time window.
+
+    t_ms keeps the windows containing that moment, from_ms/to_ms the windows
+    intersecting [from_ms, to_ms); both are answered by the GiST index.
+    """
+    filters = [Threshold.threshold_set_id == threshold_set_id]
+    if feature_id is not None:
+        filters.append(Threshold.feature_id == feature_id)
+    if t_ms is not None:
+        filters.append(peewee.Expression(threshold_window(), '@>', Value(t_ms).cast('bigint')))
+    if from_ms is not None or to_ms is not None:
+        filters.append(peewee.Expression(threshold_window(), '&&', fn.int8range(from_ms, to_ms)))
+    try:
+        return _select_thresholds(*filters)
+    except peewee.PeeweeException as px:
+        raise SetpointsOperationError(message=str(px),
+                                      item_type=Threshold.__name__)
+
+
+def get_threshold_by_id(item_id):
+    try:
+        data = _select_thresholds(Threshold.id == item_id)
+        return data[0] if data else {}
+    except peewee.PeeweeException as px:
+        raise SetpointsOperationError(message=str(px),
+                                      item_type=Threshold.__name__)
+
+
+def add_thresholds(threshold_set_id, items, changed_by='system', comment=None):
+    """Create many thresholds of one set in one transaction, returns per-item results"""
+    rows = []
+    for item in items:
+        rows.append(Threshold(
+            id=uuid.uuid4(),
+            threshold_set_id=threshold_set_id,
+            feature_id=item.get('feature_id'),
+            default=item.get('default', False),
+            value=item.get('value'),
+            deadband=item.get('deadband'),
+            step_indicator=item.get('step_indicator'),
+            time_point_start_ms=item.get('time_point_start_ms'),
+            time_point_end_ms=item.get('time_point_end_ms'),
+            active=item.get('active', True),
+        ))
+
+    try:
+        with db.atomic():
+            if not ThresholdSet.select().where(ThresholdSet.id == threshold_set_id).exists():
+                raise SetpointsOperationError(message=f'Error: {threshold_set_id} does not exist',
+                                              item_type=ThresholdSet.__name__)
+            Threshold.bulk_create(rows, batch_size=BULK_CHUNK_SIZE)
+            # the change log is built from the inserted rows in Postgres, a set has thousands of them
+            for chunk in peewee.chunked([row.id for row in rows], BULK_CHUNK_SIZE):
+                log_rows_sql(Threshold, Threshold.select(Threshold.id).where(Threshold.id.in_(chunk)),
+                             changed_by=changed_by, comment=comment)
+        _publish_invalidation()
+    except peewee.PeeweeException as px:
+        raise SetpointsOperationError(message=str(px),
+                                      item_type=Threshold.__name__)
+
+    return [{'index': index, 'id': str(row.id), 'status': 'created'}
+            for index, row in enumerate(rows)]
+
+
+def modify_threshold(item_id,
+                     feature_id,
+                     value,
+                     default=False,
+                     deadband=None,
+                     step_indicator=None,
+                     time_point_start_ms=None,
+                     time_point_end_ms=None,
+                     active=True,
+                     changed_by='system',
+                     comment=None
+                     ):
+
+    try:
+        with db.atomic():
+            old_instance, new_instance = _update_returning_old(Threshold, THRESHOLD_FIELDS, item_id, {
+                Threshold.feature_id: feature_id,
+                Threshold.default: default,
+                Threshold.value: value,
+                Threshold.deadband: deadband,
+                Threshold.step_indicator: step_indicator,
+                Threshold.time_point_start_ms: time_point_start_ms,
+                Threshold.time_point_end_ms: time_point_end_ms,
+                Threshold.active: active,
+            })
+            if new_instance is None:
+                raise SetpointsOperationError(message=f'Error: {item_id} does not exist',
+                                              item_type=Threshold.__name__)
+            log_changes(old_instance, new_instance, changed_by=changed_by, comment=comment)
+        _publish_invalidation()
+        return get_threshold_by_id(item_id)
+    except peewee.PeeweeException as px:
+        raise SetpointsOperationError(message=str(px),
+                                      item_type=Threshold.__name__)
+
+
+def delete_threshold(item_id, changed_by='system', comment=None):
+    try:
+        with db.atomic():
+            logged = log_rows_sql(Threshold, Threshold.select(Threshold.id).where(Threshold.id == item_id),
+                                  changed_by=changed_by, comment=comment, deleted=True)
+            if not logged:
+                raise SetpointsOperationError(message=f'Error: {item_id} does not exist',
+                                              item_type=Threshold.__name__)
+            Threshold.delete().where(Threshold.id == item_id).execute()
+        _publish_invalidation()
+    except peewee.PeeweeException as px:
+        raise SetpointsOperationError(message=str(px),
+                                      item_type=Threshold.__name__)
@@ -0,0 +1,96 @@
+import time
+from app.model.models import db, Feature, ThresholdSet, Threshold, DataVersion
+
+SETPOINTS_VERSION = 'setpoints'
+SETPOINTS_VERSION_CHANNEL = 'setpoints_version'
+SETPOINTS_VERSION_SEQUENCE = 'setpoints_version_seq'
+# advisory lock id: writers hold it shared until commit, readers wait for its current holders
+SETPOINTS_WRITE_LOCK_ID = 7_104_202_512
+# interval of checking whether those writers are done
+SETTLE_POLL_SECONDS = 0.005
+# a bigint advisory key shows up in pg_locks split into classid/objid, objsubid 1;
+# a session that is itself writing does not wait for its own transaction
+_WRITE_LOCK_HOLDERS = (
+    "SELECT virtualtransaction FROM pg_locks WHERE locktype = 'advisory' AND granted "
+    "AND classid = %s AND objid = %s AND objsubid = 1 AND pid <> pg_backend_pid()"
+)
+# DML events with a transition table; a statement that changed no rows does not bump the version
+_VERSIONED_EVENTS = (('INSERT', 'NEW'), ('UPDATE', 'NEW'), ('DELETE', 'OLD'))
+
+_BUMP_FUNCTION = """
+CREATE OR REPLACE FUNCTION bump_setpoints_version() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP <> 'TRUNCATE' THEN
+        IF NOT EXISTS (SELECT 1 FROM changed_rows) THEN
+            RETURN NULL;
+        END IF;
+    END IF;
+    -- shared: concurrent writers never wait for each other here
+    PERFORM pg_advisory_xact_lock_shared({lock_id});
+    PERFORM pg_notify('{channel}', nextval('{sequence}')::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+"""
+
+
+def install_version_triggers():
+    """Statement-level triggers bumping the setpoints version on any change to features and thresholds.
+
+    The version is a sequence, so writers do not serialize on a counter row;
+    nextval is not transactional, get_settled_setpoints_version() tells when
+    the writes behind a version are committed.
+    """
+    table = DataVersion._meta.table_name
+    with db.atomic():
+        db.execute_sql(f'CREATE SEQUENCE IF NOT EXISTS "{SETPOINTS_VERSION_SEQUENCE}"')
+        # versions keep growing across the switch from the old counter row
+        db.execute_sql(f'SELECT setval(%s, GREATEST(version, 1)) FROM "{table}" WHERE name = %s',
+                       (SETPOINTS_VERSION_SEQUENCE, SETPOINTS_VERSION))
+        DataVersion.delete().where(DataVersion.name == SETPOINTS_VERSION).execute()
+        db.execute_sql(_BUMP_FUNCTION.format(lock_id=SETPOINTS_WRITE_LOCK_ID,
+                                             channel=SETPOINTS_VERSION_CHANNEL,
+                                             sequence=SETPOINTS_VERSION_SEQUENCE))
+        for model in (Feature, ThresholdSet, Threshold):
+            model_table = model._meta.table_name
+            db.execute_sql(f'DROP TRIGGER IF EXISTS "{model_table}_setpoints_version" ON "{model_table}"')
+            for event, rows in _VERSIONED_EVENTS:
+                db.execute_sql(f'CREATE OR REPLACE TRIGGER "{model_table}_setpoints_version_{event.lower()}" '
+                               f'AFTER {event} ON "{model_table}" REFERENCING {rows} TABLE AS changed_rows '
+                               f'FOR EACH STATEMENT EXECUTE FUNCTION bump_setpoints_version()')
+            db.execute_sql(f'CREATE OR REPLACE TRIGGER "{model_table}_setpoints_version_truncate" '
+                           f'AFTER TRUNCATE ON "{model_table}" '
+                           f'FOR EACH STATEMENT EXECUTE FUNCTION bump_setpoints_version()')
+
+
+def get_setpoints_version():
+    """Latest handed out setpoints version, its writes may still be in flight"""
+    cursor = db.execute_sql(f'SELECT CASE WHEN is_called THEN last_value ELSE 0 END '
+                            f'FROM "{SETPOINTS_VERSION_SEQUENCE}"')
+    return cursor.fetchone()[0]
+
+
+def _write_lock_holders():
+    cursor = db.execute_sql(_WRITE_LOCK_HOLDERS, (SETPOINTS_WRITE_LOCK_ID >> 32,
+                                                  SETPOINTS_WRITE_LOCK_ID & 0xFFFFFFFF))
+    return {row[0] for row in cursor.fetchall()}
+
+
+def get_settled_setpoints_version(timeout=None):
+    """Setpoints version whose writes are all committed (or rolled back), to build caches from.
+
+    Writers take the write lock before nextval, so the transactions holding it
+    right after the version is read are the only ones that can be behind it.
+    Only those are waited for, without taking the lock: new writers never
+    queue behind a reader. Returns None if they are still running after
+    timeout seconds (None waits as long as it takes).
+    """
+    version = get_setpoints_version()
+    writers = _write_lock_holders()
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while writers:
+        if deadline is not None and time.monotonic() >= deadline:
+            return None
+        time.sleep(SETTLE_POLL_SECONDS)
+        writers &= _write_lock_holders()
+    return version
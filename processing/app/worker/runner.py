@@ -0,0 +1,163 @@
+import os
+import time
+import signal
+import socket
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from app.manage_app.config import Config
+from app.manage_app.logging import processes_logger
+from app.model.models import db
+from app.model.notify import NotifyListener
+from app.model.jobs import (JOBS_CHANNEL, claim_jobs, heartbeat_jobs, complete_job, cancel_running_job, fail_job,
+                            requeue_stale_jobs)
+from app.model.calculations import CALCULATIONS, JobContext, JobCancelled, is_retryable
+
+
+def cpu_count():
+    # в контейнере sched_getaffinity учитывает cpuset, os.cpu_count() - нет
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def init_job_process(database):
+    """Pool process initializer: own database connections; Ctrl+C is left to the dispatcher"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    db.init(database=database['name'], user=database['user'], password=database['password'],
+            host=database['host'], port=database['port'])
+
+
+def execute_job(job):
+    """Run one job in a pool process, returns (outcome, result or (error, retryable))"""
+    calculation = CALCULATIONS.get(job['kind'])
+    if calculation is None:
+        return 'failed', (f"unknown calculation {job['kind']}", False)
+    try:
+        with db.connection_context():
+            return 'succeeded', calculation.run(JobContext(job))
+    except JobCancelled:
+        return 'cancelled', None
+    except Exception as e:
+        return 'failed', (f'{type(e).__name__}: {e}', is_retryable(e))
+
+
+class JobRunner:
+    """Claims jobs from the queue and runs them in a pool of processes, one job per process.
+
+    Only as many jobs are claimed as there are idle processes, the rest stay
+    queued for other workers. The dispatcher alone writes the outcome of a
+    job; pool processes write progress. Running jobs get a heartbeat every
+    JOB_HEARTBEAT_SECONDS, and every worker returns jobs of workers that
+    stopped sending them to the queue. Calculations are CPU bound, so they
+    run in processes started with spawn: no locks or connections are
+    inherited from the dispatcher's threads.
+    """
+
+    def __init__(self, database, processes=None, worker_id=None):
+        self.database = database
+        self.processes = processes or Config.JOB_PROCESSES or cpu_count()
+        self.worker_id = worker_id or f'{socket.gethostname()}:{os.getpid()}'
+        self.running = {}
+        self._pool = None
+        self._pool_broken = False
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+
+    def stop(self, *_):
+        """Stop claiming jobs and exit once the running ones are done"""
+        self._stopping.set()
+        self._wakeup.set()
+
+    def _new_pool(self):
+        return ProcessPoolExecutor(max_workers=self.processes,
+                                   mp_context=multiprocessing.get_context('spawn'),
+                                   initializer=init_job_process,
+                                   initargs=(self.database,))
+
+    def _record(self, job, outcome, payload):
+        if outcome == 'succeeded':
+            if complete_job(job['id'], job['attempt'], payload):
+                processes_logger.info(f"Job {job['id']} ({job['kind']}) succeeded")
+        elif outcome == 'cancelled':
+            if cancel_running_job(job['id'], job['attempt']):
+                processes_logger.info(f"Job {job['id']} ({job['kind']}) was cancelled")
+        else:
+            error, retryable = payload
+            status = fail_job(job['id'], job['attempt'], error, retry=retryable)
+            if status is not None:
+                processes_logger.error(f"Job {job['id']} ({job['kind']}) attempt {job['attempt']} failed, "
+                                       f"{status}: {error}")
+
+    def _collect(self):
+        for future in [future for future in self.running if future.done()]:
+            job = self.running[future]
+            try:
+                outcome, payload = future.result()
+            except BrokenProcessPool:
+                # a pool process was killed (e.g. out of memory), every job of the pool is lost
+                self._pool_broken = True
+                outcome, payload = 'failed', ('calculation process terminated abruptly', True)
+            except Exception as e:
+                outcome, payload = 'failed', (f'{type(e).__name__}: {e}', False)
+            # kept on a database error, the outcome is written on the next round
+            self._record(job, outcome, payload)
+            del self.running[future]
+
+        if self._pool_broken and not self.running:
+            self._pool.shutdown(wait=False)
+            self._pool = self._new_pool()
+            self._pool_broken = False
+
+    def _claim(self):
+        if self._stopping.is_set() or self._pool_broken:
+            return
+        for job in claim_jobs(self.worker_id, self.processes - len(self.running)):
+            future = self._pool.submit(execute_job, job)
+            future.add_done_callback(lambda _: self._wakeup.set())
+            self.running[future] = job
+            processes_logger.info(f"Job {job['id']} ({job['kind']}) attempt {job['attempt']} started")
+
+    def _keep_leases(self):
+        heartbeat_jobs(self.worker_id, [job['id'] for job in self.running.values()])
+        for job_id, status in requeue_stale_jobs(Config.JOB_LEASE_SECONDS):
+            processes_logger.error(f"Job {job_id} lost its worker, {status}")
+
+    def run(self):
+        """Dispatch until SIGTERM or SIGINT, then wait for the running jobs"""
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        listen_params = {
+            'dbname': self.database['name'],
+            'user': self.database['user'],
+            'password': self.database['password'],
+            'host': self.database['host'],
+            'port': self.database['port'],
+        }
+        listener = NotifyListener(JOBS_CHANNEL, lambda _: self._wakeup.set(), listen_params)
+        listener.start()
+        self._pool = self._new_pool()
+        processes_logger.info(f"Job worker {self.worker_id} started with {self.processes} processes")
+
+        next_lease_check = 0.0
+        try:
+            while not self._stopping.is_set() or self.running:
+                self._wakeup.clear()
+                try:
+                    with db.connection_context():
+                        self._collect()
+                        if time.monotonic() >= next_lease_check:
+                            self._keep_leases()
+                            next_lease_check = time.monotonic() + Config.JOB_HEARTBEAT_SECONDS
+                        self._claim()
+                    timeout = min(Config.JOB_POLL_SECONDS, max(0.0, next_lease_check - time.monotonic()))
+                except Exception as e:
+                    # e.g. the database is restarting: the jobs keep running, try again after a poll interval
+                    processes_logger.error(f"Job worker {self.worker_id}: {e}")
+                    timeout = Config.JOB_POLL_SECONDS
+                self._wakeup.wait(timeout)
+        finally:
+            listener.stop()
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            processes_logger.info(f"Job worker {self.worker_id} stopped")
@@ -0,0 +1,134 @@
+"""Latency and throughput of the WSGI (gunicorn) and ASGI (uvicorn) serving modes.
+
+    python -m benchmarks.seed --dataset small
+    python -m benchmarks.bench_asgi --workers 4 --concurrency 1 16 64 --duration 10
+
+Both servers run on the test database with the same number of worker
+processes (sync gunicorn workers vs uvicorn workers under gunicorn) and are
+driven by the same asyncio HTTP/1.1 client: `concurrency` connections, each sending its next request as soon as the previous answer is
+read (keep-alive where the server allows it, gunicorn's sync workers close the
+connection after every response).
+"""
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+from benchmarks.common import create_test_app, print_header, print_row
+from benchmarks.load import FEATURES, start_server, start_gunicorn
+from app.model.models import db, Feature
+
+# (name, method, path(rng, ids), body(rng, n))
+SCENARIOS = [
+    ('GET features page', 'GET', lambda rng, ids: f'{FEATURES}?limit=50', None),
+    ('GET feature by id', 'GET', lambda rng, ids: f'{FEATURES}/{rng.choice(ids)}', None),
+    ('PUT feature settings', 'PUT', lambda rng, ids: f'{FEATURES}/{rng.choice(ids)}/settings',
+     lambda rng, n: {'name': f'asgi {n}', 'type': 'ecg', 'active': True}),
+]
+
+
+def start_uvicorn(workers, port):
+    # uvicorn --workers leaves TCP_NODELAY off on accepted sockets (+40 ms per keep-alive
+    # response from delayed ACKs), gunicorn sets it on the listening socket
+    return start_server([sys.executable, '-m', 'gunicorn', '-w', str(workers), '-k', 'uvicorn.workers.UvicornWorker',
+                         '-b', f'127.0.0.1:{port}', 'processing_asgi:app'], port, 'uvicorn')
+
+
+class Connection:
+    """Minimal HTTP/1.1 client connection, reconnects when the server closes it"""
+
+    def __init__(self, port):
+        self.port = port
+        self.reader = self.writer = None
+
+    async def request(self, method, path, body=None):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection('127.0.0.1', self.port)
+        payload = json.dumps(body).encode() if body is not None else b''
+        self.writer.write(f'{method} {path} HTTP/1.1\r\nHost: 127.0.0.1\r\n'
+                          f'Content-Type: application/json\r\nContent-Length: {len(payload)}\r\n\r\n'.encode()
+                          + payload)
+        status_line = await self.reader.readline()
+        status = int(status_line.split()[1])
+        length, close = 0, False
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            name = name.strip().lower()
+            if name == 'content-length':
+                length = int(value)
+            elif name == 'connection' and value.strip().lower() == 'close':
+                close = True
+        await self.reader.readexactly(length)
+        if close:
+            await self.close()
+        return status
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            await self.writer.wait_closed()
+            self.reader = self.writer = None
+
+
+async def _client(port, scenario, ids, deadline, samples, errors, seed):
+    name, method, path, body = scenario
+    rng = random.Random(seed)
+    connection = Connection(port)
+    n = 0
+    try:
+        while time.monotonic() < deadline:
+            n += 1
+            started = time.perf_counter()
+            status = await connection.request(method, path(rng, ids), body(rng, f'{seed}-{n}') if body else None)
+            samples.append(time.perf_counter() - started)
+            if status >= 400:
+                errors.append(status)
+    finally:
+        await connection.close()
+
+
+async def _drive(port, scenario, ids, concurrency, duration):
+    samples, errors = [], []
+    started = time.monotonic()
+    deadline = started + duration
+    await asyncio.gather(*(_client(port, scenario, ids, deadline, samples, errors, seed)
+                           for seed in range(concurrency)))
+    return samples, errors, time.monotonic() - started
+
+
+def run(workers, concurrency_levels, duration, port):
+    create_test_app()
+    with db.connection_context():
+        ids = [str(row[0]) for row in Feature.select(Feature.id).limit(1000).tuples()]
+    if not ids:
+        raise SystemExit('No features in the test database, run python -m benchmarks.seed first')
+
+    for server, start in (('gunicorn', start_gunicorn), ('uvicorn', start_uvicorn)):
+        process = start(workers, port)
+        try:
+            print(f'server={server} workers={workers} duration={duration:.0f}s per row')
+            print_header()
+            for scenario in SCENARIOS:
+                for concurrency in concurrency_levels:
+                    samples, errors, elapsed = asyncio.run(_drive(port, scenario, ids, concurrency, duration))
+                    print_row(f'{scenario[0]} c={concurrency}', samples, elapsed=elapsed)
+                    if errors:
+                        print(f'  errors: {len(errors)} (status {sorted(set(errors))})')
+            print()
+        finally:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 16, 64])
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+    run(args.workers, args.concurrency, args.duration, args.port)
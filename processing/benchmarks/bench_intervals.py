@@ -0,0 +1,123 @@
+"""Time-window threshold lookups at 100k thresholds: interval index vs scans, GiST index vs none.
+
+    python -m benchmarks.seed --dataset large
+    python -m benchmarks.bench_intervals [--iterations 1000]
+
+In memory: IntervalIndex.at / overlapping against a NumPy mask over every
+window (the cost of a lookup before the index), for the seeded windows held
+by one feature and split over 100 features as in the seeded set.
+Database: get_thresholds() with a moment or a range, with the GiST index on
+threshold_window() and with the index dropped inside a rolled back
+transaction.
+"""
+import time
+import random
+import argparse
+import numpy as np
+from benchmarks.common import create_test_app, measure, print_header, print_row
+from benchmarks.seed import DATASETS, DAY_MS, THRESHOLD_FEATURES, THRESHOLD_SET_ID, threshold_window
+from app.model.models import db, Threshold
+from app.model.migrations import THRESHOLD_WINDOW_INDEX
+from app.model.setpoints.intervals import IntervalIndex
+from app.model.setpoints.threshold import get_thresholds
+
+# length of the range queries
+RANGE_MS = 60000
+
+
+def _windows(indexes):
+    bounds = [threshold_window(i) for i in indexes]
+    start = np.array([-np.inf if s is None else s for s, _ in bounds], dtype=np.float64)
+    end = np.array([np.inf if e is None else e for _, e in bounds], dtype=np.float64)
+    return start, end
+
+
+def run_memory(count, iterations):
+    rng = random.Random(42)
+    groups = {
+        'one feature': [list(range(1, count + 1))],
+        f'{THRESHOLD_FEATURES} features': [list(range(feature, count + 1, THRESHOLD_FEATURES))
+                                           for feature in range(THRESHOLD_FEATURES)],
+    }
+    print(f'in memory, {count} windows')
+    print_header()
+    for name, features in groups.items():
+        arrays = [_windows(indexes) for indexes in features]
+        started = time.perf_counter()
+        indexes = [IntervalIndex(start, end) for start, end in arrays]
+        print(f'  build {name}: {(time.perf_counter() - started) * 1000:.0f} ms')
+
+        def pick():
+            feature = rng.randrange(len(arrays))
+            t = rng.randrange(DAY_MS)
+            return feature, t
+
+        def index_at():
+            feature, t = pick()
+            return indexes[feature].at(t)
+
+        def mask_at():
+            feature, t = pick()
+            start, end = arrays[feature]
+            return np.nonzero((start <= t) & (t < end))[0]
+
+        def index_overlapping():
+            feature, t = pick()
+            return indexes[feature].overlapping(t, t + RANGE_MS)
+
+        def mask_overlapping():
+            feature, t = pick()
+            start, end = arrays[feature]
+            return np.nonzero((start < t + RANGE_MS) & (end > t) & (start < end))[0]
+
+        for label, func in (('at: interval index', index_at), ('at: numpy mask', mask_at),
+                            ('overlap: interval index', index_overlapping),
+                            ('overlap: numpy mask', mask_overlapping)):
+            samples, _ = measure(func, iterations, warmup=10)
+            print_row(f'{name} {label}', samples)
+    print()
+
+
+def run_database(iterations):
+    rng = random.Random(42)
+    with db.connection_context():
+        features = [row[0] for row in (Threshold
+                                       .select(Threshold.feature_id)
+                                       .where(Threshold.threshold_set_id == THRESHOLD_SET_ID)
+                                       .distinct()
+                                       .tuples())]
+        if not features:
+            raise SystemExit('No benchmark thresholds in the test database, run python -m benchmarks.seed first')
+
+        def in_range():
+            t = rng.randrange(DAY_MS)
+            return get_thresholds(THRESHOLD_SET_ID, from_ms=t, to_ms=t + RANGE_MS)
+
+        scenarios = [
+            ('set, t_ms', lambda: get_thresholds(THRESHOLD_SET_ID, t_ms=rng.randrange(DAY_MS))),
+            ('set, feature, t_ms', lambda: get_thresholds(THRESHOLD_SET_ID, feature_id=rng.choice(features),
+                                                          t_ms=rng.randrange(DAY_MS))),
+            ('set, 1 min range', in_range),
+        ]
+        print('database')
+        print_header()
+        for name, func in scenarios:
+            samples, queries = measure(func, iterations, warmup=10)
+            print_row(f'GiST: {name}', samples, queries)
+        with db.atomic() as transaction:
+            db.execute_sql(f'DROP INDEX "{THRESHOLD_WINDOW_INDEX}"')
+            for name, func in scenarios:
+                samples, queries = measure(func, max(1, iterations // 10), warmup=2)
+                print_row(f'no index: {name}', samples, queries)
+            transaction.rollback()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=1000)
+    parser.add_argument('--count', type=int, default=DATASETS['large']['thresholds'],
+                        help='windows of the in-memory part')
+    args = parser.parse_args()
+    run_memory(args.count, args.iterations)
+    create_test_app()
+    run_database(args.iterations)
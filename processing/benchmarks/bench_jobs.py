@@ -0,0 +1,93 @@
+"""Job queue: cost of a claim on a deep queue and claim throughput of concurrent workers.
+
+    python -m benchmarks.bench_jobs [--backlog 20000] [--iterations 500] [--threads 8]
+
+Queues backlog jobs next to as many finished ones, then claims them one by one,
+eight at a time and from several threads at once, the way worker dispatchers
+poll the queue (FOR UPDATE SKIP LOCKED). Concurrent claimers must never get
+the same job. The benchmark jobs are deleted at the end.
+"""
+import argparse
+import threading
+import time
+from peewee import fn
+from benchmarks.common import create_test_app, measure, print_header, print_row
+from app.model.models import db, Job
+from app.model.jobs import SUCCEEDED, claim_jobs, complete_job
+
+KIND = 'bench'
+
+
+def fill(count, status):
+    rows = [{'kind': KIND, 'params': {}, 'status': status, 'max_attempts': 1,
+             'run_after': fn.NOW(), 'created_at': fn.NOW()} for _ in range(count)]
+    with db.atomic():
+        for start in range(0, count, 1000):
+            Job.insert_many([dict(row, id=fn.gen_random_uuid()) for row in rows[start:start + 1000]]).execute()
+
+
+def claim_concurrently(threads):
+    """Drain the queue from threads claimers, returns (latencies, wall time, claimed ids)"""
+    latencies, claimed = [], []
+    lock = threading.Lock()
+
+    def worker(index):
+        own_latencies, own_claimed = [], []
+        with db.connection_context():
+            while True:
+                started = time.perf_counter()
+                jobs = claim_jobs(f'bench:{index}', 8)
+                own_latencies.append(time.perf_counter() - started)
+                if not jobs:
+                    break
+                own_claimed.extend(job['id'] for job in jobs)
+        with lock:
+            latencies.extend(own_latencies)
+            claimed.extend(own_claimed)
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=worker, args=(index,)) for index in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return latencies, time.perf_counter() - started, claimed
+
+
+def run(backlog, iterations, threads):
+    with db.connection_context():
+        Job.delete().where(Job.kind == KIND).execute()
+        fill(backlog, SUCCEEDED)
+        fill(backlog, 'queued')
+        db.execute_sql(f'ANALYZE "{Job._meta.table_name}"')
+
+        print_header()
+        latencies, queries = measure(lambda: claim_jobs('bench', 1), iterations, warmup=10)
+        print_row(f'claim 1 of {backlog} queued', latencies, queries)
+        latencies, queries = measure(lambda: claim_jobs('bench', 8), iterations, warmup=10)
+        print_row(f'claim 8 of {backlog} queued', latencies, queries)
+
+        running = iter(claim_jobs('bench', iterations + 10))
+
+        def complete():
+            job = next(running)
+            complete_job(job['id'], job['attempt'], {'file_name': None})
+        latencies, queries = measure(complete, iterations, warmup=10)
+        print_row('complete', latencies, queries)
+
+    latencies, elapsed, claimed = claim_concurrently(threads)
+    print_row(f'claim 8, {threads} threads, drain', latencies, elapsed=elapsed)
+    print(f'{len(claimed)} jobs claimed concurrently, {len(claimed) - len(set(claimed))} claimed twice')
+
+    with db.connection_context():
+        Job.delete().where(Job.kind == KIND).execute()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--backlog', type=int, default=20000)
+    parser.add_argument('--iterations', type=int, default=500)
+    parser.add_argument('--threads', type=int, default=8)
+    args = parser.parse_args()
+    create_test_app()
+    run(args.backlog, args.iterations, args.threads)
@@ -0,0 +1,75 @@
+"""Micro-benchmarks of the model layer against the seeded test database.
+
+    python -m benchmarks.seed --dataset small
+    python -m benchmarks.bench_model [--iterations 500]
+
+Reports p50/p95/p99 latency, calls per second and SQL statements per call.
+Writes go to the seeded tables, re-seed before comparing runs.
+"""
+import argparse
+import random
+import uuid
+from benchmarks.common import create_test_app, measure, print_header, print_row
+from app.model.models import db, Feature
+from app.model.changelog import log_changes, get_changelog_page
+from app.model.setpoints.feature import (add_feature, modify_feature, get_feature_list, get_feature_page,
+                                         get_feature_by_id, invalidate_feature_cache)
+
+
+def _sample_ids(count):
+    ids = [row[0] for row in Feature.select(Feature.id).order_by(Feature.id).limit(count).tuples()]
+    if not ids:
+        raise SystemExit('No features in the test database, run python -m benchmarks.seed first')
+    return ids
+
+
+def run(iterations):
+    rng = random.Random(42)
+    ids = _sample_ids(max(iterations, 100))
+    counter = iter(range(10 ** 9))
+
+    def next_id():
+        return ids[rng.randrange(len(ids))]
+
+    def add():
+        add_feature(name=f'bench {next(counter)}', type='ecg', priority='low', default_threshold=1.0)
+
+    def modify():
+        modify_feature(next_id(), name=f'bench {next(counter)}', type='spo2', default_threshold=2.0)
+
+    def log():
+        old = Feature(id=uuid.uuid4(), name='a', type='ecg', active=True)
+        new = Feature(id=old.id, name=f'b {next(counter)}', type='bp', active=False)
+        log_changes(old, new, changed_by='bench')
+
+    scenarios = [
+        ('add_feature', add, None),
+        ('modify_feature', modify, None),
+        ('log_changes (3 fields)', log, None),
+        ('get_feature_list(100) cold', lambda: get_feature_list(100), invalidate_feature_cache),
+        ('get_feature_list(100) cached', lambda: get_feature_list(100), None),
+        ('get_feature_list(all) cold', lambda: get_feature_list(), invalidate_feature_cache),
+        ('get_feature_page(100) cold', lambda: get_feature_page(limit=100), invalidate_feature_cache),
+        ('get_feature_page(100, total) cold', lambda: get_feature_page(limit=100, with_total=True),
+         invalidate_feature_cache),
+        ('get_feature_page(type) cold', lambda: get_feature_page(limit=100, type='ecg'), invalidate_feature_cache),
+        ('get_feature_by_id cold', lambda: get_feature_by_id(next_id()), invalidate_feature_cache),
+        ('get_changelog_page(100)', lambda: get_changelog_page(limit=100), None),
+        ('get_changelog_page(entity)', lambda: get_changelog_page(limit=100, entity_id=next_id()), None),
+    ]
+
+    print_header()
+    for name, func, before in scenarios:
+        # listing every row is far slower than the rest, keep its run short
+        count = max(5, iterations // 50) if name.endswith('(all) cold') else iterations
+        samples, queries = measure(func, count, warmup=min(10, count), before=before)
+        print_row(name, samples, queries)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=500)
+    args = parser.parse_args()
+    create_test_app()
+    with db.connection_context():
+        run(args.iterations)
@@ -0,0 +1,70 @@
+"""Response serialization: marshmallow schema dump vs the compiled fast path.
+
+Both paths encode with the Flask JSON provider, so their bodies must be equal;
+orjson is timed for reference only when installed (it does not escape non-ASCII
+and formats some floats differently, so its output is not byte-identical).
+
+    python -m benchmarks.bench_serialization [--repeat 5]
+"""
+import sys
+import uuid
+import argparse
+import timeit
+from flask import Flask
+
+sys.path.insert(0, '.')
+from app.api.serialization import compile_schema  # noqa: E402
+from app.api.setpoints.feature.schemas import FeatureResponseSchema, FeaturePageResponseSchema  # noqa: E402
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+SIZES = (10, 1000, 10000)
+
+
+def make_features(count):
+    return [{'id': uuid.uuid4(),
+             'name': f'feature {i}',
+             'description': 'Описание признака' if i % 3 else None,
+             'type': ('ecg', 'spo2', 'bp')[i % 3],
+             'priority': None if i % 5 else 'high',
+             'default_threshold': i * 0.25 if i % 2 else None,
+             'active': bool(i % 7)} for i in range(count)]
+
+
+def run(repeat):
+    app = Flask(__name__)
+    list_schema = FeatureResponseSchema(many=True)
+    page_schema = FeaturePageResponseSchema()
+    print(f"{'endpoint':<8} {'rows':>6} {'marshmallow ms':>15} {'fast ms':>9} {'speedup':>8} {'orjson ms':>10}")
+    with app.app_context():
+        for name, schema, wrap in (('list', list_schema, lambda rows: rows),
+                                   ('page', page_schema, lambda rows: {'items': rows, 'next_cursor': None,
+                                                                       'total': len(rows)})):
+            fast_dump = compile_schema(schema)
+            for size in SIZES:
+                data = wrap(make_features(size))
+                slow_body = app.json.response(schema.dump(data)).get_data()
+                fast_body = app.json.response(fast_dump(data)).get_data()
+                assert slow_body == fast_body, f'{name}/{size}: fast path output differs'
+
+                number = max(1, 2000 // size)
+                slow = min(timeit.repeat(lambda: app.json.response(schema.dump(data)).get_data(),
+                                         number=number, repeat=repeat)) / number
+                fast = min(timeit.repeat(lambda: app.json.response(fast_dump(data)).get_data(),
+                                         number=number, repeat=repeat)) / number
+                if orjson is not None:
+                    raw = min(timeit.repeat(lambda: orjson.dumps(fast_dump(data), option=orjson.OPT_SORT_KEYS),
+                                            number=number, repeat=repeat)) / number
+                    raw = f'{raw * 1000:10.3f}'
+                else:
+                    raw = f"{'-':>10}"
+                print(f'{name:<8} {size:>6} {slow * 1000:15.3f} {fast * 1000:9.3f} {slow / fast:7.1f}x {raw}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    run(parser.parse_args().repeat)
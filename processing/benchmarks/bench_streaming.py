@@ -0,0 +1,86 @@
+"""Streaming threshold evaluation: cost per sample and per micro-batch, checkpoint cost.
+
+    python -m benchmarks.seed --dataset large
+    python -m benchmarks.bench_streaming [--iterations 500]
+
+Runs against the seeded threshold set (1000 windowed thresholds per feature,
+so every sample goes through the interval index) and against a feature with
+a few thresholds, which are checked in full on every sample. The stateless
+batch evaluator on the same micro-batch is the reference.
+"""
+import random
+import argparse
+from benchmarks.common import create_test_app, measure, print_header, print_row
+from benchmarks.seed import THRESHOLD_SET_ID
+from app.model.models import db, StreamCheckpoint
+from app.model.setpoints.compiled import get_compiled_threshold_set, build_feature_thresholds
+from app.model.setpoints.evaluation import evaluate_batch
+from app.model.setpoints.streaming import RunStream, FeatureStream, feed_feature
+
+# samples 10 ms apart, so runs stay inside the seeded day of windows
+STEP_MS = 10
+
+
+class Feed:
+    """Consecutive micro-batches of random samples for a list of features"""
+
+    def __init__(self, feature_ids, samples):
+        self.feature_ids = feature_ids
+        self.samples = samples
+        self.t = 0
+        self.rng = random.Random(42)
+
+    def next(self):
+        t_ms = [float(self.t + i * STEP_MS) for i in range(self.samples)]
+        self.t += self.samples * STEP_MS
+        return [{'feature_id': feature_id, 't_ms': t_ms,
+                 'values': [self.rng.uniform(-10, 110) for _ in range(self.samples)]}
+                for feature_id in self.feature_ids]
+
+
+def run(iterations):
+    with db.connection_context():
+        compiled = get_compiled_threshold_set(THRESHOLD_SET_ID)
+        features = sorted(compiled.features)
+        if not features:
+            raise SystemExit('No benchmark thresholds in the test database, run python -m benchmarks.seed first')
+        per_feature = len(compiled.features[features[0]])
+
+        print_header()
+        for samples, feature_count in ((1, 1), (100, 1), (100, 10)):
+            name = f'{samples} samples x {feature_count} features, {per_feature} thresholds'
+            stream = RunStream(THRESHOLD_SET_ID, 'bench')
+            feed = Feed(features[:feature_count], samples)
+            latencies, queries = measure(lambda: stream.apply(feed.next()), iterations, warmup=10)
+            print_row(f'stream: {name}', latencies, queries)
+            feed = Feed(features[:feature_count], samples)
+            latencies, queries = measure(lambda: evaluate_batch(THRESHOLD_SET_ID, feed.next()),
+                                         iterations, warmup=10)
+            print_row(f'batch: {name}', latencies, queries)
+
+        small = build_feature_thresholds([
+            {'id': str(i), 'feature_id': 'f', 'value': 20.0 * i, 'deadband': 2.0, 'step_indicator': None,
+             'time_point_start_ms': None, 'time_point_end_ms': None}
+            for i in range(5)])
+        state = FeatureStream()
+        feed = Feed(['f'], 1)
+
+        def one_sample():
+            item = feed.next()[0]
+            feed_feature(state, small, 0, 'f', None, item['t_ms'], item['values'], [])
+        latencies, _ = measure(one_sample, iterations * 10, warmup=10)
+        print_row('stream: 1 sample, 5 thresholds', latencies)
+
+        stream = RunStream(THRESHOLD_SET_ID, 'bench-checkpoint')
+        stream.apply(Feed(features, 10).next())
+        latencies, queries = measure(stream.checkpoint, iterations, warmup=5)
+        print_row(f'checkpoint: {len(features)} features', latencies, queries)
+        StreamCheckpoint.delete().where(StreamCheckpoint.run_id == 'bench-checkpoint').execute()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=500)
+    args = parser.parse_args()
+    create_test_app()
+    run(args.iterations)
@@ -0,0 +1,81 @@
+"""Shared helpers of the benchmark suite: test app, query counting and latency reports.
+
+Every benchmark runs against the test database (TESTING_DB_* settings), never
+against DB_*; `docker compose --profile bench up -d processing-test-db` starts
+a disposable Postgres for it.
+"""
+import sys
+import time
+from contextlib import contextmanager
+
+sys.path.insert(0, '.')
+from app.manage_app.config import Config  # noqa: E402
+from app.model.models import db  # noqa: E402
+
+
+def create_test_app():
+    """create_app(tests=True) on a migrated test database"""
+    missing = [key for key, value in Config.DATABASE_TEST.items() if key != 'password' and not value]
+    if missing:
+        raise SystemExit(f'TESTING_DB_* is not configured (missing: {", ".join(missing)})')
+    from app.manage_app.default_units import ensure_database_exists
+    from app.model.migrations import apply_migrations
+    from app.manage_app.manage_app import create_app
+
+    database = Config.DATABASE_TEST
+    ensure_database_exists(database)
+    db.init(database=database['name'], user=database['user'], password=database['password'],
+            host=database['host'], port=database['port'])
+    with db.connection_context():
+        apply_migrations()
+    return create_app(tests=True)
+
+
+@contextmanager
+def count_queries():
+    """with count_queries() as counted: ...; counted() is the number of statements so far"""
+    stats = db.track_queries()
+    try:
+        yield lambda: stats['count']
+    finally:
+        db.pop_query_stats()
+
+
+def percentile(sorted_samples, p):
+    if not sorted_samples:
+        return 0.0
+    index = min(len(sorted_samples) - 1, max(0, round(p / 100 * len(sorted_samples)) - 1))
+    return sorted_samples[index]
+
+
+def measure(func, iterations, warmup=0, before=None):
+    """Run func iterations times, returns (latencies in seconds, statements per call)"""
+    for _ in range(warmup):
+        if before:
+            before()
+        func()
+    samples = []
+    with count_queries() as counted:
+        for _ in range(iterations):
+            if before:
+                before()
+            started = time.perf_counter()
+            func()
+            samples.append(time.perf_counter() - started)
+        queries = counted()
+    return samples, queries / iterations if iterations else 0.0
+
+
+def print_header():
+    print(f"{'scenario':<34} {'n':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'ops/s':>9} {'queries':>8}")
+
+
+def print_row(name, samples, queries=None, elapsed=None):
+    """elapsed: wall time for throughput of concurrent runs, the sum of samples otherwise"""
+    ordered = sorted(samples)
+    elapsed = elapsed if elapsed is not None else sum(samples)
+    throughput = len(samples) / elapsed if elapsed else 0.0
+    queries = f'{queries:8.1f}' if queries is not None else f"{'-':>8}"
+    print(f'{name:<34} {len(samples):>7} '
+          f'{percentile(ordered, 50) * 1000:9.2f} {percentile(ordered, 95) * 1000:9.2f} '
+          f'{percentile(ordered, 99) * 1000:9.2f} {throughput:9.1f} {queries}')
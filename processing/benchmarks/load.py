@@ -0,0 +1,174 @@
+"""HTTP load scenario against the processing API.
+
+    python -m benchmarks.seed --dataset small
+    python -m benchmarks.load --mode client --threads 8 --duration 10
+    python -m benchmarks.load --mode gunicorn --workers 4 --threads 16 --duration 10
+
+client drives the Flask app in-process through test clients (one per thread) and
+also counts SQL statements per request; gunicorn starts `gunicorn processing:app`
+on the test database and sends real HTTP requests over keep-alive connections.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+import subprocess
+import http.client
+from benchmarks.common import create_test_app, count_queries, print_header, print_row
+from app.manage_app.config import Config
+from app.model.models import db, Feature
+
+FEATURES = '/api/processing/setpoints/features'
+CHANGELOG = '/api/processing/changelog'
+
+# (name, weight, method, path(rng, ids), body(rng, n))
+SCENARIOS = [
+    ('GET features page', 30, 'GET', lambda rng, ids: f'{FEATURES}?limit=50', None),
+    ('GET features page filtered', 10, 'GET',
+     lambda rng, ids: f'{FEATURES}?limit=50&type={rng.choice(["ecg", "spo2", "bp"])}', None),
+    ('GET feature by id', 30, 'GET', lambda rng, ids: f'{FEATURES}/{rng.choice(ids)}', None),
+    ('PUT feature settings', 15, 'PUT', lambda rng, ids: f'{FEATURES}/{rng.choice(ids)}/settings',
+     lambda rng, n: {'name': f'load {n}', 'type': 'ecg', 'active': True}),
+    ('POST feature', 5, 'POST', lambda rng, ids: FEATURES,
+     lambda rng, n: {'name': f'load {n}', 'type': 'bp', 'active': True}),
+    ('GET changelog page', 10, 'GET', lambda rng, ids: f'{CHANGELOG}?limit=50', None),
+]
+
+
+class Results:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {name: [] for name, *_ in SCENARIOS}
+        self.queries = {name: 0 for name, *_ in SCENARIOS}
+        self.errors = {name: 0 for name, *_ in SCENARIOS}
+
+    def add(self, name, elapsed, ok, queries=0):
+        with self.lock:
+            self.samples[name].append(elapsed)
+            self.queries[name] += queries
+            if not ok:
+                self.errors[name] += 1
+
+
+def _client_sender(app):
+    client = app.test_client()
+
+    def send(method, path, body):
+        with count_queries() as counted:
+            response = client.open(path, method=method, json=body)
+            response.get_data()
+            return response.status_code, counted()
+    return send
+
+
+def _http_sender(port):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+
+    def send(method, path, body):
+        payload = json.dumps(body) if body is not None else None
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        connection.request(method, path, body=payload, headers=headers)
+        response = connection.getresponse()
+        response.read()
+        return response.status, 0
+    return send
+
+
+def _worker(make_sender, ids, deadline, results, seed):
+    rng = random.Random(seed)
+    send = make_sender()
+    weights = [scenario[1] for scenario in SCENARIOS]
+    n = 0
+    while time.monotonic() < deadline:
+        name, _, method, path, body = rng.choices(SCENARIOS, weights)[0]
+        n += 1
+        started = time.perf_counter()
+        status, queries = send(method, path(rng, ids), body(rng, f'{seed}-{n}') if body else None)
+        results.add(name, time.perf_counter() - started, status < 400, queries)
+
+
+def start_server(argv, port, name):
+    """Start argv serving the test database on port, wait until it answers"""
+    env = dict(os.environ)
+    # the served app must use the test database as its main one
+    for key, value in Config.DATABASE_TEST.items():
+        env[f'DB_{key.upper()}'] = value or ''
+    process = subprocess.Popen(argv, env=env)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f'{name} exited with code {process.returncode}')
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            connection.request('GET', f'{FEATURES}/amount?amount=1')
+            connection.getresponse().read()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise SystemExit(f'{name} did not start in 30 seconds')
+
+
+def start_gunicorn(workers, port):
+    return start_server([sys.executable, '-m', 'gunicorn', '-w', str(workers),
+                         '-b', f'127.0.0.1:{port}', 'processing:app'], port, 'gunicorn')
+
+
+def run(mode, threads, duration, workers, port):
+    app = create_test_app()
+    with db.connection_context():
+        ids = [str(row[0]) for row in Feature.select(Feature.id).limit(1000).tuples()]
+    if not ids:
+        raise SystemExit('No features in the test database, run python -m benchmarks.seed first')
+
+    process = None
+    if mode == 'client':
+        make_sender = lambda: _client_sender(app)  # noqa: E731
+    else:
+        process = start_gunicorn(workers, port)
+        make_sender = lambda: _http_sender(port)  # noqa: E731
+
+    results = Results()
+    started = time.monotonic()
+    deadline = started + duration
+    pool = [threading.Thread(target=_worker, args=(make_sender, ids, deadline, results, seed))
+            for seed in range(threads)]
+    try:
+        for thread in pool:
+            thread.start()
+        for thread in pool:
+            thread.join()
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+    elapsed = time.monotonic() - started
+
+    print(f'mode={mode} threads={threads} duration={elapsed:.1f}s' + (f' workers={workers}' if process else ''))
+    print_header()
+    total = []
+    for name, *_ in SCENARIOS:
+        samples = results.samples[name]
+        if not samples:
+            continue
+        total.extend(samples)
+        queries = results.queries[name] / len(samples) if mode == 'client' else None
+        print_row(name, samples, queries, elapsed=elapsed)
+    print_row('total', total, elapsed=elapsed)
+    errors = sum(results.errors.values())
+    if errors:
+        print(f'errors: {errors} ' + ', '.join(f'{name}={count}' for name, count in results.errors.items() if count))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mode', choices=('client', 'gunicorn'), default='client')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+    run(args.mode, args.threads, args.duration, args.workers, args.port)
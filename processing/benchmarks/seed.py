@@ -0,0 +1,112 @@
+"""Seed the test database with a reproducible benchmark dataset.
+
+    python -m benchmarks.seed --dataset small     # 1k features, 10k change-log rows, 10k thresholds
+    python -m benchmarks.seed --dataset large     # 100k features, 1M change-log rows, 100k thresholds
+
+Rows are generated inside Postgres (generate_series + setseed), so seeding 1M
+change-log rows takes seconds and the same dataset comes out on every run.
+"""
+import argparse
+from datetime import datetime, timezone
+from benchmarks.common import create_test_app
+from app.manage_app.config import Config
+from app.model.models import db, Feature, ThresholdSet, Threshold, ChangeLog, EntitySnapshot
+from app.model.partitions import create_changelog_partitions, _add_months, _month_start
+
+DATASETS = {
+    'small': {'features': 1000, 'changelog': 10000, 'thresholds': 10000},
+    'large': {'features': 100000, 'changelog': 1000000, 'thresholds': 100000},
+}
+# change-log rows are spread over this many past months, one partition each
+HISTORY_MONTHS = 6
+SEED = 0.42
+# thresholds of the benchmark set belong to this many features, windows spread over one day
+THRESHOLD_FEATURES = 100
+THRESHOLD_SET_ID = '6d9a8a64-0f4b-4b59-8d0d-5d4b0c9b1a01'
+DAY_MS = 86400000
+
+
+def reset():
+    db.execute_sql(f'TRUNCATE "{ChangeLog._meta.table_name}", "{EntitySnapshot._meta.table_name}", '
+                   f'"{Feature._meta.table_name}", "{ThresholdSet._meta.table_name}" CASCADE')
+
+
+def seed_features(count):
+    db.execute_sql('SELECT setseed(%s)', (SEED,))
+    db.execute_sql(
+        'INSERT INTO feature (id, name, description, type, priority, default_threshold, active) '
+        "SELECT md5('feature' || i)::uuid, "
+        "       'feature ' || i, "
+        "       CASE WHEN i %% 3 = 0 THEN NULL ELSE 'benchmark feature ' || i END, "
+        "       (ARRAY['ecg', 'spo2', 'bp', 'hr', 'temp'])[1 + i %% 5], "
+        "       (ARRAY['low', 'medium', 'high'])[1 + i %% 3], "
+        '       CASE WHEN i %% 2 = 0 THEN NULL ELSE round((random() * 100)::numeric, 2)::float8 END, '
+        '       i %% 10 <> 0 '
+        'FROM generate_series(1, %s) AS i', (count,))
+
+
+def seed_changelog(count, now=None):
+    now = now or datetime.now(timezone.utc)
+    create_changelog_partitions(Config.CHANGELOG_PARTITION_MONTHS_AHEAD,
+                                start=_add_months(_month_start(now), -HISTORY_MONTHS),
+                                today=now)
+    db.execute_sql('SELECT setseed(%s)', (SEED,))
+    db.execute_sql(
+        'WITH ids AS (SELECT array_agg(id ORDER BY id) AS a FROM feature) '
+        'INSERT INTO changelog (id, entity_type, entity_id, field_name, old_value, new_value, '
+        '                       changed_at, changed_by, comment) '
+        "SELECT nextval('changelog_id_seq'), 'Feature', ids.a[(1 + (i::bigint * 7919) %% cardinality(ids.a))::int], "
+        "       (ARRAY['name', 'description', 'type', 'priority', 'default_threshold', 'active'])[1 + i %% 6], "
+        "       to_json('old ' || i), to_json('new ' || i), "
+        "       %s::timestamptz - make_interval(secs => (i::float8 / %s) * %s * 30 * 86400), "
+        "       (ARRAY['system', 'operator', 'doctor'])[1 + i %% 3], "
+        "       CASE WHEN i %% 4 = 0 THEN 'seeded' END "
+        'FROM generate_series(1, %s) AS i, ids',
+        (now, count, HISTORY_MONTHS, count))
+
+
+def threshold_window(i):
+    """Window of the i-th seeded threshold, the same formula as seed_thresholds()"""
+    start = None if i % 1000 == 0 else (i * 7919) % DAY_MS
+    end = None if i % 1000 == 500 else (i * 7919) % DAY_MS + 1000 + (i * 104729) % 600000
+    return start, end
+
+
+def seed_thresholds(count):
+    db.execute_sql(f'INSERT INTO "{ThresholdSet._meta.table_name}" (id, name, "group", active, version) '
+                   "VALUES (%s, 'benchmark set', 'bench', true, 1)", (THRESHOLD_SET_ID,))
+    db.execute_sql(
+        f'WITH ids AS (SELECT array_agg(id ORDER BY id) AS a '
+        f'             FROM (SELECT id FROM feature ORDER BY id LIMIT %s) AS f) '
+        f'INSERT INTO "{Threshold._meta.table_name}" (id, feature_id, threshold_set_id, "default", value, deadband, '
+        f'                       step_indicator, time_point_start_ms, time_point_end_ms, active) '
+        "SELECT md5('threshold' || i)::uuid, ids.a[1 + i %% cardinality(ids.a)], %s, false, "
+        '       (i %% 100)::float8, CASE WHEN i %% 4 = 0 THEN 1.0 END, '
+        "       CASE WHEN i %% 2 = 0 THEN 'down' END, "
+        '       CASE WHEN i %% 1000 = 0 THEN NULL ELSE (i::bigint * 7919) %% %s END, '
+        '       CASE WHEN i %% 1000 = 500 THEN NULL ELSE (i::bigint * 7919) %% %s + 1000 + (i::bigint * 104729) %% 600000 END, '
+        '       true '
+        'FROM generate_series(1, %s) AS i, ids',
+        (THRESHOLD_FEATURES, THRESHOLD_SET_ID, DAY_MS, DAY_MS, count))
+
+
+def seed(dataset):
+    sizes = DATASETS[dataset]
+    with db.connection_context():
+        with db.atomic():
+            reset()
+            seed_features(sizes['features'])
+            seed_changelog(sizes['changelog'])
+            seed_thresholds(sizes['thresholds'])
+        db.execute_sql('ANALYZE')
+    return sizes
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--dataset', choices=sorted(DATASETS), default='small')
+    args = parser.parse_args()
+    create_test_app()
+    sizes = seed(args.dataset)
+    print(f"Seeded {sizes['features']} features, {sizes['changelog']} change-log rows "
+          f"and {sizes['thresholds']} thresholds")
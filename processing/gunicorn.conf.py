@@ -0,0 +1,73 @@
+import gc
+import os
+import shutil
+import tempfile
+from app.manage_app.config import Config
+
+# Конфигурация gunicorn (подхватывается автоматически из рабочего каталога).
+# С preload_app приложение создается один раз в мастере: импорты, схемы
+# marshmallow и OpenAPI-спецификация делятся между воркерами copy-on-write,
+# а потоки, соединения с БД и логгеры создаются в каждом воркере после fork
+
+
+def _cpu_count():
+    # в контейнере sched_getaffinity учитывает cpuset, os.cpu_count() - нет
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+bind = Config.GUNICORN_BIND
+workers = Config.GUNICORN_WORKERS or _cpu_count() + 1
+threads = Config.GUNICORN_THREADS or min(4, Config.DB_MAX_CONNECTIONS)
+preload_app = Config.GUNICORN_PRELOAD
+# heartbeat-файлы воркеров в памяти, а не на overlay-диске контейнера
+if os.path.isdir('/dev/shm'):
+    worker_tmp_dir = '/dev/shm'
+
+Config.DEFER_WORKER_INIT = preload_app
+# гистограммы запросов всех воркеров сводятся через общий каталог
+if not Config.METRICS_DIR and workers > 1:
+    Config.METRICS_DIR = os.path.join(worker_tmp_dir if os.path.isdir('/dev/shm') else tempfile.gettempdir(),
+                                      f'processing-metrics-{os.getpid()}')
+
+
+def on_starting(server):
+    # файлы воркеров прошлого запуска не должны попасть в сумму
+    if Config.METRICS_DIR:
+        shutil.rmtree(Config.METRICS_DIR, ignore_errors=True)
+        os.makedirs(Config.METRICS_DIR, exist_ok=True)
+
+
+def when_ready(server):
+    if not preload_app:
+        return
+    from app.manage_app.logging import stop_logging
+
+    # в мастере не должно остаться потоков к моменту fork
+    stop_logging()
+    # объекты приложения не попадают в сборку мусора воркеров, их страницы не копируются
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    from app.model.models import db
+
+    db.reset_after_fork()
+
+
+def post_worker_init(worker):
+    from flask import Flask
+    from app.manage_app.manage_app import init_worker
+
+    # ASGI-воркеры (processing_asgi:app) инициализируются в lifespan
+    if preload_app and isinstance(worker.wsgi, Flask):
+        init_worker(worker.wsgi)
+
+
+def worker_exit(server, worker):
+    # последние запросы воркера остаются в сумме и после его выхода
+    if Config.METRICS_DIR:
+        from app.manage_app.metrics import flush_metrics
+
+        flush_metrics()
@@ -0,0 +1,29 @@
+from app.manage_app.config import Config
+from app.model.models import db, Feature
+from app.model.history import snapshot_entities
+from app.model.idempotency import purge_idempotency_keys
+from app.model.partitions import create_changelog_partitions, archive_changelog_partitions
+
+# Запускается по расписанию (cron): сохраняет снимки текущего состояния признаков,
+# создает будущие секции журнала изменений, выгружает и удаляет секции старше
+# CHANGELOG_RETENTION_MONTHS (перед удалением снимает состояние на границу архива,
+# история до границы больше не восстанавливается),
+# удаляет просроченные ключи идемпотентности
+
+db.init(
+    database=Config.DATABASE['name'],
+    user=Config.DATABASE['user'],
+    password=Config.DATABASE['password'],
+    host=Config.DATABASE['host'],
+    port=Config.DATABASE['port'],
+)
+
+snapshot_entities(Feature)
+create_changelog_partitions(Config.CHANGELOG_PARTITION_MONTHS_AHEAD)
+print(f"{purge_idempotency_keys()} expired idempotency key(s) deleted")
+
+if Config.CHANGELOG_RETENTION_MONTHS > 0:
+    for path in archive_changelog_partitions(Config.CHANGELOG_RETENTION_MONTHS, Config.CHANGELOG_ARCHIVE_DIR):
+        print(f"archived {path}")
+else:
+    print("CHANGELOG_RETENTION_MONTHS is not set, nothing to archive")
@@ -0,0 +1,5 @@
+from app.asgi.app import create_asgi_app
+
+# ASGI-режим: uvicorn processing_asgi:app (один процесс) или
+# gunicorn -k uvicorn.workers.UvicornWorker -w 4 processing_asgi:app
+app = create_asgi_app()
@@ -1,7 +1,7 @@
 import os
 from dotenv import load_dotenv
-from app.model.models import db, create_all_tables, drop_all_tables
-from app.manage_app.default_units import default_reference
+from app.model.models import db, drop_all_tables
+from app.model.migrations import apply_migrations
 
 load_dotenv()
 
@@ -29,6 +29,6 @@ db.init(
 )
 
 
+# пересоздает схему с нуля: все таблицы удаляются, затем применяются все миграции
 drop_all_tables()
-create_all_tables()
-default_reference()
+apply_migrations()
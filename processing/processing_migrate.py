@@ -0,0 +1,42 @@
+import sys
+import peewee
+from app.manage_app.config import Config
+from app.manage_app.default_units import ensure_database_exists
+from app.model.models import db
+from app.model.migrations import (apply_migrations, get_schema_version, sync_feature_name_index, SCHEMA_VERSION,
+                                  MIGRATION_LOCK_ID)
+from app.model.partitions import create_changelog_partitions
+
+# Создает БД и применяет миграции схемы; запускается один раз перед стартом
+# воркеров (деплой, docker-compose), а не в каждом воркере.
+# --check только сообщает версию схемы и завершается с кодом 1, если она устарела.
+# Секции журнала изменений на CHANGELOG_PARTITION_MONTHS_AHEAD месяцев вперед
+# создаются при каждом запуске, не только миграцией
+
+database = Config.DATABASE_TEST if '--tests' in sys.argv else Config.DATABASE
+
+ensure_database_exists(database)
+db.init(
+    database=database['name'],
+    user=database['user'],
+    password=database['password'],
+    host=database['host'],
+    port=database['port'],
+)
+
+with db.connection_context():
+    if '--check' in sys.argv:
+        version = get_schema_version()
+        print(f"schema version {version}, application needs {SCHEMA_VERSION}")
+        sys.exit(0 if version is not None and version >= SCHEMA_VERSION else 1)
+
+    applied = apply_migrations()
+    try:
+        # сервисы docker-compose запускают этот скрипт одновременно
+        with db.atomic():
+            db.execute_sql('SELECT pg_advisory_xact_lock(%s)', (MIGRATION_LOCK_ID,))
+            sync_feature_name_index(Config.FEATURE_UNIQUE_NAMES)
+            create_changelog_partitions(Config.CHANGELOG_PARTITION_MONTHS_AHEAD)
+    except peewee.IntegrityError as px:
+        sys.exit(f"FEATURE_UNIQUE_NAMES=1, but feature names are not unique: {px}")
+    print(f"Success. Schema version {get_schema_version()}, {len(applied)} migration(s) applied")
@@ -0,0 +1,25 @@
+from app.manage_app.config import Config
+from app.manage_app.logging import setup_logging
+from app.model.models import db
+from app.model.migrations import check_schema_version
+from app.worker.runner import JobRunner
+
+# Воркер очереди расчетов: python processing_worker.py (после processing_migrate.py).
+# Берет задачи из таблицы job и считает их в пуле процессов, по одному расчету на
+# процесс (JOB_PROCESSES, по умолчанию по числу ядер). Воркеров можно запускать
+# сколько угодно на разных машинах: задачи разбираются через SKIP LOCKED.
+# SIGTERM: новые задачи не берутся, начатые досчитываются; задачи воркера,
+# убитого раньше, вернутся в очередь через JOB_LEASE_SECONDS
+
+if __name__ == '__main__':
+    db.init(
+        database=Config.DATABASE['name'],
+        user=Config.DATABASE['user'],
+        password=Config.DATABASE['password'],
+        host=Config.DATABASE['host'],
+        port=Config.DATABASE['port'],
+    )
+    setup_logging({name: getattr(Config, name) for name in dir(Config) if name.isupper()})
+    with db.connection_context():
+        check_schema_version()
+    JobRunner(Config.DATABASE).run()
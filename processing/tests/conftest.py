@@ -0,0 +1,16 @@
+import pytest
+from app.manage_app.config import Config
+
+
+@pytest.fixture(scope='session')
+def app():
+    """The app on the test database (TESTING_DB_*), the tests are skipped without one"""
+    if not all(value for key, value in Config.DATABASE_TEST.items() if key != 'password'):
+        pytest.skip('TESTING_DB_* is not configured')
+    from benchmarks.common import create_test_app
+    return create_test_app()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
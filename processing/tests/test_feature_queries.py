@@ -0,0 +1,56 @@
+"""Statements a feature read and modify send to the database."""
+import uuid
+import select
+import psycopg2
+import pytest
+from benchmarks.common import count_queries
+from app.model.models import db
+from app.model.setpoints import feature
+from app.model.setpoints.feature import FEATURE_CACHE_CHANNEL, invalidate_feature_cache
+
+FEATURES = '/api/processing/setpoints/features'
+
+
+@pytest.fixture
+def feature_id(client):
+    response = client.post(FEATURES, json={'name': f'queries {uuid.uuid4()}', 'type': 'ecg', 'active': True})
+    assert response.status_code == 201
+    return response.get_json()['feature_id']
+
+
+def test_put_feature_is_update_and_changelog_insert(client, feature_id):
+    # UPDATE ... RETURNING and one change-log INSERT; the NOTIFY for other workers comes from a trigger
+    with count_queries() as counted:
+        response = client.put(f'{FEATURES}/{feature_id}/settings',
+                              json={'name': 'renamed', 'type': 'bp', 'active': True})
+        assert response.status_code == 200
+        assert counted() == 2
+    assert response.get_json()['name'] == 'renamed'
+
+
+def test_put_feature_notifies_other_workers_on_commit(client, feature_id):
+    listener = psycopg2.connect(database=db.database, **db.connect_params)
+    listener.autocommit = True
+    try:
+        listener.cursor().execute(f'LISTEN {FEATURE_CACHE_CHANNEL}')
+        response = client.put(f'{FEATURES}/{feature_id}/settings',
+                              json={'name': 'renamed', 'type': 'bp', 'active': True})
+        assert response.status_code == 200
+        assert select.select([listener], [], [], 5) != ([], [], [])
+        listener.poll()
+        assert [n.payload for n in listener.notifies] == [feature_id]
+    finally:
+        listener.close()
+
+
+def test_get_feature_is_one_select_then_cached(client, feature_id, monkeypatch):
+    invalidate_feature_cache()
+    # the NOTIFY of the fixture's insert reaches this process's own listener whenever it does
+    monkeypatch.setattr(feature, 'invalidate_feature_cache', lambda item_ids=None: None)
+    with count_queries() as counted:
+        response = client.get(f'{FEATURES}/{feature_id}')
+        assert response.status_code == 200
+        assert counted() == 1
+    with count_queries() as counted:
+        assert client.get(f'{FEATURES}/{feature_id}').status_code == 200
+        assert counted() == 0
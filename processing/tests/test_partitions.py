@@ -0,0 +1,64 @@
+"""Change log partitions created next to rows already in the default partition."""
+import uuid
+import threading
+from datetime import date, datetime, timezone
+import pytest
+from app.model.models import db, ChangeLog
+from app.model.partitions import (CHANGELOG_TABLE, CHANGELOG_DEFAULT_PARTITION, create_changelog_partition,
+                                  list_changelog_partitions)
+
+# far enough ahead that no maintenance run creates it
+MONTH = date(2999, 1, 1)
+PARTITION = f'{CHANGELOG_TABLE}_p299901'
+
+
+def _drop_partition():
+    db.execute_sql(f'DROP TABLE IF EXISTS "{PARTITION}"')
+
+
+def _tables_of(entity_id):
+    cursor = db.execute_sql(f'SELECT tableoid::regclass::text FROM "{CHANGELOG_TABLE}" WHERE entity_id = %s',
+                            (entity_id,))
+    return [row[0].strip('"') for row in cursor.fetchall()]
+
+
+@pytest.fixture
+def entity_id(app):
+    _drop_partition()
+    entity_id = uuid.uuid4()
+    ChangeLog.insert(entity_type='Feature', entity_id=entity_id, field_name='name', old_value=None,
+                     new_value='moved', changed_at=datetime(2999, 1, 15, tzinfo=timezone.utc),
+                     changed_by='tests').execute()
+    yield entity_id
+    ChangeLog.delete().where(ChangeLog.entity_id == entity_id).execute()
+    _drop_partition()
+
+
+def test_rows_move_out_of_the_default_partition(entity_id):
+    assert _tables_of(entity_id) == [CHANGELOG_DEFAULT_PARTITION]
+
+    create_changelog_partition(MONTH)
+
+    assert MONTH in list_changelog_partitions()
+    assert _tables_of(entity_id) == [PARTITION]
+
+
+def test_concurrent_creates_of_one_partition(entity_id):
+    errors = []
+
+    def create():
+        try:
+            create_changelog_partition(MONTH)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            db.close()
+
+    threads = [threading.Thread(target=create) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert _tables_of(entity_id) == [PARTITION]
@@ -0,0 +1,43 @@
+"""Compiled dumps give the same output as the marshmallow schemas they replace."""
+import uuid
+from datetime import datetime, timezone
+import pytest
+from app.api.serialization import compile_schema
+from app.api.setpoints.feature.schemas import FeatureResponseSchema, FeaturePageResponseSchema
+from app.api.changelog.schemas import ChangeLogPageResponseSchema
+
+FEATURE_ID = uuid.uuid4()
+
+FEATURES = [
+    {'id': FEATURE_ID, 'name': 'hr', 'description': None, 'type': 'ecg', 'priority': 'high',
+     'default_threshold': 1.5, 'active': True},
+    # values of the wrong type are dumped the way marshmallow does it
+    {'id': str(FEATURE_ID), 'name': 5, 'type': 'ecg', 'default_threshold': 2, 'active': 1},
+    {'id': FEATURE_ID, 'active': 0},
+    {'id': FEATURE_ID, 'active': 'yes'},
+    {},
+]
+
+
+@pytest.mark.parametrize('obj', FEATURES)
+def test_feature_dump(obj):
+    assert compile_schema(FeatureResponseSchema)(obj) == FeatureResponseSchema().dump(obj)
+
+
+def test_feature_list_dump():
+    schema = FeatureResponseSchema(many=True)
+    assert compile_schema(schema)(FEATURES) == schema.dump(FEATURES)
+
+
+def test_feature_page_dump():
+    page = {'items': FEATURES, 'next_cursor': None, 'total': '7'}
+    assert compile_schema(FeaturePageResponseSchema)(page) == FeaturePageResponseSchema().dump(page)
+
+
+def test_changelog_page_dump():
+    page = {'items': [{'id': 1, 'entity_type': 'Feature', 'entity_id': FEATURE_ID, 'field_name': 'active',
+                       'old_value': {'a': [1, None]}, 'new_value': None,
+                       'changed_at': datetime(2024, 5, 1, 12, 30, tzinfo=timezone.utc),
+                       'changed_by': 'tests', 'comment': None}],
+            'next_cursor': 'abc'}
+    assert compile_schema(ChangeLogPageResponseSchema)(page) == ChangeLogPageResponseSchema().dump(page)